@@ -1,8 +1,18 @@
 import polars as pl
+import numpy as np
 import os
 from typing import Literal
 import tempfile
 import matplotlib.pyplot as plt
+from FactorExposureStore import ExposureStore
+from FactorPanel import PanelIndex, cross_sectional_corr, cross_sectional_quantile_groups
+from FactorCodes import CodeDictionary, decode_codes, decode_exposure, align_codes, unify_codes
+
+# 进程内的日频量价面板缓存：源文件路径 -> (文件指纹, code类型, 面板)
+_DAILY_PV_CACHE = {}
+# 进程内的未来收益率缓存：保存路径 -> 未来收益率表
+_FORWARD_RETURN_CACHE = {}
+
 
 class Factor:
     def __init__(self, factor_name: str, factor_exposure: pl.DataFrame=None):
@@ -18,6 +28,215 @@ class Factor:
         self.rank_IC = None
         self.rank_ICIR = None
 
+    # 共享的股票代码字典，设置后日频与分钟频数据在读取时将code编码为字典的Enum，写入磁盘时解码为字符串；
+    # 可以对全部因子设置（Factor.code_dictionary = CodeDictionary()），也可以只对某个因子设置
+    code_dictionary: CodeDictionary = None
+    # 是否以float32在内存中保存因子暴露，写入磁盘时仍为float64
+    float32_exposure: bool = False
+
+    def _encode_codes(self, frames: list[pl.DataFrame]) -> list[pl.DataFrame]:
+        """
+        设置了代码字典时将多个因子暴露的code编码为同一Enum类型，合并前调用
+        :param frames: 因子暴露列表
+        :return:
+        """
+        if self.code_dictionary is None:
+            return frames
+        return self.code_dictionary.encode_all(frames)
+
+    def _compact_exposure(self, exposure: pl.DataFrame | None) -> pl.DataFrame | None:
+        """
+        按code_dictionary与float32_exposure转换因子暴露在内存中的类型
+        :param exposure: 因子暴露
+        :return:
+        """
+        if exposure is None:
+            return None
+        exposure = self._encode_codes([exposure])[0]
+        if self.float32_exposure and exposure.schema[self.factor_name] == pl.Float64:
+            exposure = exposure.with_columns(pl.col(self.factor_name).cast(pl.Float32))
+        return exposure
+
+    # 日频量价数据的原始列名与标准列名
+    DAILY_PV_COLUMNS = {
+        'Trddt': 'date',
+        'Stkcd': 'code',
+        'Opnprc': 'open',
+        'Hiprc': 'high',
+        'Loprc': 'low',
+        'Clsprc': 'close',
+        'Dnshrtrd': 'volume',
+        'Dnvaltrd': 'amount',
+        'ChangeRatio': 'pct_change',
+        'Dsmvosd': 'cmc',
+        'Dsmvtll': 'tmc',
+        'Adjprcwd': 'close_adjust',
+        'LimitDown': 'limit_down',
+        'LimitUp': 'limit_up'
+    }
+
+    @staticmethod
+    def _load_daily_pv_panel(
+            source_path: str = r'D:\QuantData\Price_Volume.parquet',
+            cache_dir: str = None
+    ) -> pl.DataFrame:
+        r"""
+        读取清洗后的日频量价面板，进程内只读取一次。
+        首次读取时将清洗结果（日期已解析、代码编码为整数）保存为Arrow IPC文件，
+        之后的进程以内存映射方式零拷贝读取；源文件变化时自动重建。
+        设置了Factor.code_dictionary时code解码为字典的Enum，否则为字符串
+        :param source_path: 日频量价数据的parquet文件
+        :param cache_dir: IPC文件的保存文件夹，默认为源文件所在文件夹下的cache
+        :return:
+        """
+        stat = os.stat(source_path)
+        tag = f'{stat.st_size}-{stat.st_mtime_ns}'
+        cached = _DAILY_PV_CACHE.get(source_path)
+        code_dtype = pl.String if Factor.code_dictionary is None else Factor.code_dictionary.dtype
+        if cached is not None and cached[0] == tag and cached[1] == code_dtype:
+            return cached[2]
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(source_path), 'cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        prefix = os.path.splitext(os.path.basename(source_path))[0]
+        panel_path = os.path.join(cache_dir, f'{prefix}-{tag}.arrow')
+        codes_path = os.path.join(cache_dir, f'{prefix}-{tag}-codes.arrow')
+
+        if not (os.path.exists(panel_path) and os.path.exists(codes_path)):
+            pv_data = (
+                pl.scan_parquet(source_path)
+                .with_columns(
+                    pl.col('Trddt')
+                    .str.to_date(format='%Y-%m-%d')
+                ).rename(Factor.DAILY_PV_COLUMNS)
+                .collect()
+            )
+            codes = pv_data.select(
+                pl.col('code').unique().sort()
+            )
+            pv_data = pv_data.with_columns(
+                pl.col('code')
+                .replace_strict(
+                    codes['code'], pl.int_range(codes.height, eager=True),
+                    return_dtype=pl.Int32
+                )
+            ).sort(by=['code', 'date'])
+            for data, path in [(pv_data, panel_path), (codes, codes_path)]:
+                with tempfile.NamedTemporaryFile(
+                        dir=cache_dir, delete=False, suffix='.tmp'
+                ) as tmp:
+                    temp_path = tmp.name
+                data.write_ipc(temp_path)
+                os.replace(temp_path, path)
+            for file_name in os.listdir(cache_dir):  # 删除源文件变化前的IPC文件
+                if file_name.startswith(f'{prefix}-') and tag not in file_name:
+                    os.remove(os.path.join(cache_dir, file_name))
+
+        panel = pl.read_ipc(panel_path)  # polars默认以内存映射方式读取未压缩的IPC文件
+        codes = pl.read_ipc(codes_path)['code']
+        if Factor.code_dictionary is not None:  # 先编码约5000个代码，再按序号取值，不生成字符串列
+            codes = Factor.code_dictionary.encode(codes.to_frame())['code']
+        panel = panel.with_columns(
+            codes.gather(panel['code']).alias('code')
+        )
+        _DAILY_PV_CACHE[source_path] = (tag, codes.dtype, panel)
+        return panel
+
+    # 默认预先计算的未来收益率期限
+    FORWARD_RETURN_HORIZONS = (1, 5, 10, 20)
+
+    @staticmethod
+    def _compute_forward_returns(pv_data: pl.DataFrame, horizons: list[int]) -> pl.DataFrame:
+        """
+        计算未来收益率：future_return_{h}为t+1至t+h日的累计收益率
+        :param pv_data: 日频量价数据，包含code/date/pct_change
+        :param horizons: 期限列表
+        :return: 包含code/date/future_return_{h}的DataFrame
+        """
+        log_return = (pl.col('pct_change') + 1).log()
+        return (
+            pv_data.lazy().sort(by=['code', 'date'])
+            .select(
+                pl.col('code'),
+                pl.col('date'),
+                *[
+                    (
+                        log_return
+                        .rolling_sum(horizon, min_samples=horizon)
+                        .exp() - 1
+                    )
+                    .shift(-horizon)
+                    .over('code')
+                    .alias(f'future_return_{horizon}')
+                    for horizon in horizons
+                ]
+            ).collect()
+        )
+
+    @staticmethod
+    def _read_forward_returns(
+            horizons: list[int] = None,
+            cache_path: str = r'D:\QuantData\cache\Forward_Return.arrow'
+    ) -> pl.DataFrame:
+        """
+        读取多期限未来收益率表，所有因子共用。
+        日频数据新增日期时只重新计算每只股票最后max(horizons)行及新增行，
+        未来收益率只依赖之后的数据，因此更早的行无需重新计算。
+        :param horizons: 需要的期限，与FORWARD_RETURN_HORIZONS合并
+        :param cache_path: 未来收益率表的IPC文件路径
+        :return: 包含code/date/future_return_{h}的DataFrame
+        """
+        horizons = sorted(set(Factor.FORWARD_RETURN_HORIZONS) | set(horizons or ()))
+        columns = [f'future_return_{horizon}' for horizon in horizons]
+        pv_data = Factor._read_daily_pv_data(['code', 'date', 'pct_change'])
+        latest_date = pv_data['date'].max()
+
+        forward_returns = _FORWARD_RETURN_CACHE.get(cache_path)
+        if forward_returns is None and os.path.exists(cache_path):
+            forward_returns = pl.read_ipc(cache_path)
+        if forward_returns is not None:  # code类型与日频数据一致
+            forward_returns = align_codes(forward_returns, pv_data.schema['code'])
+            if not set(columns).issubset(forward_returns.columns):  # 新的期限需要全部重新计算
+                horizons = sorted(
+                    set(horizons)
+                    | {int(c.removeprefix('future_return_')) for c in forward_returns.columns[2:]}
+                )
+                forward_returns = None
+            elif forward_returns['date'].max() == latest_date:
+                _FORWARD_RETURN_CACHE[cache_path] = forward_returns
+                return forward_returns.select('code', 'date', *columns)
+            elif (
+                    pv_data.filter(pl.col('date') <= forward_returns['date'].max()).height
+                    != forward_returns.height
+            ):  # 历史数据发生变化
+                forward_returns = None
+
+        if forward_returns is None:
+            forward_returns = Factor._compute_forward_returns(pv_data, horizons)
+        else:
+            horizons = [int(c.removeprefix('future_return_')) for c in forward_returns.columns[2:]]
+            keep = forward_returns.sort(by=['code', 'date']).filter(
+                pl.int_range(pl.len()).reverse().over('code') >= max(horizons)
+            )
+            update = Factor._compute_forward_returns(
+                pv_data.join(keep.select('code', 'date'), on=['code', 'date'], how='anti'),
+                horizons
+            )
+            forward_returns = pl.concat([keep, update], how='vertical')
+
+        forward_returns = forward_returns.sort(by=['code', 'date'])
+        cache_dir = os.path.dirname(cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                dir=cache_dir, delete=False, suffix='.tmp'
+        ) as tmp:
+            temp_path = tmp.name
+        decode_codes(forward_returns).write_ipc(temp_path)
+        os.replace(temp_path, cache_path)
+        _FORWARD_RETURN_CACHE[cache_path] = forward_returns
+        return forward_returns.select('code', 'date', *columns)
+
     @staticmethod
     def _read_daily_pv_data(column_need: str|list[str]=None) -> pl.DataFrame:
         """
@@ -29,36 +248,16 @@ class Factor:
         :param column_need: 需要的列
         :return:
         """
-        column_dict = {
-            'Trddt': 'date',
-            'Stkcd': 'code',
-            'Opnprc': 'open',
-            'Hiprc': 'high',
-            'Loprc': 'low',
-            'Clsprc': 'close',
-            'Dnshrtrd': 'volume',
-            'Dnvaltrd': 'amount',
-            'ChangeRatio': 'pct_change',
-            'Dsmvosd': 'cmc',
-            'Dsmvtll': 'tmc',
-            'Adjprcwd': 'close_adjust',
-            'LimitDown': 'limit_down',
-            'LimitUp': 'limit_up'
-        }
-        pv_data = (
-            pl.scan_parquet(r'D:\QuantData\Price_Volume.parquet')
-            .with_columns(
-                pl.col('Trddt')
-                .str.to_date(format='%Y-%m-%d')
-            ).rename(column_dict)
-        )
+        pv_data = Factor._load_daily_pv_panel()
         if column_need is None:
-            column_need = column_dict.keys()
+            column_need = Factor.DAILY_PV_COLUMNS.values()
+        elif isinstance(column_need, str):
+            column_need = [column_need]
         pv_data = pv_data.select(
             pl.col(column)
             for column in column_need
-            if column in pv_data.collect_schema().names()
-        ).collect()
+            if column in pv_data.columns
+        )
         return pv_data
 
     def to_parquet(self, path: str=None):
@@ -78,7 +277,7 @@ class Factor:
             temp_path = tmp.name
 
         try:
-            self.factor_exposure.write_parquet(temp_path)
+            decode_exposure(self.factor_exposure).write_parquet(temp_path)
             # 替换原文件
             if os.path.exists(path):
                 os.remove(path)
@@ -89,20 +288,42 @@ class Factor:
                 os.remove(temp_path)
             raise e
 
-    def coverage(self, plot_out=True, return_df=False) -> pl.DataFrame | None:
+    def to_store(self, store: ExposureStore = None) -> int:
+        r"""
+        将因子暴露追加至按年月分区的存储，只写入晚于已保存最新日期的数据，不重写历史数据。
+        :param store: 分区存储，默认根目录为'D:\QuantData\MinuteFreqFactor\store'
+        :return: 追加的行数
+        """
+        if store is None:
+            store = ExposureStore()
+        return store.append(self.factor_name, self.factor_exposure)
+
+    def coverage(
+            self, plot_out=True, return_df=False, engine: Literal['polars', 'panel'] = 'polars'
+    ) -> pl.DataFrame | None:
         """
         计算因子覆盖度
         :param plot_out: 是否输出每日因子暴露有效数量图，默认为False
         :param return_df: 是否返回包含每日因子暴露有效数量的DataFrame，默认为False
+        :param engine: 'polars'使用长表分组，'panel'统计日期×股票矩阵每行的有效值个数，结果相同
         :return:
         """
-        coverage = (
-            self.factor_exposure.filter(
-                ~pl.col(self.factor_name).is_nan()
-            ).group_by('date').agg(
-                pl.col(self.factor_name).count()
-            ).sort(by='date')
-        )
+        if engine == 'panel':
+            index = PanelIndex.from_frames(self.factor_exposure)
+            coverage = pl.DataFrame({
+                'date': index.dates,
+                self.factor_name: (~np.isnan(self.to_panel(index))).sum(axis=1),
+            }, schema_overrides={self.factor_name: pl.UInt32}).filter(pl.col(self.factor_name) > 0)
+        elif engine == 'polars':
+            coverage = (
+                self.factor_exposure.filter(
+                    ~pl.col(self.factor_name).is_nan()
+                ).group_by('date').agg(
+                    pl.col(self.factor_name).count()
+                ).sort(by='date')
+            )
+        else:
+            raise ValueError(f'Unknown engine: {engine}')
         if plot_out:
             color = 'tab:blue'
             plt.figure(figsize=(12, 8))
@@ -140,26 +361,15 @@ class Factor:
         :return:
         """
         pv_data = (
-            self._read_daily_pv_data(['code', 'date', 'pct_change'])
-            .lazy().sort(by=['code', 'date'])
-            .with_columns(
-                (
-                    (pl.col('pct_change') + 1)
-                    .log()
-                    .rolling_sum(future_days, min_samples=future_days)
-                    .over('code')
-                    .exp() - 1
-                )
-                .alias('rolling_change')
-            ).select(
+            self._read_forward_returns([future_days])
+            .select(
                 pl.col('code'),
                 pl.col('date'),
-                pl.col('rolling_change')
-                .shift(-future_days)
-                .over('code')
+                pl.col(f'future_return_{future_days}')
                 .alias('future_return')
-            ).collect()
+            )
         )
+        pv_data = align_codes(pv_data, self.factor_exposure.schema['code'])
         ic_df = (
             pl.concat(
                 items=[
@@ -228,13 +438,233 @@ class Factor:
             return ic_df
         return None
 
+    def to_panel(self, index: PanelIndex) -> np.ndarray:
+        """
+        因子暴露转为日期×股票的float32矩阵
+        :param index: 面板索引，与收益率等矩阵共用
+        :return:
+        """
+        return index.to_matrix(self.factor_exposure, self.factor_name)
+
+    @staticmethod
+    def _panel_ic(
+            factors: list['Factor'],
+            future_days: list[int],
+            forward_returns: pl.DataFrame
+    ) -> pl.DataFrame:
+        """
+        在日期×股票矩阵上计算每日IC与rank_IC，收益率矩阵每个期限只转换一次
+        :param factors: 因子列表
+        :param future_days: 期限列表
+        :param forward_returns: 未来收益率表
+        :return: 包含date/factor/future_days/IC/rank_IC的DataFrame
+        """
+        index = PanelIndex.from_frames(*[factor.factor_exposure for factor in factors])
+        return_panels = {
+            horizon: index.to_matrix(forward_returns, f'future_return_{horizon}')
+            for horizon in future_days
+        }
+        ic_frames = []
+        for factor in factors:
+            exposure_panel = factor.to_panel(index)
+            for horizon, return_panel in return_panels.items():
+                ic_frames.append(pl.DataFrame({
+                    'date': index.dates,
+                    'factor': [factor.factor_name] * len(index.dates),
+                    'future_days': [horizon] * len(index.dates),
+                    'IC': cross_sectional_corr(exposure_panel, return_panel, 'pearson'),
+                    'rank_IC': cross_sectional_corr(exposure_panel, return_panel, 'spearman'),
+                }, schema_overrides={'future_days': pl.Int32}))
+        return pl.concat(ic_frames, how='vertical')
+
+    @staticmethod
+    def batch_ic_test(
+            factors: list['Factor'],
+            future_days: int | list[int] = 5,
+            return_daily: bool = False,
+            engine: Literal['polars', 'panel'] = 'polars'
+    ) -> pl.DataFrame | tuple[pl.DataFrame, pl.DataFrame]:
+        """
+        多因子批量IC与rank_IC测试：全部因子暴露与未来收益率只连接一次，
+        在同一次按日分组中计算所有因子与所有期限的IC
+        :param factors: 因子列表
+        :param future_days: 与未来多少天的收益计算相关系数，可以为多个期限
+        :param return_daily: 是否同时返回每日IC与rank_IC，默认为False
+        :param engine: 'polars'使用长表连接与分组，'panel'使用日期×股票矩阵按截面计算
+        :return: 汇总表，每个因子×期限一行：factor/future_days/IC/ICIR/rank_IC/rank_ICIR；
+            return_daily为True时返回(汇总表, 每日IC表)
+        """
+        if isinstance(future_days, int):
+            future_days = [future_days]
+        forward_returns = Factor._read_forward_returns(future_days)
+        if engine == 'panel':
+            ic_df = Factor._panel_ic(factors, future_days, forward_returns)
+        elif engine == 'polars':
+            ic_df = Factor._polars_ic(factors, future_days, forward_returns)
+        else:
+            raise ValueError(f'Unknown engine: {engine}')
+        ic_df = ic_df.filter(
+            (~pl.col('IC').is_null()) & (~pl.col('IC').is_nan())
+        ).sort(by=['factor', 'future_days', 'date'])
+        summary = (
+            ic_df.group_by(['factor', 'future_days'], maintain_order=True).agg(
+                pl.col('IC').mean(),
+                (pl.col('IC').mean() / pl.col('IC').std()).alias('ICIR'),
+                pl.col('rank_IC').mean(),
+                (pl.col('rank_IC').mean() / pl.col('rank_IC').std()).alias('rank_ICIR'),
+            ).select('factor', 'future_days', 'IC', 'ICIR', 'rank_IC', 'rank_ICIR')
+        )
+        if len(future_days) == 1:  # 单一期限时与ic_test一样记录在因子上
+            for factor in factors:
+                row = summary.filter(pl.col('factor') == factor.factor_name)
+                if row.height > 0:
+                    factor.IC, factor.ICIR, factor.rank_IC, factor.rank_ICIR = (
+                        row.select('IC', 'ICIR', 'rank_IC', 'rank_ICIR').row(0)
+                    )
+        if return_daily:
+            return summary, ic_df
+        return summary
+
+    @staticmethod
+    def _polars_ic(
+            factors: list['Factor'],
+            future_days: list[int],
+            forward_returns: pl.DataFrame
+    ) -> pl.DataFrame:
+        """
+        全部因子暴露与未来收益率连接一次，在同一次按日分组中计算每日IC与rank_IC
+        :param factors: 因子列表
+        :param future_days: 期限列表
+        :param forward_returns: 未来收益率表
+        :return: 包含date/factor/future_days/IC/rank_IC的DataFrame
+        """
+        factor_names = [factor.factor_name for factor in factors]
+        # NaN转为空值，相关系数按对剔除空值，与逐个因子剔除NaN一致
+        exposure = pl.concat(
+            unify_codes([
+                factor.factor_exposure.select(
+                    pl.col('code'),
+                    pl.col('date'),
+                    pl.col(factor.factor_name).fill_nan(None)
+                )
+                for factor in factors
+            ]), how='align_full'
+        )
+        ic_wide = (
+            exposure.lazy()
+            .join(
+                align_codes(forward_returns, exposure.schema['code']).lazy(),
+                on=['code', 'date'], how='left'
+            )
+            .group_by('date').agg(
+                *[
+                    pl.corr(
+                        pl.col(factor_name),
+                        pl.col(f'future_return_{horizon}'),
+                        method=method
+                    ).alias(f'{factor_name}|{horizon}|{label}')
+                    for factor_name in factor_names
+                    for horizon in future_days
+                    for method, label in [('pearson', 'IC'), ('spearman', 'rank_IC')]
+                ]
+            ).collect()
+        )
+        return pl.concat(
+            [
+                ic_wide.select(
+                    pl.col('date'),
+                    pl.lit(factor_name).alias('factor'),
+                    pl.lit(horizon, dtype=pl.Int32).alias('future_days'),
+                    pl.col(f'{factor_name}|{horizon}|IC').alias('IC'),
+                    pl.col(f'{factor_name}|{horizon}|rank_IC').alias('rank_IC'),
+                )
+                for factor_name in factor_names
+                for horizon in future_days
+            ], how='vertical'
+        )
+
+    def _panel_group_returns(
+            self,
+            pv_data: pl.DataFrame,
+            group_param: str,
+            weight_param: Literal['tmc', 'cmc', None],
+            group_num: int
+    ) -> pl.DataFrame:
+        """
+        在日期×股票矩阵上计算分组收益：每日按截面分位数分组，调仓期内累乘日收益，
+        使用股票上一个有数据的调仓期末的分组与市值，按组等权或市值加权
+        :param pv_data: 日频量价数据，包含code/date/pct_change/tmc/cmc
+        :param group_param: 调仓周期，如'1mo'
+        :param weight_param: 加权方式，包括总市值tmc、流通市值cmc和等权
+        :param group_num: 分组数量
+        :return: 包含date/group/pct_change的DataFrame
+        """
+        index = PanelIndex.from_frames(self.factor_exposure)
+        present = ~np.isnan(index.to_matrix(
+            self.factor_exposure.select('code', 'date', pl.lit(1.0).alias('present')), 'present'
+        ))
+        daily_group = cross_sectional_quantile_groups(
+            index.to_matrix(self.factor_exposure, self.factor_name, np.float64), group_num
+        )
+        pct_change = index.to_matrix(pv_data, 'pct_change', np.float64)
+
+        # 调仓期以区间右端点标记；交易日有序，同一调仓期的行连续
+        period_end = index.dates.dt.truncate(group_param).dt.offset_by(group_param)
+        starts = np.flatnonzero(period_end.is_first_distinct().to_numpy())
+        growth = np.multiply.reduceat(
+            np.where(present & ~np.isnan(pct_change), pct_change + 1, 1.0), starts, axis=0
+        ) - 1
+        # 每个调仓期最后一个有因子暴露的交易日，没有时为-1
+        last_row = np.maximum.reduceat(
+            np.where(present, np.arange(len(index.dates))[:, None], -1), starts, axis=0
+        )
+        # 股票之前最近一个有数据的调仓期的最后一个交易日
+        period_ordinal = np.where(last_row >= 0, np.arange(len(starts))[:, None], -1)
+        previous = np.full(period_ordinal.shape, -1)
+        previous[1:] = np.maximum.accumulate(period_ordinal, axis=0)[:-1]
+        previous_row = np.where(
+            previous >= 0, np.take_along_axis(last_row, np.maximum(previous, 0), axis=0), -1
+        )
+        code_ordinal = np.arange(len(index.codes))
+        group = np.where(previous_row >= 0, daily_group[previous_row, code_ordinal], -1)
+        if weight_param is None:
+            weight = np.ones(group.shape)
+        else:
+            weight = index.to_matrix(pv_data, weight_param, np.float64)[previous_row, code_ordinal]
+            weight = np.where((previous_row >= 0) & ~np.isnan(weight), weight, 0.0)
+
+        labels = [f'group_{i + 1}' for i in range(group_num)]
+        group_frames = []
+        for group_ordinal, label in enumerate(labels):
+            member = (last_row >= 0) & (group == group_ordinal)
+            member_weight = np.where(member, weight, 0.0)
+            total_weight = member_weight.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                value = np.where(
+                    total_weight != 0,
+                    (member_weight * np.where(member, growth, 0.0)).sum(axis=1) / total_weight,
+                    0.0
+                )
+            keep = member.any(axis=1)
+            group_frames.append(pl.DataFrame({
+                'date': period_end.gather(starts[keep]),
+                'group': [label] * int(keep.sum()),
+                'pct_change': value[keep],
+            }))
+        return (
+            pl.concat(group_frames)
+            .with_columns(pl.col('group').cast(pl.Categorical))
+            .sort(by=['date', 'group'])
+        )
+
     def group_test(
             self,
             frequency: Literal['weekly', 'monthly', 'quarterly', 'yearly'] = 'monthly',
             weight_param: Literal['tmc', 'cmc', None] = None,
             group_num: int = 5,
             plot_out: bool = True,
-            return_df: bool = False
+            return_df: bool = False,
+            engine: Literal['polars', 'panel'] = 'polars'
     ) -> pl.DataFrame | None:
         """
         因子分组测试
@@ -243,6 +673,7 @@ class Factor:
         :param group_num: 分组数量，默认为5
         :param plot_out: 是否输出分组收益图，默认为True
         :param return_df: 是否输出DataFrame，默认为False
+        :param engine: 'polars'使用长表连接与分组，'panel'使用日期×股票矩阵按截面分组、按调仓期累乘收益，结果相同
         :return:
         """
         if frequency == 'weekly':
@@ -253,8 +684,9 @@ class Factor:
             group_param = '1q'
         elif frequency == 'yearly':
             group_param = '1y'
-        pv_data = (
-            self._read_daily_pv_data(['code', 'date', 'pct_change', 'tmc', 'cmc'])
+        pv_data = align_codes(
+            self._read_daily_pv_data(['code', 'date', 'pct_change', 'tmc', 'cmc']),
+            self.factor_exposure.schema['code']
         )
         if weight_param is None:
             expr = (
@@ -277,48 +709,53 @@ class Factor:
                 ((pl.col('pct_change') * pl.col('cmc')).sum() / pl.col('cmc').sum())
                 .alias('pct_change')
             ).otherwise(0)
-        group_df = (
-            pl.concat(
-                [self.factor_exposure, pv_data],
-                how='align_left'
-            ).lazy().with_columns(
-                pl.col(self.factor_name)
-                .qcut(
-                    group_num,
-                    labels=[f"group_{i+1}" for i in range(group_num)],
-                    allow_duplicates=True
-                )
-                .over('date')
-                .alias('group')
-            ).group_by_dynamic(
-                'date', every=group_param, label='right', group_by='code'
-            ).agg(
-                (
+        if engine == 'panel':
+            group_df = self._panel_group_returns(pv_data, group_param, weight_param, group_num)
+        elif engine == 'polars':
+            group_df = (
+                pl.concat(
+                    [self.factor_exposure, pv_data],
+                    how='align_left'
+                ).lazy().with_columns(
+                    pl.col(self.factor_name)
+                    .qcut(
+                        group_num,
+                        labels=[f"group_{i+1}" for i in range(group_num)],
+                        allow_duplicates=True
+                    )
+                    .over('date')
+                    .alias('group')
+                ).group_by_dynamic(
+                    'date', every=group_param, label='right', group_by='code'
+                ).agg(
                     (
-                        pl.col('pct_change') + 1
-                    ).product() - 1
-                ).alias('pct_change'),
-                pl.col('group').last(),
-                pl.col('tmc').last(),
-                pl.col('cmc').last()
-            ).sort(by=['date', 'group'])
-            .with_columns(
-                pl.col('group')
-                .shift(1)
-                .over('code'),
-                pl.col('tmc')
-                .shift(1)
-                .over('code'),
-                pl.col('cmc')
-                .shift(1)
-                .over('code')
-            ).filter(
-                ~pl.col('group').is_null()
-            ).group_by(['date', 'group']).agg(
-                expr
-            ).sort(by=['date', 'group'])
-            .collect()
-        )
+                        (
+                            pl.col('pct_change') + 1
+                        ).product() - 1
+                    ).alias('pct_change'),
+                    pl.col('group').last(),
+                    pl.col('tmc').last(),
+                    pl.col('cmc').last()
+                ).sort(by=['date', 'group'])
+                .with_columns(
+                    pl.col('group')
+                    .shift(1)
+                    .over('code'),
+                    pl.col('tmc')
+                    .shift(1)
+                    .over('code'),
+                    pl.col('cmc')
+                    .shift(1)
+                    .over('code')
+                ).filter(
+                    ~pl.col('group').is_null()
+                ).group_by(['date', 'group']).agg(
+                    expr
+                ).sort(by=['date', 'group'])
+                .collect()
+            )
+        else:
+            raise ValueError(f'Unknown engine: {engine}')
         if plot_out:  # 输出图
             plt.figure(figsize=(12, 8))
             for group in group_df['group'].unique().sort():
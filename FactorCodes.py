@@ -0,0 +1,192 @@
+import os
+import tempfile
+import polars as pl
+from typing import Iterable
+
+
+class CodeDictionary:
+    def __init__(self, path: str = None):
+        r"""
+        共享的股票代码字典：全部代码按字符串顺序作为pl.Enum的类别，code列编码为Enum后按整数序号存储，
+        分组与连接按整数哈希，比字符串更快、更省内存，按code排序的结果与字符串一致。
+        字典只增不减并保存在磁盘上供之后的运行共用；新增代码后Enum类型随之变化，之前编码的数据需重新encode。
+        写入磁盘的因子暴露、缓存与检查点统一解码为字符串（见decode_exposure），与是否使用字典无关
+        :param path: 字典文件，默认为'D:\QuantData\cache\codes.parquet'
+        """
+        if path is None:
+            path = r'D:\QuantData\cache\codes.parquet'
+        self.path = path
+        self._codes = None
+        self._dtype = None
+
+    @property
+    def codes(self) -> pl.Series:
+        """
+        字典中的全部代码，按字符串排序
+        """
+        if self._codes is None:
+            if os.path.exists(self.path):
+                self._codes = pl.read_parquet(self.path)['code']
+            else:
+                self._codes = pl.Series('code', [], dtype=pl.String)
+        return self._codes
+
+    @property
+    def dtype(self) -> pl.Enum:
+        """
+        code列编码后的类型
+        """
+        if self._dtype is None:
+            self._dtype = pl.Enum(self.codes)
+        return self._dtype
+
+    def extend(self, codes: pl.Series | Iterable[str]) -> bool:
+        """
+        加入新代码，有新代码时先写入临时文件再原子替换字典文件
+        :param codes: 代码，可以为String或Enum/Categorical的Series
+        :return: 是否加入了新代码
+        """
+        if not isinstance(codes, pl.Series):
+            codes = pl.Series('code', list(codes), dtype=pl.String)
+        elif isinstance(codes.dtype, pl.Enum):
+            codes = codes.dtype.categories
+        codes = codes.cast(pl.String).drop_nulls().unique()
+        new_codes = codes.filter(~codes.is_in(self.codes.implode()))
+        if new_codes.len() == 0:
+            return False
+        self._codes = pl.concat([self.codes, new_codes.alias('code')]).sort()
+        self._dtype = None
+        directory = os.path.dirname(self.path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory or None, delete=False, suffix='.tmp') as tmp:
+            temp_path = tmp.name
+        try:
+            self._codes.to_frame().write_parquet(temp_path)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise e
+        return True
+
+    def extend_from_files(self, file_paths: list[str], column: str = 'code') -> bool:
+        """
+        加入parquet文件中出现的全部代码，只读取code列
+        :param file_paths: parquet文件路径
+        :param column: 代码所在的列
+        :return: 是否加入了新代码
+        """
+        if len(file_paths) == 0:
+            return False
+        return self.extend(
+            pl.scan_parquet(file_paths).select(pl.col(column).unique())
+            .collect(engine='streaming')[column]
+        )
+
+    def encode_all(self, frames: list[pl.DataFrame], column: str = 'code') -> list[pl.DataFrame]:
+        """
+        将多个DataFrame的code列编码为当前字典的Enum，先一次性加入全部新代码，编码后的类型相同，可以直接合并
+        :param frames: DataFrame列表，code列可以为String或其他类别的Enum
+        :param column: 代码所在的列
+        :return:
+        """
+        pending = [frame for frame in frames if frame.schema[column] != self.dtype]
+        if len(pending) == 0:
+            return frames
+        self.extend(pl.concat([
+            frame[column].dtype.categories if isinstance(frame.schema[column], pl.Enum)
+            else frame[column].cast(pl.String).unique()
+            for frame in pending
+        ]))
+        dtype = self.dtype
+        return [
+            frame if frame.schema[column] == dtype
+            else frame.with_columns(pl.col(column).cast(dtype))
+            for frame in frames
+        ]
+
+    def encode(
+            self, frame: pl.DataFrame | pl.LazyFrame, column: str = 'code'
+    ) -> pl.DataFrame | pl.LazyFrame:
+        """
+        将code列编码为当前字典的Enum。DataFrame中的新代码先加入字典；
+        LazyFrame无法预先取得代码，不在字典中的代码在collect时报错，需先调用extend或extend_from_files
+        :param frame: DataFrame或LazyFrame
+        :param column: 代码所在的列
+        :return:
+        """
+        if isinstance(frame, pl.LazyFrame):
+            return frame.with_columns(pl.col(column).cast(self.dtype))
+        return self.encode_all([frame], column)[0]
+
+
+def encode_codes(codes: pl.Series, dtype: pl.Enum) -> pl.Series:
+    """
+    在工作进程中按共享字典编码一个文件的代码；文件中有字典之外的新代码时改用字典与本文件代码并集的Enum，
+    父进程合并结果时由CodeDictionary.encode_all加入新代码
+    :param codes: String类型的代码
+    :param dtype: 共享字典的Enum类型
+    :return:
+    """
+    encoded = codes.cast(dtype, strict=False)
+    if encoded.null_count() == codes.null_count():
+        return encoded
+    categories = pl.concat([dtype.categories, codes.drop_nulls().unique()]).unique().sort()
+    return codes.cast(pl.Enum(categories))
+
+
+def decode_codes(
+        frame: pl.DataFrame | pl.LazyFrame, column: str = 'code'
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    将Enum/Categorical编码的code列解码为字符串，其他类型不变
+    :param frame: DataFrame或LazyFrame
+    :param column: 代码所在的列
+    :return:
+    """
+    dtype = frame.collect_schema()[column]
+    if isinstance(dtype, (pl.Enum, pl.Categorical)):
+        return frame.with_columns(pl.col(column).cast(pl.String))
+    return frame
+
+
+def decode_exposure(exposure: pl.DataFrame) -> pl.DataFrame:
+    """
+    写入磁盘前将因子暴露转为统一的类型：code为字符串，Float32为Float64，
+    不同设置下写入的文件可以直接合并读取
+    :param exposure: 因子暴露
+    :return:
+    """
+    exposure = decode_codes(exposure)
+    float32_columns = [name for name, dtype in exposure.schema.items() if dtype == pl.Float32]
+    if len(float32_columns) > 0:
+        exposure = exposure.with_columns(pl.col(float32_columns).cast(pl.Float64))
+    return exposure
+
+
+def align_codes(
+        frame: pl.DataFrame | pl.LazyFrame, dtype: pl.DataType, column: str = 'code'
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    将code列转为与连接对象相同的类型；转为Enum时不在类别中的代码为空值，这些代码本来也无法连接上
+    :param frame: DataFrame或LazyFrame
+    :param dtype: 连接对象的code类型
+    :param column: 代码所在的列
+    :return:
+    """
+    if frame.collect_schema()[column] == dtype:
+        return frame
+    return frame.with_columns(pl.col(column).cast(dtype, strict=False))
+
+
+def unify_codes(frames: list[pl.DataFrame], column: str = 'code') -> list[pl.DataFrame]:
+    """
+    多个DataFrame的code类型相同时保持不变，否则全部解码为字符串
+    :param frames: DataFrame列表
+    :param column: 代码所在的列
+    :return:
+    """
+    if len({frame.schema[column] for frame in frames}) <= 1:
+        return frames
+    return [decode_codes(frame, column) for frame in frames]
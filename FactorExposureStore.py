@@ -0,0 +1,157 @@
+import os
+import json
+import datetime
+import tempfile
+import polars as pl
+from typing import Optional
+from FactorCodes import decode_exposure
+
+
+class ExposureStore:
+    def __init__(self, root: str = None):
+        r"""
+        按年/月分区保存因子暴露：root/因子名/year=YYYY/month=MM/part-起始日-结束日.parquet。
+        追加新日期时只写入新的分区文件，不重写历史数据；
+        每个因子的_manifest.json记录分区文件与最新日期，读取最新日期无需扫描数据。
+        :param root: 保存的根目录，默认为'D:\QuantData\MinuteFreqFactor\store'
+        """
+        if root is None:
+            root = r'D:\QuantData\MinuteFreqFactor\store'
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+
+    def _manifest_path(self, factor_name: str) -> str:
+        return os.path.join(self.root, factor_name, '_manifest.json')
+
+    def read_manifest(self, factor_name: str) -> dict:
+        """
+        读取因子的manifest，不存在时返回空manifest
+        :param factor_name: 因子名
+        :return: {'latest_date': 'YYYY-MM-DD'|None, 'rows': int, 'parts': [{'path', 'start', 'end', 'rows'}]}
+        """
+        path = self._manifest_path(factor_name)
+        if not os.path.exists(path):
+            return {'latest_date': None, 'rows': 0, 'parts': []}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, factor_name: str, manifest: dict):
+        factor_dir = os.path.join(self.root, factor_name)
+        with tempfile.NamedTemporaryFile(
+                mode='w', dir=factor_dir, delete=False, suffix='.tmp', encoding='utf-8'
+        ) as tmp:
+            json.dump(manifest, tmp, indent=2)
+            temp_path = tmp.name
+        os.replace(temp_path, self._manifest_path(factor_name))
+
+    def latest_date(self, factor_name: str) -> Optional[datetime.date | None]:
+        """
+        已保存的最新日期，没有数据时返回None
+        :param factor_name: 因子名
+        :return:
+        """
+        latest_date = self.read_manifest(factor_name)['latest_date']
+        if latest_date is None:
+            return None
+        return datetime.date.fromisoformat(latest_date)
+
+    def append(self, factor_name: str, exposure: pl.DataFrame) -> int:
+        """
+        追加因子暴露，只写入晚于已保存最新日期的数据。
+        分区文件先写入临时文件再原子替换，最后更新manifest；中途失败时未登记的文件不会被读取。
+        分区文件中code统一为字符串、因子值为float64，与读取时的编码设置无关
+        :param factor_name: 因子名
+        :param exposure: 因子暴露，包含code/date/因子列
+        :return: 追加的行数
+        """
+        manifest = self.read_manifest(factor_name)
+        latest_date = self.latest_date(factor_name)
+        if latest_date is not None:
+            exposure = exposure.filter(pl.col('date') > latest_date)
+        if exposure.height == 0:
+            return 0
+
+        factor_dir = os.path.join(self.root, factor_name)
+        exposure = decode_exposure(exposure).sort(['date', 'code'])
+        for (year, month), partition in exposure.group_by(
+                pl.col('date').dt.year().alias('year'),
+                pl.col('date').dt.month().alias('month'),
+                maintain_order=True
+        ):
+            start = partition['date'].min()
+            end = partition['date'].max()
+            partition_dir = os.path.join(factor_dir, f'year={year}', f'month={month:02d}')
+            os.makedirs(partition_dir, exist_ok=True)
+            relative_path = os.path.join(
+                f'year={year}', f'month={month:02d}',
+                f'part-{start:%Y%m%d}-{end:%Y%m%d}.parquet'
+            )
+            with tempfile.NamedTemporaryFile(
+                    dir=partition_dir, delete=False, suffix='.tmp'
+            ) as tmp:
+                temp_path = tmp.name
+            try:
+                partition.write_parquet(temp_path)
+                os.replace(temp_path, os.path.join(factor_dir, relative_path))
+            except Exception as e:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise e
+            manifest['parts'].append({
+                'path': relative_path,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'rows': partition.height
+            })
+
+        manifest['latest_date'] = exposure['date'].max().isoformat()
+        manifest['rows'] += exposure.height
+        self._write_manifest(factor_name, manifest)
+        return exposure.height
+
+    def scan(
+            self,
+            factor_name: str,
+            start_date: datetime.date = None,
+            end_date: datetime.date = None
+    ) -> Optional[pl.LazyFrame | None]:
+        """
+        惰性读取因子暴露，按manifest中各分区文件的日期范围跳过无关文件
+        :param factor_name: 因子名
+        :param start_date: 起始日期（包含）
+        :param end_date: 结束日期（包含）
+        :return: 没有数据时返回None
+        """
+        parts = self.read_manifest(factor_name)['parts']
+        if start_date is not None:
+            parts = [p for p in parts if p['end'] >= start_date.isoformat()]
+        if end_date is not None:
+            parts = [p for p in parts if p['start'] <= end_date.isoformat()]
+        if len(parts) == 0:
+            return None
+        exposure = pl.scan_parquet(
+            [os.path.join(self.root, factor_name, p['path']) for p in parts]
+        )
+        if start_date is not None:
+            exposure = exposure.filter(pl.col('date') >= start_date)
+        if end_date is not None:
+            exposure = exposure.filter(pl.col('date') <= end_date)
+        return exposure
+
+    def read(
+            self,
+            factor_name: str,
+            start_date: datetime.date = None,
+            end_date: datetime.date = None
+    ) -> Optional[pl.DataFrame | None]:
+        """
+        读取因子暴露
+        :param factor_name: 因子名
+        :param start_date: 起始日期（包含）
+        :param end_date: 结束日期（包含）
+        :return: 没有数据时返回None
+        """
+        exposure = self.scan(factor_name, start_date, end_date)
+        if exposure is None:
+            return None
+        return exposure.sort(['date', 'code']).collect()
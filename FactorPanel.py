@@ -0,0 +1,153 @@
+import warnings
+import numpy as np
+import polars as pl
+from FactorCodes import align_codes, unify_codes
+
+
+class PanelIndex:
+    def __init__(self, codes: pl.Series, dates: pl.Series):
+        """
+        日期×股票面板的公共索引：股票代码与交易日到序号的字典，
+        同一索引下转换的因子暴露与收益率矩阵可以直接逐元素对齐
+        :param codes: 股票代码，按序号排列
+        :param dates: 交易日，按序号排列
+        """
+        self.codes = codes.alias('code')
+        self.dates = dates.alias('date')
+        self._code_ordinal = pl.DataFrame({
+            'code': self.codes,
+            'code_ordinal': np.arange(len(self.codes), dtype=np.int32)
+        })
+        self._date_ordinal = pl.DataFrame({
+            'date': self.dates,
+            'date_ordinal': np.arange(len(self.dates), dtype=np.int32)
+        })
+
+    @classmethod
+    def from_frames(cls, *frames: pl.DataFrame) -> 'PanelIndex':
+        """
+        由多个长表的code/date并集构建索引，各表的code类型不同时按字符串构建
+        :param frames: 包含code/date的DataFrame
+        :return:
+        """
+        codes = pl.concat([frame['code'] for frame in unify_codes(list(frames))]).unique().sort()
+        dates = pl.concat([frame['date'] for frame in frames]).unique().sort()
+        return cls(codes, dates)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.dates), len(self.codes)
+
+    def to_matrix(
+            self, frame: pl.DataFrame, value_column: str, dtype: type = np.float32
+    ) -> np.ndarray:
+        """
+        长表转为连续存储的矩阵，默认为float32，行为交易日、列为股票，缺失值为NaN
+        :param frame: 包含code/date/value_column的DataFrame
+        :param value_column: 值所在的列
+        :param dtype: np.float32或np.float64，需要与长表上的比较结果完全一致时使用np.float64
+        :return:
+        """
+        value_dtype = pl.Float32 if dtype == np.float32 else pl.Float64
+        encoded = (
+            align_codes(
+                frame.select('code', 'date', pl.col(value_column).cast(value_dtype)),
+                self.codes.dtype
+            )
+            .join(self._code_ordinal, on='code', how='inner')
+            .join(self._date_ordinal, on='date', how='inner')
+        )
+        matrix = np.full(self.shape, np.nan, dtype=dtype)
+        matrix[
+            encoded['date_ordinal'].to_numpy(),
+            encoded['code_ordinal'].to_numpy()
+        ] = encoded[value_column].fill_null(np.nan).to_numpy()
+        return matrix
+
+    def to_long(self, matrix: np.ndarray, value_column: str) -> pl.DataFrame:
+        """
+        矩阵转回长表，剔除NaN
+        :param matrix: 日期×股票矩阵
+        :param value_column: 值的列名
+        :return: 包含code/date/value_column的DataFrame
+        """
+        date_ordinal, code_ordinal = np.nonzero(~np.isnan(matrix))
+        return pl.DataFrame({
+            'code': self.codes.gather(code_ordinal),
+            'date': self.dates.gather(date_ordinal),
+            value_column: matrix[date_ordinal, code_ordinal],
+        })
+
+
+def cross_sectional_rank(matrix: np.ndarray) -> np.ndarray:
+    """
+    每个截面（行）内的平均秩，从1开始，NaN保持为NaN
+    :param matrix: 日期×股票矩阵
+    :return: float64矩阵
+    """
+    n_rows, n_cols = matrix.shape
+    order = np.argsort(matrix, axis=1, kind='stable')  # NaN排在最后
+    sorted_values = np.take_along_axis(matrix, order, axis=1).ravel()
+    position = np.tile(np.arange(n_cols), n_rows)
+    # 每行开始处或值变化处开始新的并列组
+    new_group = np.ones(sorted_values.shape, dtype=bool)
+    new_group[1:] = (sorted_values[1:] != sorted_values[:-1]) | (position[1:] == 0)
+    starts = np.flatnonzero(new_group)
+    group_first = np.minimum.reduceat(position, starts)
+    group_last = np.maximum.reduceat(position, starts)
+    group_id = np.cumsum(new_group) - 1
+    sorted_rank = (group_first + group_last)[group_id] / 2 + 1
+    sorted_rank[np.isnan(sorted_values)] = np.nan
+    rank = np.empty((n_rows, n_cols), dtype=np.float64)
+    np.put_along_axis(rank, order, sorted_rank.reshape(n_rows, n_cols), axis=1)
+    return rank
+
+
+def cross_sectional_corr(
+        a: np.ndarray,
+        b: np.ndarray,
+        method: str = 'pearson',
+        min_count: int = 2
+) -> np.ndarray:
+    """
+    每个截面（行）内两个矩阵的相关系数，只使用两者均非NaN的股票
+    :param a: 日期×股票矩阵
+    :param b: 日期×股票矩阵
+    :param method: 'pearson'或'spearman'
+    :param min_count: 有效股票数少于该值时结果为NaN
+    :return: 长度为日期数的数组
+    """
+    mask = ~(np.isnan(a) | np.isnan(b))
+    a = np.where(mask, a, np.nan).astype(np.float64)
+    b = np.where(mask, b, np.nan).astype(np.float64)
+    if method == 'spearman':
+        a = cross_sectional_rank(a)
+        b = cross_sectional_rank(b)
+    elif method != 'pearson':
+        raise ValueError(f'Unknown method: {method}')
+    count = mask.sum(axis=1)
+    a = np.where(mask, a, 0)
+    b = np.where(mask, b, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = np.where(mask, a - a.sum(axis=1, keepdims=True) / count[:, None], 0)
+        b = np.where(mask, b - b.sum(axis=1, keepdims=True) / count[:, None], 0)
+        corr = (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+    corr[count < min_count] = np.nan
+    return corr
+
+
+def cross_sectional_quantile_groups(matrix: np.ndarray, group_num: int = 5) -> np.ndarray:
+    """
+    每个截面（行）内按分位数断点分为group_num组，组号从0开始，NaN所在位置为-1。
+    断点为剔除NaN后的1/group_num、2/group_num...分位数（线性插值），组号为小于该值的断点个数，
+    与pl.Expr.qcut(group_num, allow_duplicates=True)按日分组的结果一致
+    :param matrix: 日期×股票矩阵
+    :param group_num: 分组数量
+    :return: int8矩阵
+    """
+    quantiles = np.arange(1, group_num) / group_num
+    with warnings.catch_warnings():  # 全为NaN的截面断点为NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        breaks = np.nanquantile(matrix, quantiles, axis=1)
+    groups = (breaks.T[:, :, None] < matrix[:, None, :]).sum(axis=1)
+    return np.where(np.isnan(matrix), -1, groups).astype(np.int8)
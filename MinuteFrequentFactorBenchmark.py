@@ -0,0 +1,340 @@
+import MinuteFrequentFactorCalculateMethodsCICC as cicc_methods
+import os
+import gc
+import time
+import datetime
+import threading
+import numpy as np
+import polars as pl
+from typing import Callable
+from MinuteFrequentFactorCICC import MinFreqFactor
+from MinuteFrequentFactorKernels import attach_segments
+
+try:
+    import psutil
+except ImportError:  # 未安装psutil时不统计内存，peak_memory_mb为空
+    psutil = None
+
+"""
+    ========================
+        分钟频因子性能基准
+    ========================
+"""
+
+
+def _trade_times() -> np.ndarray:
+    """
+    一个交易日的k线时间，HHMMSSmmm格式：09:25开盘集合竞价、09:30-11:30与13:00-15:00，共243根，
+    其中14:57-15:00为收盘集合竞价
+    """
+    minutes = [9 * 60 + 25] + list(range(9 * 60 + 30, 11 * 60 + 31)) + list(range(13 * 60, 15 * 60 + 1))
+    return np.array([m // 60 * 10000000 + m % 60 * 100000 for m in minutes], dtype=np.int64)
+
+
+def _warn_without_psutil():
+    if psutil is None:
+        print('未安装psutil，不统计内存峰值，peak_memory_mb为空，无法检查内存退化')
+
+
+def generate_min_data(
+        date: datetime.date,
+        n_codes: int = 5000,
+        seed: int = 0,
+        zero_volume_ratio: float = 0.03,
+        limit_ratio: float = 0.01
+) -> pl.DataFrame:
+    """
+    生成一个交易日的合成A股分钟频数据，列与清洗后的分钟频文件一致：
+    code/date/time/open/high/low/close/volume/amount，按code、time排序。
+    包含开盘集合竞价k线、11:30与15:00的k线、收盘集合竞价（14:57-14:59无成交，15:00一次撮合）、
+    随机的零成交量k线以及全天一字板（价格不变）的股票
+    :param date: 交易日
+    :param n_codes: 股票数量
+    :param seed: 随机数种子，相同参数生成相同数据
+    :param zero_volume_ratio: 零成交量k线的比例
+    :param limit_ratio: 全天价格不变的股票比例
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    times = _trade_times()
+    n_bars = len(times)
+    codes = np.array([f'{i:06d}' for i in range(n_codes)])
+
+    # 集合竞价的跳空更大，日内收益率的波动开盘与收盘较高
+    intraday_vol = 0.0015 * (1 + 0.8 * np.abs(np.linspace(-1, 1, n_bars)))
+    ret = rng.standard_t(df=4, size=(n_codes, n_bars)) * intraday_vol / np.sqrt(2)
+    ret[:, 0] = rng.normal(0, 0.01, n_codes)
+    pre_close = rng.lognormal(2.5, 0.8, n_codes)[:, None]
+    close = np.round(pre_close * np.exp(np.cumsum(ret, axis=1)), 2)
+    open_ = np.concatenate([np.round(pre_close, 2), close[:, :-1]], axis=1)
+    wick = np.abs(rng.normal(0, 0.0008, (n_codes, n_bars, 2))) * close[:, :, None]
+    high = np.round(np.maximum(open_, close) + wick[:, :, 0], 2)
+    low = np.round(np.minimum(open_, close) - wick[:, :, 1], 2)
+
+    # 成交量呈U型分布
+    volume_profile = 1 + 2 * np.linspace(-1, 1, n_bars) ** 2
+    volume = np.round(
+        rng.lognormal(7, 1.2, (n_codes, 1)) * volume_profile
+        * rng.lognormal(0, 0.6, (n_codes, n_bars)),
+        -2
+    )
+    volume[rng.random((n_codes, n_bars)) < zero_volume_ratio] = 0
+
+    # 收盘集合竞价：14:57-14:59只申报不成交，价格不变；15:00按集合竞价价格一次撮合，成交量较大
+    call = np.flatnonzero(times >= 145700000)[:-1]
+    match = n_bars - 1
+    close[:, call] = close[:, call[:1] - 1]
+    close[:, match] = np.round(close[:, match - 1] * np.exp(rng.normal(0, 0.002, n_codes)), 2)
+    open_[:, call] = high[:, call] = low[:, call] = close[:, call]
+    open_[:, match] = close[:, match - 1]
+    high[:, match] = np.maximum(open_[:, match], close[:, match])
+    low[:, match] = np.minimum(open_[:, match], close[:, match])
+    volume[:, call] = 0
+    volume[:, match] = np.round(volume[:, match] * 3, -2)
+
+    limit = rng.random(n_codes) < limit_ratio
+    for price in (open_, high, low, close):
+        price[limit] = close[limit, :1]
+    zero_volume = volume == 0
+    for price in (open_, high, low):  # 无成交的k线价格等于收盘价
+        price[zero_volume] = close[zero_volume]
+
+    return pl.DataFrame({
+        'code': np.repeat(codes, n_bars),
+        'date': pl.Series([date], dtype=pl.Date).extend_constant(date, n_codes * n_bars - 1),
+        'time': np.tile(times, n_codes),
+        'open': open_.ravel(),
+        'high': high.ravel(),
+        'low': low.ravel(),
+        'close': close.ravel(),
+        'volume': volume.ravel(),
+        'amount': (volume * close).ravel(),
+    })
+
+
+def generate_min_archive(
+        folder_path: str,
+        n_days: int = 5,
+        n_codes: int = 5000,
+        start_date: datetime.date = datetime.date(2024, 1, 2),
+        seed: int = 0
+) -> list[str]:
+    """
+    生成合成分钟频文件夹，文件名为YYYYMMDD.parquet，跳过周末
+    :param folder_path: 保存的文件夹
+    :param n_days: 交易日数量
+    :param n_codes: 股票数量
+    :param start_date: 起始日期
+    :param seed: 随机数种子，第i个交易日使用seed + i
+    :return: 生成的文件名
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    file_names = []
+    date = start_date
+    while len(file_names) < n_days:
+        if date.weekday() < 5:
+            file_name = f'{date:%Y%m%d}.parquet'
+            generate_min_data(date, n_codes, seed + len(file_names)).write_parquet(
+                os.path.join(folder_path, file_name)
+            )
+            file_names.append(file_name)
+        date += datetime.timedelta(days=1)
+    return file_names
+
+
+class _PeakMemory:
+    def __init__(self, interval: float = 0.005):
+        """
+        后台线程采样进程RSS，记录代码块执行期间相对开始时的峰值增量（字节）；未安装psutil时为None
+        :param interval: 采样间隔（秒）
+        """
+        self.interval = interval
+        self.peak = None
+
+    def __enter__(self):
+        if psutil is None:
+            return self
+        self._process = psutil.Process()
+        self._start = self._process.memory_info().rss
+        self._max = self._start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self._max = max(self._max, self._process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __exit__(self, *exc):
+        if psutil is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._max = max(self._max, self._process.memory_info().rss)
+        self.peak = self._max - self._start
+
+
+def _resolve_methods(calculate_methods: list[Callable | str] = None) -> dict[str, Callable]:
+    """
+    因子名到计算函数的映射，默认为因子注册表中的全部因子
+    :param calculate_methods: 计算函数或因子名
+    :return:
+    """
+    if calculate_methods is None:
+        calculate_methods = sorted(cicc_methods.FACTOR_REGISTRY)
+    methods = {}
+    for method in calculate_methods:
+        if isinstance(method, str):
+            method = cicc_methods.get_factor(method).calculate_method
+        methods[getattr(method, 'func', method).__name__.removeprefix('cal_')] = method
+    return methods
+
+
+def benchmark_factors(
+        calculate_methods: list[Callable | str] = None,
+        min_data: pl.DataFrame = None,
+        n_codes: int = 5000,
+        repeat: int = 3,
+        seed: int = 0
+) -> pl.DataFrame:
+    """
+    单个cal_*因子的性能基准：在同一份单日数据上逐个计算，每个因子重复repeat次
+    :param calculate_methods: 计算函数或因子名，默认为因子注册表中的全部因子
+    :param min_data: 单日分钟频数据，默认生成n_codes只股票的合成数据；与读取时相同，计算前添加段号列
+    :param n_codes: 合成数据的股票数量
+    :param repeat: 重复次数，耗时取最小值与中位数
+    :param seed: 合成数据的随机数种子
+    :return: 每个因子一行：factor/rows/best_seconds/median_seconds/rows_per_sec/peak_memory_mb
+    """
+    _warn_without_psutil()
+    methods = _resolve_methods(calculate_methods)
+    if min_data is None:
+        min_data = generate_min_data(datetime.date(2024, 1, 2), n_codes, seed)
+    min_data = attach_segments(min_data)
+    records = []
+    for factor_name, method in methods.items():
+        seconds = []
+        peak_memory = None
+        for _ in range(repeat):
+            gc.collect()
+            with _PeakMemory() as memory:
+                start = time.perf_counter()
+                result = method(min_data)
+                if isinstance(result, pl.LazyFrame):
+                    result = result.collect()
+                seconds.append(time.perf_counter() - start)
+            del result
+            if memory.peak is not None:
+                peak_memory = max(peak_memory or 0, memory.peak)
+        best = min(seconds)
+        records.append({
+            'factor': factor_name,
+            'rows': min_data.height,
+            'best_seconds': best,
+            'median_seconds': float(np.median(seconds)),
+            'rows_per_sec': min_data.height / best if best > 0 else None,
+            'peak_memory_mb': None if peak_memory is None else peak_memory / 1024 ** 2,
+        })
+    return pl.DataFrame(records, schema={
+        'factor': pl.String,
+        'rows': pl.Int64,
+        'best_seconds': pl.Float64,
+        'median_seconds': pl.Float64,
+        'rows_per_sec': pl.Float64,
+        'peak_memory_mb': pl.Float64,
+    })
+
+
+def benchmark_exposure(
+        folder_path: str,
+        calculate_methods: list[Callable | str] = None,
+        n_jobs: int = None,
+        output_path: str = None
+) -> pl.DataFrame:
+    """
+    MinFreqFactor.cal_exposure_by_min_data的端到端性能基准：读取、并行计算、合并排序
+    :param folder_path: 分钟频数据所在的文件夹，可由generate_min_archive生成
+    :param calculate_methods: 计算函数或因子名，默认为因子注册表中的全部因子
+    :param n_jobs: 并行进程数
+    :param output_path: 因子暴露的保存路径（应为不含已计算因子的空文件夹），默认为folder_path下的exposure
+    :return: 每个因子一行：factor/files/rows/seconds/rows_per_sec/peak_memory_mb
+    """
+    _warn_without_psutil()
+    methods = _resolve_methods(calculate_methods)
+    if output_path is None:
+        output_path = os.path.join(folder_path, 'exposure')
+    os.makedirs(output_path, exist_ok=True)
+    file_names = [f for f in os.listdir(folder_path) if f.endswith('.parquet')]
+    rows = sum(pl.scan_parquet(os.path.join(folder_path, f)).select(pl.len()).collect().item()
+               for f in file_names)
+    records = []
+    for factor_name, method in methods.items():
+        factor = MinFreqFactor(factor_name)
+        gc.collect()
+        with _PeakMemory() as memory:
+            start = time.perf_counter()
+            factor.cal_exposure_by_min_data(
+                method, path=output_path, n_jobs=n_jobs, folder_path=folder_path
+            )
+            seconds = time.perf_counter() - start
+        records.append({
+            'factor': factor_name,
+            'files': len(file_names),
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_sec': rows / seconds if seconds > 0 else None,
+            'peak_memory_mb': None if memory.peak is None else memory.peak / 1024 ** 2,
+        })
+    return pl.DataFrame(records, schema={
+        'factor': pl.String,
+        'files': pl.Int64,
+        'rows': pl.Int64,
+        'seconds': pl.Float64,
+        'rows_per_sec': pl.Float64,
+        'peak_memory_mb': pl.Float64,
+    })
+
+
+def compare_with_baseline(
+        result: pl.DataFrame,
+        baseline_path: str,
+        time_column: str = 'best_seconds',
+        tolerance: float = 1.2
+) -> pl.DataFrame:
+    """
+    与保存的基准结果比较，耗时超过基准tolerance倍的因子视为性能退化。基准文件不存在时保存当前结果
+    :param result: benchmark_factors或benchmark_exposure的结果
+    :param baseline_path: 基准结果的parquet文件
+    :param time_column: 比较的耗时列，也可以为peak_memory_mb
+    :param tolerance: 允许的耗时倍数
+    :return: 每个因子一行：factor/baseline/current/ratio/regressed
+    """
+    if result[time_column].null_count() == result.height:
+        print(f'{time_column}全部为空，无法检查退化')
+    if not os.path.exists(baseline_path):
+        result.write_parquet(baseline_path)
+        baseline = result
+    else:
+        baseline = pl.read_parquet(baseline_path)
+    return (
+        result.select('factor', pl.col(time_column).alias('current'))
+        .join(
+            baseline.select('factor', pl.col(time_column).alias('baseline')),
+            on='factor', how='left'
+        )
+        .select(
+            'factor', 'baseline', 'current',
+            (pl.col('current') / pl.col('baseline')).alias('ratio'),
+        )
+        .with_columns(
+            (pl.col('ratio') > tolerance).fill_null(False).alias('regressed')
+        )
+        .sort('ratio', descending=True, nulls_last=True)
+    )
+
+
+if __name__ == '__main__':
+    with pl.Config(tbl_rows=-1):
+        print(benchmark_factors())
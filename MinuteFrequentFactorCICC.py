@@ -1,9 +1,17 @@
 from Factor import Factor
+from MinuteFrequentFactorCalculateMethodsCICC import get_read_plan, add_intermediate_columns, get_factor
+from MinuteFrequentFactorKernels import attach_segments
+from MinuteFrequentFactorCache import ExposureCache
+from FactorExposureStore import ExposureStore
+from MinuteFrequentFactorProfile import ProfileReport, profile_stage
+from MinuteFrequentFactorScheduler import FileScheduler, MemoryBudget
+from MinuteFrequentFactorCheckpoint import Checkpoint
+from FactorCodes import encode_codes, decode_exposure
 import os
+import shutil
+import tempfile
 import polars as pl
 from typing import Optional
-from joblib import Parallel, delayed
-from tqdm import tqdm
 
 class MinFreqFactor(Factor):
     def __init__(self, factor_name, factor_exposure=None):
@@ -15,14 +23,151 @@ class MinFreqFactor(Factor):
         super().__init__(factor_name, factor_exposure)
 
     @staticmethod
-    def _process_single_file(file_name, folder_path, calculate_method):
-        """处理单个文件"""
+    def _read_min_data(
+            file_path: str,
+            columns: list[str] = None,
+            time_window: tuple[int | None, int | None] = None,
+            code_dtype: pl.Enum = None
+    ) -> pl.DataFrame:
+        """
+        读取分钟频数据，只解码需要的列，time范围下推至parquet读取以跳过无关的行组
+        :param file_path: 文件路径
+        :param columns: 需要的列，默认读取全部列
+        :param time_window: time范围(start, end)，两端均包含，None表示不限制
+        :param code_dtype: 共享代码字典的Enum类型，传入时code编码为Enum，文件中有新代码时使用扩充后的Enum
+        :return: 包含code、date时校验排序并添加段号列（见attach_segments）；
+            包含time时添加交易分钟序号minute_in_trade（Int16）与交易时段编号session（Int8），每个文件只计算一次
+        """
+        min_data = MinFreqFactor._scan_min_data(file_path, columns, time_window).collect()
+        if code_dtype is not None and 'code' in min_data.columns:
+            min_data = min_data.with_columns(encode_codes(min_data['code'], code_dtype))
+        if 'code' in min_data.columns and 'date' in min_data.columns:
+            min_data = attach_segments(min_data)
+        if 'time' in min_data.columns:
+            min_data = add_intermediate_columns(min_data, ('minute_in_trade', 'session'))
+        return min_data
+
+    @staticmethod
+    def _scan_min_data(
+            file_path: str | list[str],
+            columns: list[str] = None,
+            time_window: tuple[int | None, int | None] = None,
+            code_dtype: pl.Enum = None
+    ) -> pl.LazyFrame:
+        """
+        惰性扫描一个或多个分钟频文件，列裁剪与time范围在扫描时下推
+        :param file_path: 文件路径或文件路径列表
+        :param columns: 需要的列，默认读取全部列
+        :param time_window: time范围(start, end)，两端均包含，None表示不限制
+        :param code_dtype: 共享代码字典的Enum类型，传入时code编码为Enum，文件中的代码需已加入字典
+        :return:
+        """
+        min_data = pl.scan_parquet(file_path)
+        if time_window is not None:
+            start, end = time_window
+            if start is not None:
+                min_data = min_data.filter(pl.col('time') >= start)
+            if end is not None:
+                min_data = min_data.filter(pl.col('time') <= end)
+        if columns is not None:
+            min_data = min_data.select(columns)
+        if code_dtype is not None:
+            min_data = min_data.with_columns(pl.col('code').cast(code_dtype))
+        return min_data
+
+    @staticmethod
+    def _process_single_file(
+            file_name, folder_path, calculate_method, profile=False, capture_plans=False,
+            result_dir=None, code_dtype=None
+    ):
+        """
+        处理单个文件
+        :param profile: 是否剖析各阶段，剖析时返回(当日因子暴露, 本文件的剖析报告)
+        :param capture_plans: 剖析时是否以惰性查询计算并记录查询计划
+        :param result_dir: 传入时当日因子暴露写为该文件夹下的Arrow IPC文件，返回文件路径
+        :param code_dtype: 共享代码字典的Enum类型，传入时读取后将code编码为Enum
+        """
+        report = ProfileReport(capture_plans) if profile else None
+        factor_name = getattr(calculate_method, 'func', calculate_method).__name__.removeprefix('cal_')
+        result = None
         try:
             file_path = os.path.join(folder_path, file_name)
-            return calculate_method(pl.read_parquet(file_path))
+            columns, time_window = get_read_plan([calculate_method])
+            with profile_stage(report, 'read', file_name) as record:
+                min_data = MinFreqFactor._read_min_data(file_path, columns, time_window, code_dtype)
+                record['rows'] = min_data.height
+                record['bytes'] = os.path.getsize(file_path)
+            with profile_stage(report, 'intermediates', file_name) as record:
+                min_data = add_intermediate_columns(
+                    min_data, getattr(calculate_method, 'intermediates', ())
+                )
+                record['rows'] = min_data.height
+                record['bytes'] = min_data.estimated_size()
+            with profile_stage(report, 'factor', file_name, factor_name) as record:
+                if report is not None and capture_plans:
+                    result = calculate_method(min_data.lazy())
+                    report.capture_plan(factor_name, result)
+                else:
+                    result = calculate_method(min_data)
+                if isinstance(result, pl.LazyFrame):
+                    result = result.collect()
+                record['rows'] = result.height
+                record['bytes'] = result.estimated_size()
         except Exception as e:
             print(f"处理文件 {file_name} 时出错: {str(e)}")
-            return None
+            result = None
+        if result is not None and result_dir is not None:
+            with profile_stage(report, 'transfer', file_name, factor_name) as record:
+                result = MinFreqFactor._write_result(result_dir, file_name, factor_name, result)
+                record['bytes'] = os.path.getsize(result)
+        elif report is not None:
+            report.measure_transfer(file_name, result)
+        if report is None:
+            return result
+        return result, report
+
+    @staticmethod
+    def _write_result(result_dir: str, file_name: str, factor_name: str, result: pl.DataFrame) -> str:
+        """
+        工作进程将当日因子暴露写为未压缩的Arrow IPC文件，只向父进程返回路径
+        :param result_dir: 保存的文件夹
+        :param file_name: 分钟频文件名
+        :param factor_name: 因子名
+        :param result: 当日因子暴露
+        :return: 文件路径
+        """
+        path = os.path.join(result_dir, f'{file_name[:8]}_{factor_name}.arrow')
+        result.write_ipc(path, compression='uncompressed', compat_level=pl.CompatLevel.newest())
+        return path
+
+    @staticmethod
+    def _read_result(result: Optional[pl.DataFrame | str | None]) -> Optional[pl.DataFrame | None]:
+        """
+        父进程读取工作进程的结果：IPC文件以内存映射方式读取，不复制、不反序列化
+        :param result: 当日因子暴露或IPC文件路径
+        :return:
+        """
+        if isinstance(result, str):
+            return pl.read_ipc(result)  # polars默认内存映射本地IPC文件
+        return result
+
+    @staticmethod
+    def _list_min_files(folder_path: str) -> pl.DataFrame:
+        """
+        列出分钟频数据文件，文件名前8位为日期
+        :param folder_path: 分钟频数据所在的文件夹
+        :return: 包含file_name/date两列的DataFrame
+        """
+        file_names = [f for f in os.listdir(folder_path) if f.endswith('.parquet')]
+        return pl.DataFrame(
+            data={'file_name': file_names},
+            schema={'file_name': pl.String},
+        ).with_columns(
+            pl.col('file_name')
+            .str.head(8)
+            .str.to_date(format='%Y%m%d')
+            .alias('date')
+        )
 
     @staticmethod
     def _read_exposure(
@@ -47,69 +192,338 @@ class MinFreqFactor(Factor):
                 factor_exposure = pl.read_parquet(path)
         return factor_exposure
 
-    def cal_exposure_by_min_data(
+    def _run_files(
             self,
+            file_names: list[str],
+            folder_path: str,
             calculate_method,
+            n_jobs: int,
+            scheduler: FileScheduler,
+            profile: ProfileReport = None,
+            transfer: str = 'ipc',
+            cache: ExposureCache = None,
+            cache_keys: dict[str, str] = None,
+            desc: str = 'Processing',
+            checkpoint: Checkpoint = None
+    ) -> tuple[list[pl.DataFrame], Optional[str | None]]:
+        """
+        并行计算一组文件的当日因子暴露，写入缓存；传入检查点时每个文件完成后立即保存，失败的文件加入重试清单
+        :return: (成功计算的当日因子暴露, 临时IPC文件夹)，结果可能内存映射自临时文件夹中的文件，
+            使用完毕后才能删除该文件夹
+        """
+        result_dir = None
+        if transfer == 'ipc' and n_jobs != 1 and scheduler.backend == 'loky':
+            result_dir = tempfile.mkdtemp(prefix='min_freq_factor_')
+        code_dtype = None if self.code_dictionary is None else self.code_dictionary.dtype
+
+        def save_checkpoint(index, result):
+            if profile is not None:
+                result = result[0]
+            result = self._read_result(result)
+            if result is None:
+                checkpoint.record_failure(file_names[index], [self.factor_name])
+            else:
+                checkpoint.save(self.factor_name, file_names[index], result)
+
+        with profile_stage(profile, 'parallel') as record:
+            results = scheduler.run(
+                self._process_single_file,
+                [
+                    (
+                        (
+                            file_name,
+                            folder_path,
+                            calculate_method,
+                            profile is not None,
+                            profile is not None and profile.capture_plans,
+                            result_dir,
+                            code_dtype
+                        ),
+                        os.path.getsize(os.path.join(folder_path, file_name))
+                    )
+                    for file_name in file_names
+                ],
+                n_jobs=n_jobs,
+                desc=desc,
+                on_result=save_checkpoint if checkpoint is not None else None
+            )
+            record['rows'] = len(results)
+        if profile is not None:
+            for _, report in results:
+                profile.merge(report)
+            results = [result for result, _ in results]
+        results = [self._read_result(result) for result in results]
+        if cache is not None:
+            for file_name, result in zip(file_names, results):
+                if result is not None:
+                    cache.put(self.factor_name, file_name[:8], cache_keys[file_name], result)
+        return [r for r in results if r is not None], result_dir
+
+    def cal_exposure_by_min_data(
+            self,
+            calculate_method=None,
             path: str = None,
-            n_jobs: int = None
+            n_jobs: int = None,
+            cache: ExposureCache = None,
+            store: ExposureStore = None,
+            folder_path: str = None,
+            profile: ProfileReport = None,
+            transfer: str = 'ipc',
+            scheduler: FileScheduler = None,
+            memory_budget: MemoryBudget = None,
+            checkpoint: Checkpoint = None
     ):
         r"""
         使用分钟频数据计算因子暴露。如果已有已计算的部分则更新至最新数据。
-        :param calculate_method: 因子计算方法
+        :param calculate_method: 因子计算方法，默认为因子注册表中与factor_name同名的因子
         :param path: 因子暴露的保存路径，默认为‘D:\quant\MinuteFreqFactor’
         :param n_jobs:
+        :param cache: 按日缓存，传入时检查全部日期，只重新计算缓存失效（文件或因子函数变化）的日期
+        :param store: 按年月分区的存储，传入时从manifest读取最新日期代替读取整个因子文件，
+            新日期的结果追加至存储，最终因子暴露从存储惰性读取
+        :param folder_path: 分钟频价量数据所在的文件夹，默认为'D:\QuantData\KLine_cleaned'
+        :param profile: 剖析报告，传入时记录每个文件各阶段的耗时、行数、字节数与内存
+        :param transfer: 工作进程返回结果的方式：'ipc'写入临时Arrow IPC文件由父进程内存映射读取，
+            'pickle'由joblib序列化返回；n_jobs为1或使用多线程后端时不经过进程间传输
+        :param scheduler: 文件调度器，决定分批方式与joblib后端，默认为FileScheduler()，保存检查点时每批一个文件
+        :param memory_budget: 内存预算，传入时按预算限制并行数，并按月（或年）分块计算，
+            每块结果写入store或临时parquet文件后释放，最后合并为因子暴露，用于全历史回补
+        :param checkpoint: 检查点，传入时每个交易日完成后立即保存，中断后重新运行只计算未完成的日期，
+            失败的日期加入重试清单并在下次运行时重试；结果写入store后清空该因子的检查点
+        设置了code_dictionary时分钟频数据的code在读取时编码为Enum，float32_exposure为True时因子暴露以float32保存在内存中
         """
-        factor_exposure = self._read_exposure(
-            factor_name=self.factor_name,
-            default_path=r'D:\QuantData\MinuteFreqFactor\CICC Factor',
-            path=path
-        )
+        if transfer not in ('ipc', 'pickle'):
+            raise ValueError(f'Unknown transfer: {transfer}')
+        if calculate_method is None:
+            calculate_method = get_factor(self.factor_name).calculate_method
+        factor_exposure = None
+        if store is None and cache is None:
+            factor_exposure = self._read_exposure(
+                factor_name=self.factor_name,
+                default_path=r'D:\QuantData\MinuteFreqFactor\CICC Factor',
+                path=path
+            )
 
-        folder_path = r'D:\QuantData\KLine_cleaned'  # 分钟频价量数据
-        file_names = [f for f in os.listdir(folder_path) if f.endswith('.parquet')]
-        pv_data_index = pl.DataFrame(
-            data={'file_name': file_names},
-            schema={'file_name': pl.String},
-        ).with_columns(
-            pl.col('file_name')
-            .str.head(8)
-            .str.to_date(format='%Y%m%d')
-            .alias('date')
-        )
-        if factor_exposure is not None:  # 如果有已计算的因子暴露
+        if folder_path is None:
+            folder_path = r'D:\QuantData\KLine_cleaned'  # 分钟频价量数据
+        pv_data_index = self._list_min_files(folder_path)
+        cached_results = {}
+        cache_keys = {}
+        if cache is not None:  # 全部日期由缓存与重新计算的结果组成
+            method_fingerprint = cache.method_fingerprint(calculate_method)
+            for file_name in pv_data_index['file_name']:
+                key = cache.make_key(
+                    cache.file_fingerprint(os.path.join(folder_path, file_name)),
+                    method_fingerprint
+                )
+                cached = cache.get(self.factor_name, file_name[:8], key)
+                if cached is None:
+                    cache_keys[file_name] = key
+                else:
+                    cached_results[file_name] = cached
+            pv_data_index = pv_data_index.filter(
+                pl.col('file_name').is_in(list(cache_keys))
+            )
+        elif store is not None:
+            end_date = store.latest_date(self.factor_name)
+            if end_date is not None:
+                pv_data_index = pv_data_index.filter(pl.col('date') > end_date)
+        elif factor_exposure is not None:  # 如果有已计算的因子暴露
             end_date = factor_exposure['date'].max()
             pv_data_index = pv_data_index.filter(pl.col('date') > end_date)
 
+        file_names = pv_data_index.sort('date')['file_name'].to_list()
+        if checkpoint is not None:  # 已完成的日期从检查点读取
+            checkpoint.bind(self.factor_name, calculate_method)
+            completed = checkpoint.completed(self.factor_name)
+            for file_name in file_names:
+                if f'{file_name[:8]}.parquet' in completed:
+                    exposure = checkpoint.load(self.factor_name, file_name)
+                    if exposure is not None:
+                        cached_results[file_name] = exposure
+            file_names = [f for f in file_names if f not in cached_results]
+        pending = set(file_names)  # 需要计算的文件，其余为缓存命中的文件
+        if n_jobs is None:  # 如果需要日频量价数据
+            n_jobs = -1
+        if scheduler is None:  # 保存检查点时每个文件完成后即返回父进程
+            scheduler = FileScheduler(max_batch_size=1 if checkpoint is not None else None)
+        spill_dir = None
+        if memory_budget is None:  # 全部日期为一块，结果保留在内存中
+            chunks = {None: list(cached_results) + file_names}
+        else:
+            chunks = memory_budget.split(list(cached_results) + file_names)
+            if len(file_names) > 0:
+                n_jobs = memory_budget.n_workers(
+                    n_jobs, [os.path.join(folder_path, file_name) for file_name in file_names]
+                )
+            if store is None:
+                spill_dir = tempfile.mkdtemp(prefix='min_freq_spill_')
+
         valid_results = []
-        if len(pv_data_index) > 0:
-            if n_jobs is None:  # 如果需要日频量价数据
-                n_jobs = -1
-            results = Parallel(n_jobs=n_jobs)(
-                delayed(self._process_single_file)(
-                    file_name,
-                    folder_path,
-                    calculate_method
+        result_dirs = []
+        for chunk_key, chunk_files in chunks.items():
+            chunk_results = [cached_results.pop(f) for f in chunk_files if f in cached_results]
+            to_compute = [f for f in chunk_files if f in pending]
+            if len(to_compute) > 0:
+                results, result_dir = self._run_files(
+                    to_compute, folder_path, calculate_method, n_jobs, scheduler,
+                    profile, transfer, cache, cache_keys,
+                    desc='Processing' if chunk_key is None else f'Processing {chunk_key}',
+                    checkpoint=checkpoint
                 )
-                for file_name in tqdm(pv_data_index['file_name'], desc='Processing')
+                chunk_results += results
+                del results
+                if result_dir is not None:
+                    result_dirs.append(result_dir)
+            if memory_budget is None:
+                valid_results += chunk_results
+                continue
+            if len(chunk_results) > 0:  # 写出本块结果后释放内存与临时文件
+                with profile_stage(profile, 'concat', factor_name=self.factor_name) as record:
+                    chunk_exposure = pl.concat(
+                        self._encode_codes(chunk_results), how='vertical'
+                    ).sort(['date', 'code'])
+                    if store is not None:
+                        store.append(self.factor_name, chunk_exposure)
+                    else:
+                        decode_exposure(chunk_exposure).write_parquet(
+                            os.path.join(spill_dir, f'{chunk_key}.parquet')
+                        )
+                    record['rows'] = chunk_exposure.height
+                    record['bytes'] = chunk_exposure.estimated_size()
+                del chunk_results, chunk_exposure
+            while len(result_dirs) > 0:
+                shutil.rmtree(result_dirs.pop(), ignore_errors=True)
+
+        with profile_stage(profile, 'concat', factor_name=self.factor_name) as record:
+            if store is not None:
+                if len(valid_results) > 0:
+                    store.append(
+                        self.factor_name,
+                        pl.concat(self._encode_codes(valid_results), how='vertical')
+                    )
+                self.factor_exposure = store.read(self.factor_name)
+            elif spill_dir is not None:  # 临时文件与已有因子暴露均为解码后的类型
+                parts = [] if factor_exposure is None else [factor_exposure.lazy()]
+                parts += [
+                    pl.scan_parquet(os.path.join(spill_dir, f'{chunk_key}.parquet'))
+                    for chunk_key in chunks
+                    if os.path.exists(os.path.join(spill_dir, f'{chunk_key}.parquet'))
+                ]
+                self.factor_exposure = factor_exposure if len(parts) == 0 else (
+                    pl.concat(parts, how='vertical')
+                    .sort(['date', 'code'])
+                    .collect(engine='streaming')
+                )
+            elif factor_exposure is None:
+                self.factor_exposure = (
+                    pl.concat(self._encode_codes(valid_results), how='vertical')
+                    .sort(['date', 'code'])
+                )
+            elif len(valid_results) > 0:
+                self.factor_exposure = (
+                    pl.concat(
+                        items=self._encode_codes([factor_exposure] + valid_results),
+                        how='vertical'
+                    )
+                    .sort(['date', 'code'])
+                )
+            else:
+                self.factor_exposure = factor_exposure
+            self.factor_exposure = self._compact_exposure(self.factor_exposure)
+            if self.factor_exposure is not None:
+                record['rows'] = self.factor_exposure.height
+                record['bytes'] = self.factor_exposure.estimated_size()
+        if checkpoint is not None and store is not None:  # 结果已持久化
+            checkpoint.clear(self.factor_name, failures=False)
+        del valid_results  # 排序后的因子暴露已复制，释放内存映射后删除临时文件
+        for result_dir in result_dirs:
+            shutil.rmtree(result_dir, ignore_errors=True)
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def cal_exposure_by_scan(
+            self,
+            calculate_method=None,
+            path: str = None,
+            folder_path: str = None,
+            store: ExposureStore = None,
+            memory_budget: MemoryBudget = None
+    ):
+        r"""
+        将分钟频文件夹视为一个数据集惰性扫描，以Polars流式引擎在全部日期上一次性计算因子，
+        不按文件派发进程。适合计算量小的因子（如liq_openvol、trade_headRatio），省去逐文件的进程调度与结果传输，
+        内存占用由流式引擎控制。只支持以day_local声明的因子，其余因子的窗口跨越日期，需使用cal_exposure_by_min_data。
+        需要扫描的文件按文件名中的日期选择，已有因子暴露时只扫描之后的日期
+        :param calculate_method: 因子计算方法，默认为因子注册表中与factor_name同名的因子
+        :param path: 因子暴露的保存路径，默认为'D:\QuantData\MinuteFreqFactor\CICC Factor'
+        :param folder_path: 分钟频价量数据所在的文件夹，默认为'D:\QuantData\KLine_cleaned'
+        :param store: 按年月分区的存储，传入时从manifest读取最新日期，新日期的结果追加至存储
+        :param memory_budget: 内存预算，传入时按月（或年）分块扫描，每块结果写入store或内存后再扫描下一块
+        设置了code_dictionary时先将各块文件中的代码加入字典，扫描时code编码为Enum
+        """
+        if calculate_method is None:
+            calculate_method = get_factor(self.factor_name).calculate_method
+        if not getattr(calculate_method, 'day_local', False):
+            raise ValueError(
+                f'{self.factor_name} is not day_local, use cal_exposure_by_min_data instead'
             )
-            valid_results = [r for r in results if r is not None]
+        factor_exposure = None
+        end_date = None
+        if store is not None:
+            end_date = store.latest_date(self.factor_name)
+        else:
+            factor_exposure = self._read_exposure(
+                factor_name=self.factor_name,
+                default_path=r'D:\QuantData\MinuteFreqFactor\CICC Factor',
+                path=path
+            )
+            if factor_exposure is not None:
+                end_date = factor_exposure['date'].max()
 
-        if factor_exposure is None:
-            self.factor_exposure = (
-                pl.concat(valid_results, how='vertical')
-                .sort(['date', 'code'])
+        if folder_path is None:
+            folder_path = r'D:\QuantData\KLine_cleaned'  # 分钟频价量数据
+        pv_data_index = self._list_min_files(folder_path)
+        if end_date is not None:
+            pv_data_index = pv_data_index.filter(pl.col('date') > end_date)
+        file_names = pv_data_index.sort('date')['file_name'].to_list()
+        if memory_budget is None:
+            chunks = {None: file_names} if len(file_names) > 0 else {}
+        else:
+            chunks = memory_budget.split(file_names)
+
+        columns, time_window = get_read_plan([calculate_method])
+        valid_results = []
+        for chunk_files in chunks.values():
+            file_paths = [os.path.join(folder_path, file_name) for file_name in chunk_files]
+            code_dtype = None
+            if self.code_dictionary is not None:  # 惰性扫描无法在读取后扩充字典
+                self.code_dictionary.extend_from_files(file_paths)
+                code_dtype = self.code_dictionary.dtype
+            min_data = add_intermediate_columns(
+                self._scan_min_data(file_paths, columns, time_window, code_dtype),
+                getattr(calculate_method, 'intermediates', ())
             )
+            result = calculate_method(min_data)
+            if isinstance(result, pl.LazyFrame):
+                result = result.collect(engine='streaming')
+            if store is not None:
+                store.append(self.factor_name, result)
+            else:
+                valid_results.append(result)
+
+        if store is not None:
+            self.factor_exposure = store.read(self.factor_name)
         elif len(valid_results) > 0:
-            update_exposure = pl.concat(valid_results, how='vertical')
+            if factor_exposure is not None:
+                valid_results.insert(0, factor_exposure)
             self.factor_exposure = (
-                pl.concat(
-                    items=[factor_exposure, update_exposure],
-                    how='vertical'
-                )
+                pl.concat(self._encode_codes(valid_results), how='vertical')
                 .sort(['date', 'code'])
             )
         else:
             self.factor_exposure = factor_exposure
+        self.factor_exposure = self._compact_exposure(self.factor_exposure)
 
     def cal_final_exposure(
             self,
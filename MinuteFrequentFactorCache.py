@@ -0,0 +1,189 @@
+import MinuteFrequentFactorCalculateMethodsCICC as cicc_methods
+import MinuteFrequentFactorKernels as kernels
+import os
+import hashlib
+import inspect
+import tempfile
+import polars as pl
+from typing import Callable, Literal, Optional
+from FactorCodes import decode_exposure
+
+
+class ExposureCache:
+    def __init__(
+            self,
+            cache_dir: str = None,
+            max_bytes: int = 10 * 1024 ** 3,
+            fingerprint: Literal['stat', 'content'] = 'stat'
+    ):
+        r"""
+        按日、按因子缓存因子暴露。缓存键由分钟频文件指纹、因子函数源码哈希与参数组成，
+        任一变化都会使当日缓存失效，只重新计算失效的日期。
+        :param cache_dir: 缓存文件夹，默认为'D:\QuantData\MinuteFreqFactor\cache'
+        :param max_bytes: 缓存占用磁盘的上限，超出时按最近最少使用淘汰，默认10GB
+        :param fingerprint: 文件指纹方式：'stat'使用文件大小与修改时间，'content'使用文件内容哈希
+        """
+        if cache_dir is None:
+            cache_dir = r'D:\QuantData\MinuteFreqFactor\cache'
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+        self._size = None  # 缓存占用的字节数，首次写入时统计
+
+    def file_fingerprint(self, file_path: str) -> str:
+        """
+        分钟频文件指纹
+        :param file_path: 文件路径
+        :return:
+        """
+        if self.fingerprint == 'content':
+            digest = hashlib.blake2b(digest_size=16)
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            return digest.hexdigest()
+        stat = os.stat(file_path)
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    @staticmethod
+    def method_fingerprint(calculate_method: Callable) -> str:
+        """
+        因子计算方法指纹：函数源码、实际使用的参数、依赖的中间列定义以及计算核模块的源码。
+        参数为函数的默认参数与functools.partial绑定的参数（如doc_*因子的bin_width），绑定默认值与不绑定的指纹相同。
+        因子的主要计算在MinuteFrequentFactorKernels中，修改其中任一计算核都会使全部因子的缓存与检查点失效
+        :param calculate_method: 因子计算方法
+        :return:
+        """
+        func = getattr(calculate_method, 'func', calculate_method)
+        params = {
+            name: parameter.default
+            for name, parameter in inspect.signature(func).parameters.items()
+            if parameter.default is not inspect.Parameter.empty
+        }
+        params.update(getattr(calculate_method, 'keywords', {}))
+        parts = [
+            inspect.getsource(inspect.unwrap(func)),
+            repr(getattr(calculate_method, 'args', ())),
+            repr(sorted(params.items())),
+            inspect.getsource(kernels),
+        ]
+        for name in getattr(func, 'intermediates', ()):
+            if name in cicc_methods.INTERMEDIATE_COLUMNS:
+                parts.append(str(cicc_methods.INTERMEDIATE_COLUMNS[name]))
+            else:
+                kernel = cicc_methods.INTERMEDIATE_KERNELS[name]  # 计算核可以为函数或functools.partial
+                parts.append(inspect.getsource(getattr(kernel, 'func', kernel)))
+                parts.append(repr(sorted(getattr(kernel, 'keywords', {}).items())))
+        return hashlib.blake2b('\n'.join(parts).encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def make_key(file_fingerprint: str, method_fingerprint: str) -> str:
+        """
+        缓存键
+        :param file_fingerprint: 分钟频文件指纹
+        :param method_fingerprint: 因子计算方法指纹
+        :return:
+        """
+        return hashlib.blake2b(
+            f'{file_fingerprint}|{method_fingerprint}'.encode(), digest_size=16
+        ).hexdigest()
+
+    def _path(self, factor_name: str, date_str: str, key: str) -> str:
+        return os.path.join(self.cache_dir, factor_name, f'{date_str}_{key}.parquet')
+
+    def get(self, factor_name: str, date_str: str, key: str) -> Optional[pl.DataFrame | None]:
+        """
+        读取缓存，未命中时返回None
+        :param factor_name: 因子名
+        :param date_str: 日期，格式为YYYYMMDD
+        :param key: 缓存键
+        :return:
+        """
+        path = self._path(factor_name, date_str, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            exposure = pl.read_parquet(path)
+        except Exception:  # 损坏的缓存视为未命中
+            return None
+        os.utime(path)  # 记录最近使用时间
+        return exposure
+
+    def put(self, factor_name: str, date_str: str, key: str, exposure: pl.DataFrame):
+        """
+        写入缓存，并删除同一因子同一日期的失效缓存
+        :param factor_name: 因子名
+        :param date_str: 日期，格式为YYYYMMDD
+        :param key: 缓存键
+        :param exposure: 当日因子暴露
+        """
+        factor_dir = os.path.join(self.cache_dir, factor_name)
+        os.makedirs(factor_dir, exist_ok=True)
+        if self._size is None:
+            self._size = self._scan_size()
+
+        for file_name in os.listdir(factor_dir):  # 失效的旧缓存
+            if file_name.startswith(f'{date_str}_'):
+                stale_path = os.path.join(factor_dir, file_name)
+                self._size -= os.path.getsize(stale_path)
+                os.remove(stale_path)
+
+        path = self._path(factor_name, date_str, key)
+        with tempfile.NamedTemporaryFile(
+                dir=factor_dir, delete=False, suffix='.tmp'
+        ) as tmp:
+            temp_path = tmp.name
+        try:
+            decode_exposure(exposure).write_parquet(temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise e
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _scan_size(self) -> int:
+        return sum(
+            entry.stat().st_size
+            for factor_entry in os.scandir(self.cache_dir) if factor_entry.is_dir()
+            for entry in os.scandir(factor_entry.path) if entry.name.endswith('.parquet')
+        )
+
+    def evict(self, target_ratio: float = 0.9):
+        """
+        按最近使用时间淘汰缓存，直到占用不超过max_bytes * target_ratio
+        :param target_ratio: 淘汰后的目标占用比例
+        """
+        entries = sorted(
+            (
+                entry
+                for factor_entry in os.scandir(self.cache_dir) if factor_entry.is_dir()
+                for entry in os.scandir(factor_entry.path) if entry.name.endswith('.parquet')
+            ),
+            key=lambda entry: entry.stat().st_mtime_ns
+        )
+        size = sum(entry.stat().st_size for entry in entries)
+        target = self.max_bytes * target_ratio
+        for entry in entries:
+            if size <= target:
+                break
+            size -= entry.stat().st_size
+            os.remove(entry.path)
+        self._size = size
+
+    def clear(self, factor_name: str = None):
+        """
+        清空缓存
+        :param factor_name: 只清空该因子的缓存，默认清空全部
+        """
+        factor_names = [factor_name] if factor_name is not None else os.listdir(self.cache_dir)
+        for name in factor_names:
+            factor_dir = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(factor_dir):
+                continue
+            for file_name in os.listdir(factor_dir):
+                os.remove(os.path.join(factor_dir, file_name))
+        self._size = None
@@ -1,4 +1,9 @@
 import polars as pl
+import functools
+from MinuteFrequentFactorKernels import (
+    rolling_ols, rolling_ols_summary, segment_agg, segment_keys, volume_rank, volume_rank_return,
+    chip_distribution, chip_distribution_stats, power_sums, moment_std, moment_skew, moment_kurt
+)
 
 """
     ========================
@@ -7,153 +12,418 @@ import polars as pl
 """
 
 
+# 公共中间列
+
+# 交易时段编号：开盘集合竞价、上午连续竞价、下午连续竞价、收盘集合竞价（14:57起）
+SESSION_OPEN_AUCTION = 0
+SESSION_AM = 1
+SESSION_PM = 2
+SESSION_CLOSE_AUCTION = 3
+
+
+def trade_minute(time: int) -> int:
+    """
+    HHMMSSmmm格式的时间对应的交易分钟序号，与中间列minute_in_trade一致，
+    用于把time上的比较改写为minute_in_trade上的比较；11:30的处理见_minute_in_trade_expr
+    :param time: HHMMSSmmm格式的时间，如145700000
+    :return:
+    """
+    minutes = time // 10000000 * 60 + time % 10000000 // 100000
+    return minutes - 570 if minutes < 720 else minutes - 660
+
+
+def _minute_in_trade_expr() -> pl.Expr:
+    """
+    交易分钟序号：09:30为0，11:29为119，13:00为120，14:59为239，集合竞价为负数。
+    每个交易日的分钟在固定的偏移上，不随文件中缺失的k线变化，时间窗口即序号区间。
+    11:30的k线：序号与13:00同为120（QRS因子原有的换算），上午与下午连续；
+    滚动回归中两者共用一个窗口，窗口包含全部序号在区间内的k线（见rolling_ols）；
+    时段上属于上午（见_session_expr），午休边界上的比较使用session而不是序号
+    """
+    time_expr = pl.col('time') // 10000000 * 60 + pl.col('time') % 10000000 // 100000
+    return (
+        pl.when(time_expr < 720)
+        .then(time_expr - 570)
+        .otherwise(time_expr - 660)
+        .cast(pl.Int16)
+    )
+
+
+def _session_expr() -> pl.Expr:
+    """
+    交易时段编号，见SESSION_*；午休边界按time判断
+    """
+    return (
+        pl.when(pl.col('time') < 93000000).then(SESSION_OPEN_AUCTION)
+        .when(pl.col('time') <= 113000000).then(SESSION_AM)
+        .when(pl.col('time') < 145700000).then(SESSION_PM)
+        .otherwise(SESSION_CLOSE_AUCTION)
+        .cast(pl.Int8)
+    )
+
+
+INTERMEDIATE_COLUMNS = {
+    # 分钟k线收益率
+    'bar_ret': pl.col('close') / pl.col('open') - 1,
+    # 分钟成交量占当日成交量的比例
+    'volume_share': pl.col('volume') / pl.col('volume').sum().over(['code', 'date']),
+    # 交易分钟序号（Int16），读取分钟频数据时已添加
+    'minute_in_trade': _minute_in_trade_expr(),
+    # 交易时段编号（Int8），读取分钟频数据时已添加
+    'session': _session_expr(),
+    # 收盘价相对各分钟收盘价的收益，筹码分布类因子使用
+    'close_last_ratio': pl.col('close').last().over(['code', 'date']) / pl.col('close'),
+}
+
+INTERMEDIATE_KERNELS = {
+    # 50根分钟k线最低价对最高价的滚动回归，依赖minute_in_trade
+    'rolling_ols_50': functools.partial(rolling_ols, x='low', y='high', window=50),
+    # 成交量在当日从大到小、从小到大的排名，顶量/底量因子使用
+    'volume_rank': volume_rank,
+}
+
+# 中间列依赖的原始列
+INTERMEDIATE_REQUIRED_COLUMNS = {
+    'bar_ret': ('open', 'close'),
+    'volume_share': ('volume',),
+    'minute_in_trade': ('time',),
+    'session': ('time',),
+    'close_last_ratio': ('close',),
+    'rolling_ols_50': ('high', 'low'),
+    'volume_rank': ('volume',),
+}
+
+
+def add_intermediate_columns(
+        df: pl.DataFrame | pl.LazyFrame,
+        intermediates: tuple[str, ...] | list[str]
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    为日内数据添加中间列，已存在的中间列不会重复计算
+    :param df: 分钟频数据
+    :param intermediates: 需要的中间列名
+    :return:
+    """
+    existing = df.collect_schema().names()
+    exprs = [
+        INTERMEDIATE_COLUMNS[name].alias(name)
+        for name in intermediates
+        if name in INTERMEDIATE_COLUMNS and name not in existing
+    ]
+    if len(exprs) > 0:
+        df = df.with_columns(exprs)
+    for name in intermediates:  # 计算核在中间列之后执行，且自身不会重复计算
+        if name in INTERMEDIATE_KERNELS:
+            df = INTERMEDIATE_KERNELS[name](df)
+    return df
+
+
+def uses_intermediate(*intermediates: str):
+    """
+    装饰器：声明因子依赖的中间列。
+    单独调用时自动补齐中间列；批量计算时由引擎对每日数据统一计算一次。
+    :param intermediates: 依赖的中间列名，必须在INTERMEDIATE_COLUMNS或INTERMEDIATE_KERNELS中
+    """
+    for name in intermediates:
+        if name not in INTERMEDIATE_COLUMNS and name not in INTERMEDIATE_KERNELS:
+            raise ValueError(f'Unknown intermediate column: {name}')
+
+    def decorator(calculate_method):
+        @functools.wraps(calculate_method)
+        def wrapper(df, **params):
+            return calculate_method(add_intermediate_columns(df, intermediates), **params)
+        wrapper.intermediates = intermediates
+        return wrapper
+    return decorator
+
+
+def reads_columns(*columns: str, time_window: tuple[int | None, int | None] = None):
+    """
+    装饰器：声明因子需要读取的原始列与时间范围，读取分钟频数据时据此做列裁剪与谓词下推。
+    code/date与中间列依赖的原始列会自动加入。
+    :param columns: 需要的原始列
+    :param time_window: 需要的time范围(start, end)，两端均包含，None表示不限制；因子需要全天数据时不设置
+    """
+    def decorator(calculate_method):
+        calculate_method.required_columns = columns
+        calculate_method.time_window = time_window
+        return calculate_method
+    return decorator
+
+
+def day_local(calculate_method):
+    """
+    装饰器：声明因子只在同一code、date的k线内计算（窗口函数均按['code', 'date']分组），
+    在多日数据上计算的结果与逐日计算一致，可以在整个分钟频数据集上以流式引擎惰性计算
+    """
+    calculate_method.day_local = True
+    return calculate_method
+
+
+# 因子注册表
+
+# 因子类别：动量反转、波动率、高阶特征、流动性、量价相关性、筹码分布、资金成交
+FACTOR_CATEGORIES = ('mmt', 'vol', 'shape', 'liq', 'corr', 'doc', 'trade')
+
+
+class FactorSpec:
+    def __init__(
+            self,
+            name: str,
+            category: str,
+            calculate_method,
+            columns: tuple[str, ...],
+            time_window: tuple[int | None, int | None] | None,
+            intermediates: tuple[str, ...],
+            day_local: bool
+    ):
+        """
+        注册表中一个因子的声明
+        :param name: 因子名，即输出的因子列名
+        :param category: 因子类别，FACTOR_CATEGORIES之一
+        :param calculate_method: 计算函数，已按声明附加读取需求与中间列
+        :param columns: 需要读取的原始列，不含code/date与中间列依赖的列
+        :param time_window: 需要的time范围(start, end)，None表示全天
+        :param intermediates: 依赖的中间列
+        :param day_local: 是否只在同一code、date的k线内计算
+        """
+        self.name = name
+        self.category = category
+        self.calculate_method = calculate_method
+        self.columns = columns
+        self.time_window = time_window
+        self.intermediates = intermediates
+        self.day_local = day_local
+
+
+# 因子名 -> FactorSpec，按注册（定义）顺序排列
+FACTOR_REGISTRY = {}
+
+
+def register_factor(
+        category: str,
+        columns: tuple[str, ...] = (),
+        time_window: tuple[int | None, int | None] = None,
+        intermediates: tuple[str, ...] = (),
+        day_local: bool = False
+):
+    """
+    装饰器：在一处声明因子的类别、读取的原始列、time范围、依赖的中间列以及是否只在日内计算，
+    并以函数名去掉'cal_'前缀为因子名加入FACTOR_REGISTRY。
+    声明依次通过uses_intermediate、reads_columns附加到计算函数上，与单独使用这些装饰器等价
+    :param category: 因子类别，FACTOR_CATEGORIES之一
+    :param columns: 需要读取的原始列，code/date与中间列依赖的原始列会自动加入
+    :param time_window: 需要的time范围(start, end)，两端均包含，None表示不限制
+    :param intermediates: 依赖的中间列，必须在INTERMEDIATE_COLUMNS或INTERMEDIATE_KERNELS中
+    :param day_local: 因子是否只在同一code、date的k线内计算（见day_local）
+    """
+    if category not in FACTOR_CATEGORIES:
+        raise ValueError(f'Unknown factor category: {category}')
+
+    def decorator(calculate_method):
+        name = calculate_method.__name__.removeprefix('cal_')
+        if name in FACTOR_REGISTRY:
+            raise ValueError(f'Factor already registered: {name}')
+        if len(intermediates) > 0:
+            calculate_method = uses_intermediate(*intermediates)(calculate_method)
+        calculate_method = reads_columns(*columns, time_window=time_window)(calculate_method)
+        calculate_method.day_local = day_local
+        calculate_method.category = category
+        FACTOR_REGISTRY[name] = FactorSpec(
+            name, category, calculate_method, tuple(columns), time_window, tuple(intermediates), day_local
+        )
+        return calculate_method
+    return decorator
+
+
+def get_factor(name: str) -> FactorSpec:
+    """
+    按因子名查询注册表
+    :param name: 因子名，可以带'cal_'前缀
+    :return:
+    """
+    spec = FACTOR_REGISTRY.get(name.removeprefix('cal_'))
+    if spec is None:
+        raise ValueError(f'Unknown factor: {name}')
+    return spec
+
+
+def factor_with_params(factor, **params) -> functools.partial:
+    """
+    以functools.partial为因子绑定参数（如doc_*因子的bin_width），并保留声明的读取需求、中间列与day_local，
+    结果可以像计算函数一样传给MinFreqFactor、MinFreqFactorEngine，因子名不变，缓存指纹包含绑定的参数
+    :param factor: 计算函数或因子名
+    :param params: 绑定的参数
+    :return:
+    """
+    calculate_method = get_factor(factor).calculate_method if isinstance(factor, str) else factor
+    bound = functools.partial(calculate_method, **params)
+    for attribute in ('required_columns', 'time_window', 'intermediates', 'day_local', 'category'):
+        if hasattr(calculate_method, attribute):
+            setattr(bound, attribute, getattr(calculate_method, attribute))
+    return bound
+
+
+def list_factors(
+        categories: str | list[str] = None,
+        day_local_only: bool = False
+) -> list[str]:
+    """
+    注册表中的因子名
+    :param categories: 类别或类别列表，默认为全部类别
+    :param day_local_only: 是否只返回day_local的因子（可以用cal_exposure_by_scan计算）
+    :return: 按注册顺序排列的因子名
+    """
+    if categories is None:
+        categories = FACTOR_CATEGORIES
+    elif isinstance(categories, str):
+        categories = [categories]
+    for category in categories:
+        if category not in FACTOR_CATEGORIES:
+            raise ValueError(f'Unknown factor category: {category}')
+    return [
+        name for name, spec in FACTOR_REGISTRY.items()
+        if spec.category in categories and (spec.day_local or not day_local_only)
+    ]
+
+
+def get_read_plan(
+        calculate_methods
+) -> tuple[list[str] | None, tuple[int | None, int | None] | None]:
+    """
+    合并多个因子的读取需求
+    :param calculate_methods: 因子计算方法列表
+    :return: (需要读取的列, time范围)，None表示读取全部列或全天数据
+    """
+    columns = ['code', 'date']
+    windows = []
+    for calculate_method in calculate_methods:
+        if not hasattr(calculate_method, 'required_columns'):  # 未声明的因子读取全部数据
+            return None, None
+        columns.extend(calculate_method.required_columns)
+        for name in getattr(calculate_method, 'intermediates', ()):
+            columns.extend(INTERMEDIATE_REQUIRED_COLUMNS[name])
+        windows.append(calculate_method.time_window)
+    columns = list(dict.fromkeys(columns))
+
+    if len(windows) == 0 or None in windows:
+        return columns, None
+    starts = [window[0] for window in windows]
+    ends = [window[1] for window in windows]
+    time_window = (
+        None if None in starts else min(starts),
+        None if None in ends else max(ends)
+    )
+    if time_window == (None, None):
+        return columns, None
+    if 'time' not in columns:
+        columns.append('time')
+    return columns, time_window
+
+
 # 动量反转
 
+@register_factor(
+    'mmt', columns=('time', 'open', 'close'),
+    time_window=(130000000, 145900000), intermediates=('minute_in_trade', 'session'), day_local=True
+)
 def cal_mmt_pm(df: pl.DataFrame):
     """
     下午盘动量
     仅使用下午动量
     """
-    return (
-        df.filter(pl.col('time').is_in([130000000, 145900000]))
-        .sort(by=['code', 'date', 'time'])
-        .group_by(['code', 'date']).agg(
-            (pl.col('close').last() / pl.col('open').first())
-            .alias('mmt_pm')
-        )
+    return segment_agg(
+        df.filter(
+            (pl.col('session') >= SESSION_PM)
+            & pl.col('minute_in_trade').is_in([trade_minute(130000000), trade_minute(145900000)])
+        ),
+        (pl.col('close').last() / pl.col('open').first())
+        .alias('mmt_pm'),
+        ordered=True
     )
 
 
+@register_factor(
+    'mmt', columns=('time', 'open', 'close'),
+    time_window=(143000000, 145900000), intermediates=('minute_in_trade',), day_local=True
+)
 def cal_mmt_last30(df: pl.DataFrame):
     """
     尾盘半小时动量
     仅使用尾盘30分钟动量
     """
-    return (
-        df.filter(pl.col('time').is_in([143000000, 145900000]))
-        .sort(by=['code', 'date', 'time'])
-        .group_by(['code', 'date']).agg(
-            (pl.col('close').last() / pl.col('open').first())
-            .alias('mmt_last30')
-        )
+    return segment_agg(
+        df.filter(pl.col('minute_in_trade').is_in([trade_minute(143000000), trade_minute(145900000)])),
+        (pl.col('close').last() / pl.col('open').first())
+        .alias('mmt_last30'),
+        ordered=True
     )
 
 
+@register_factor(
+    'mmt', columns=('time', 'open', 'close'),
+    intermediates=('session',), day_local=True
+)
 def cal_mmt_paratio(df: pl.DataFrame):
     """
     上下午盘动量差
-    上下午盘动量差
-    """
-    return (
-        df.lazy().with_columns(
-            pl.when(pl.col('time') <= 113000000)
-            .then(0)
-            .otherwise(1)
-            .alias('am_0_pm_1')
-        ).group_by(['code', 'date', 'am_0_pm_1']).agg(
-            (pl.col('close').last() / pl.col('open').first() - 1)
-            .alias('mmt')
-        ).group_by(['code', 'date']).agg(
-            (pl.col('mmt').last() - pl.col('mmt').first())
-            .alias('mmt_paratio')
-        ).collect()
+    下午盘动量减上午盘动量，只有半天数据时为0
+    """
+    am = pl.col('session') <= SESSION_AM
+    am_mmt = pl.col('close').filter(am).last() / pl.col('open').filter(am).first() - 1
+    pm_mmt = pl.col('close').filter(~am).last() / pl.col('open').filter(~am).first() - 1
+    return segment_agg(
+        df,
+        (pm_mmt - am_mmt)
+        .fill_null(0)
+        .alias('mmt_paratio'),
+        ordered=True
     )
 
 
+@register_factor(
+    'mmt', columns=('time', 'open', 'close'),
+    time_window=(93000000, 112900000), intermediates=('minute_in_trade',), day_local=True
+)
 def cal_mmt_am(df: pl.DataFrame):
     """
     上午盘动量
     仅使用上午盘动量
     """
-    return (
-        df.filter(pl.col('time').is_in([93000000, 112900000]))
-        .sort(by=['code', 'date', 'time'])
-        .group_by(['code', 'date']).agg(
-            (pl.col('close').last() / pl.col('open').first())
-            .alias('mmt_am')
-        )
+    return segment_agg(
+        df.filter(pl.col('minute_in_trade').is_in([trade_minute(93000000), trade_minute(112900000)])),
+        (pl.col('close').last() / pl.col('open').first())
+        .alias('mmt_am'),
+        ordered=True
     )
 
 
+@register_factor(
+    'mmt', columns=('time', 'open', 'close'),
+    time_window=(100000000, 142900000), intermediates=('minute_in_trade',), day_local=True
+)
 def cal_mmt_between(df: pl.DataFrame):
     """
     去头尾动量
     使用剔除前后30分钟交易时间动量
     """
-    return (
-        df.filter(pl.col('time').is_in([100000000, 142900000]))
-        .sort(by=['code', 'date', 'time'])
-        .group_by(['code', 'date']).agg(
-            (pl.col('close').last() / pl.col('open').first())
-            .alias('mmt_between')
-        )
+    return segment_agg(
+        df.filter(pl.col('minute_in_trade').is_in([trade_minute(100000000), trade_minute(142900000)])),
+        (pl.col('close').last() / pl.col('open').first())
+        .alias('mmt_between'),
+        ordered=True
     )
 
 
+@register_factor('mmt', intermediates=('minute_in_trade', 'rolling_ols_50'), day_local=True)
 def cal_mmt_ols_qrs(df: pl.DataFrame):
     """
     分钟qrs指标
     50根分钟k线qrs指标
     """
-    time_expr = (
-            pl.col('time') // 10000000 * 60
-            + pl.col('time') % 10000000 / 100000
-    ).cast(pl.Int64)
-    trade_minute_expr = (
-        pl.when(time_expr < 720)
-        .then(time_expr - 570)
-        .otherwise(time_expr - 660)
-    )
     return (
-        df.lazy().with_columns(
-            trade_minute_expr
-            .cast(pl.Int64)
-            .alias('minute_in_trade')
-        )
-        .select(['code', 'date', 'minute_in_trade', 'high', 'low'])
-        .rolling(
-            index_column='minute_in_trade',
-            period='50i',
-            group_by=['code', 'date']
-        ).agg(
-            pl.cov(a='low', b='high', ddof=0).alias('cov'),
-            pl.var(column='low', ddof=0).alias('var_x'),
-            pl.var(column='high', ddof=0).alias('var_y'),
-            pl.col('high')
-            .mean()
-            .alias('mean_y'),
-            pl.col('low')
-            .mean()
-            .alias('mean_x'),
-            pl.len().alias('n')
-        ).filter(pl.col('n') >= 50)
-        .with_columns(
-            pl.when(pl.col('var_x') != 0)
-            .then(pl.col('cov') / pl.col('var_x'))
-            .otherwise(pl.col('mean_y') / pl.col('mean_x'))
-            .alias('beta'),
-            pl.when(pl.col('var_y') * pl.col('var_x') != 0)
-            .then(
-                pl.col('cov').pow(0.5) / (pl.col('var_x') * pl.col('var_y'))
-            )
-            .otherwise(None)
-            .alias('corr_square')
-        )
-        .group_by(['code', 'date'])
-        .agg(
-            pl.col('beta')
-            .mean()
-            .alias('beta_mean'),
-            pl.col('beta')
-            .std()
-            .alias('beta_std'),
-            pl.col('beta')
-            .last()
-            .alias('beta_last'),
-            pl.col('corr_square')
-            .mean()
-            .alias('corr_square_mean'),
-        ).select(
+        rolling_ols_summary(df, window=50)
+        .select(
             pl.col('code'),
             pl.col('date'),
             pl.when(
@@ -169,561 +439,348 @@ def cal_mmt_ols_qrs(df: pl.DataFrame):
             )
             .otherwise(0)
             .alias('mmt_ols_qrs')
-        ).collect()
+        )
     )
 
 
+@register_factor('mmt', intermediates=('minute_in_trade', 'rolling_ols_50'), day_local=True)
 def cal_mmt_ols_corr_square_mean(df: pl.DataFrame):
     """
     分钟qrs衍生回归R方
     50根分钟k线最高价与最低价相关系数平方的均值
     """
-    time_expr = (
-            pl.col('time') // 10000000 * 60
-            + pl.col('time') % 10000000 / 100000
-    ).cast(pl.Int64)
-    trade_minute_expr = (
-        pl.when(time_expr < 720)
-        .then(time_expr - 570)
-        .otherwise(time_expr - 660)
-    )
     return (
-        df.lazy()
-        .with_columns(
-            trade_minute_expr
-            .cast(pl.Int64)
-            .alias('minute_in_trade')
-        )
-        .select(['code', 'date', 'minute_in_trade', 'high', 'low'])
-        .rolling(
-            index_column='minute_in_trade',
-            period='50i',
-            group_by=['code', 'date']
-        ).agg(
-            pl.cov(a='low', b='high', ddof=0).alias('cov'),
-            pl.var(column='low', ddof=0).alias('var_x'),
-            pl.var(column='high', ddof=0).alias('var_y'),
-            pl.len().alias('n')
-        )
-        .filter(pl.col('n') >= 50)
-        .with_columns(
-            pl.when(pl.col('var_x') * pl.col('var_y') != 0)
-            .then(
-                pl.col('cov').pow(2) / (pl.col('var_x') * pl.col('var_y'))
-            )
-            .otherwise(None)
-            .alias('corr_square')
-        ).group_by(['code', 'date']).agg(
-            pl.col('corr_square')
-            .mean()
+        rolling_ols_summary(df, window=50)
+        .select(
+            pl.col('code'),
+            pl.col('date'),
+            pl.col('corr_square_mean')
             .fill_null(0)
             .alias('mmt_ols_corr_square_mean')
-        ).collect()
+        )
     )
 
 
+@register_factor('mmt', intermediates=('minute_in_trade', 'rolling_ols_50'), day_local=True)
 def cal_mmt_ols_corr_mean(df: pl.DataFrame):
     """
     分钟qrs衍生相关系数均值
     50根分钟k线最高价与最低价相关系数的均值
     """
-    time_expr = (
-            pl.col('time') // 10000000 * 60
-            + pl.col('time') % 10000000 / 100000
-    ).cast(pl.Int64)
-    trade_minute_expr = (
-        pl.when(time_expr < 720)
-        .then(time_expr - 570)
-        .otherwise(time_expr - 660)
-    )
     return (
-        df.lazy()
-        .with_columns(
-            trade_minute_expr
-            .cast(pl.Int64)
-            .alias('minute_in_trade')
-        )
-        .select(['code', 'date', 'minute_in_trade', 'high', 'low'])
-        .rolling(
-            index_column='minute_in_trade',
-            period='50i',
-            group_by=['code', 'date']
-        ).agg(
-            pl.cov(a='low', b='high', ddof=0).alias('cov'),
-            pl.var(column='low', ddof=0).alias('var_x'),
-            pl.var(column='high', ddof=0).alias('var_y'),
-            pl.len().alias('n')
-        )
-        .filter(pl.col('n') >= 50)
-        .with_columns(
-            pl.when(pl.col('var_x') * pl.col('var_y') != 0)
-            .then(
-                pl.col('cov') / (pl.col('var_x') * pl.col('var_y')).pow(0.5)
-            )
-            .otherwise(None)
-            .alias('corr')
-        ).group_by(['code', 'date']).agg(
-            pl.col('corr')
-            .mean()
+        rolling_ols_summary(df, window=50)
+        .select(
+            pl.col('code'),
+            pl.col('date'),
+            pl.col('corr_mean')
             .fill_null(0)
             .alias('mmt_ols_corr_mean')
-        ).collect()
+        )
     )
 
 
+@register_factor('mmt', intermediates=('minute_in_trade', 'rolling_ols_50'), day_local=True)
 def cal_mmt_ols_beta_mean(df: pl.DataFrame):
     """
     分钟qrs衍生beta均值
     50根分钟k线最高价与最低价回归系数的均值
     """
-    time_expr = (
-            pl.col('time') // 10000000 * 60
-            + pl.col('time') % 10000000 / 100000
-    ).cast(pl.Int64)
-    trade_minute_expr = (
-        pl.when(time_expr < 720)
-        .then(time_expr - 570)
-        .otherwise(time_expr - 660)
-    )
     return (
-        df.lazy().with_columns(
-            trade_minute_expr
-            .cast(pl.Int64)
-            .alias('minute_in_trade')
-        )
-        .select(['code', 'date', 'minute_in_trade', 'high', 'low'])
-        .rolling(
-            index_column='minute_in_trade',
-            period='50i',
-            group_by=['code', 'date']
-        ).agg(
-            pl.cov(a='low', b='high', ddof=0)
-            .alias('cov'),
-            pl.var(column='low', ddof=0)
-            .alias('var_x'),
-            pl.col('high')
-            .mean()
-            .alias('mean_y'),
-            pl.col('low')
-            .mean()
-            .alias('mean_x'),
-            pl.len()
-            .alias('n')
-        ).filter(pl.col('n') >= 50)
-        .with_columns(
-            pl.when(pl.col('var_x') != 0)
-            .then(pl.col('cov') / pl.col('var_x'))
-            .otherwise(pl.col('mean_y') / pl.col('mean_x'))
-            .alias('beta')
-        )
-        .group_by(['code', 'date']).agg(
-            pl.col('beta')
-            .mean()
+        rolling_ols_summary(df, window=50)
+        .select(
+            pl.col('code'),
+            pl.col('date'),
+            pl.col('beta_mean')
             .alias('mmt_ols_beta_mean')
-        ).collect()
+        )
     )
 
 
+@register_factor('mmt', intermediates=('minute_in_trade', 'rolling_ols_50'), day_local=True)
 def cal_mmt_ols_beta_zscore_last(df: pl.DataFrame):
     """
     分钟qrs衍生beta标准分
     50根分钟k线qrs指标
     """
-    time_expr = (
-            pl.col('time') // 10000000 * 60
-            + pl.col('time') % 10000000 / 100000
-    ).cast(pl.Int64)
-    trade_minute_expr = (
-        pl.when(time_expr < 720)
-        .then(time_expr - 570)
-        .otherwise(time_expr - 660)
-    )
     return (
-        df.lazy().with_columns(
-            trade_minute_expr
-            .cast(pl.Int64)
-            .alias('minute_in_trade')
-        ).select(['code', 'date', 'minute_in_trade', 'high', 'low'])
-        .rolling(
-            index_column='minute_in_trade',
-            period='50i',
-            group_by=['code', 'date']
-        ).agg(
-            pl.col('high')
-            .mean()
-            .alias('mean_y'),
-            pl.col('low')
-            .mean()
-            .alias('mean_x'),
-            pl.cov(a='low', b='high', ddof=0).alias('cov'),
-            pl.var(column='low', ddof=0).alias('var_x'),
-            pl.var(column='high', ddof=0).alias('var_y'),
-            pl.len().alias('n')
-        ).filter(pl.col('n') >= 50)
-        .with_columns(
-            pl.when(pl.col('var_x') != 0)
-            .then(pl.col('cov') / pl.col('var_x'))
-            .otherwise(pl.col('mean_y') / pl.col('mean_x'))
-            .alias('beta')
-        ).group_by(['code', 'date']).agg(
-            pl.when(pl.col('beta').std() > 0)
+        rolling_ols_summary(df, window=50)
+        .select(
+            pl.col('code'),
+            pl.col('date'),
+            pl.when(pl.col('beta_std') > 0)
             .then(
-                (pl.col('beta').last() - pl.col('beta').mean()) / pl.col('beta').std()
+                (pl.col('beta_last') - pl.col('beta_mean')) / pl.col('beta_std')
             )
-            .otherwise(pl.col('beta').mean())
+            .otherwise(pl.col('beta_mean'))
             .alias('mmt_ols_beta_zscore_last')
-        ).collect()
+        )
     )
 
 
+@register_factor(
+    'mmt', columns=('volume',),
+    intermediates=('bar_ret', 'volume_rank'), day_local=True
+)
 def cal_mmt_top50VolumeRet(df: pl.DataFrame):
     """
     50顶量成交动量
     成交量最高50根k线成交量收益率动量
     """
-    return (
-        df.lazy().with_columns(
-            (pl.col('close') / pl.col('open'))
-            .alias('ret')
-        )
-        .filter(
-            (
-                pl.col('volume') >= (
-                    pl.col('volume')
-                    .top_k(50)
-                    .min()
-                )
-            ).over(['code', 'date'])
-        )
-        .group_by(['code', 'date']).agg(
-            (pl.col('ret').product() - 1)
-            .alias('mmt_top50VolumeRet')
-        ).collect()
+    return segment_agg(
+        df,
+        volume_rank_return(50, 'top')
+        .alias('mmt_top50VolumeRet')
     )
 
 
+@register_factor(
+    'mmt', columns=('volume',),
+    intermediates=('bar_ret', 'volume_rank'), day_local=True
+)
 def cal_mmt_bottom50VolumeRet(df: pl.DataFrame):
     """
     50底量成交动量
     最低成交量的50根k线收益率动量
     """
-    return (
-        df.lazy().with_columns(
-            (pl.col('close') / pl.col('open'))
-            .alias('ret')
-        )
-        .filter(
-            (
-                pl.col('volume') <= (
-                    pl.col('volume')
-                    .bottom_k(50)
-                    .max()
-                )
-            ).over(['code', 'date'])
-        )
-        .group_by(['code', 'date']).agg(
-            (pl.col('ret').product() - 1)
-            .alias('mmt_bottom50VolumeRet')
-        ).collect()
+    return segment_agg(
+        df,
+        volume_rank_return(50, 'bottom')
+        .alias('mmt_bottom50VolumeRet')
     )
 
 
+@register_factor(
+    'mmt', columns=('volume',),
+    intermediates=('bar_ret', 'volume_rank'), day_local=True
+)
 def cal_mmt_top20VolumeRet(df: pl.DataFrame):
     """
     20顶量成交动量
     成交量最高20根k线成交量收益率动量
     """
-    return (
-        df.lazy().with_columns(
-            (pl.col('close') / pl.col('open'))
-            .alias('ret')
-        )
-        .filter(
-            (
-                pl.col('volume') >= (
-                    pl.col('volume')
-                    .top_k(20)
-                    .min()
-                )
-            ).over(['code', 'date'])
-        )
-        .group_by(['code', 'date']).agg(
-            (pl.col('ret').product() - 1)
-            .alias('mmt_top20VolumeRet')
-        ).collect()
+    return segment_agg(
+        df,
+        volume_rank_return(20, 'top')
+        .alias('mmt_top20VolumeRet')
     )
 
 
+@register_factor(
+    'mmt', columns=('volume',),
+    intermediates=('bar_ret', 'volume_rank'), day_local=True
+)
 def cal_mmt_bottom20VolumeRet(df: pl.DataFrame):
     """
     20底量成交动量
     最低成交量的20根k线收益率动量
     """
-    return (
-        df.lazy().with_columns(
-            (pl.col('close') / pl.col('open'))
-            .alias('ret')
-        )
-        .filter(
-            (
-                pl.col('volume') <= (
-                    pl.col('volume')
-                    .bottom_k(50)
-                    .max()
-                )
-            ).over(['code', 'date'])
-        )
-        .group_by(['code', 'date']).agg(
-            (pl.col('ret').product() - 1)
-            .alias('mmt_bottom20VolumeRet')
-        ).collect()
+    return segment_agg(
+        df,
+        volume_rank_return(20, 'bottom')
+        .alias('mmt_bottom20VolumeRet')
     )
 
 
 # 波动率
 
+@register_factor('vol', columns=('volume',), day_local=True)
 def cal_vol_volume1min(df: pl.DataFrame):
     """
     分钟成交量的标准差
     日内分钟k线成交量的标准差
     """
-    return (
-        df.group_by(['code', 'date']).agg(
-            pl.col('volume')
-            .std()
-            .alias('vol_volume1min')
-        )
+    return segment_agg(
+        df,
+        pl.col('volume')
+        .std()
+        .alias('vol_volume1min')
     )
 
 
+@register_factor('vol', columns=('high', 'low'), day_local=True)
 def cal_vol_range1min(df: pl.DataFrame):
     """
     分钟极比的标准差
     分钟k线的最大值最小值比值的标准差
     """
-    return (
-        df.select(
-            pl.col('code'),
-            pl.col('date'),
-            (pl.col('high') / pl.col('low'))
-            .alias('range')
-        ).group_by(['code', 'date']).agg(
-            pl.col('range')
-            .std()
-            .alias('vol_range1min')
-        )
+    return segment_agg(
+        df,
+        (pl.col('high') / pl.col('low'))
+        .std()
+        .alias('vol_range1min')
     )
 
 
+@register_factor('vol', intermediates=('bar_ret',), day_local=True)
 def cal_vol_return1min(df: pl.DataFrame):
     """
     分钟收益率的标准差
     日内分钟收益率的标准差
     """
-    return (
-        df.select(
-            pl.col('code'),
-            pl.col('date'),
-            (pl.col('close') / pl.col('open') - 1)
-            .alias('return')
-        ).group_by(['code', 'date']).agg(
-            pl.col('return')
-            .std()
-            .alias('vol_return1min')
-        )
+    vol_return1min = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_std('bar_ret')
+        .alias('vol_return1min')
     )
+    return vol_return1min
 
 
+@register_factor('vol', intermediates=('bar_ret',), day_local=True)
 def cal_vol_upVol(df: pl.DataFrame):
     """
     上行波动率
     使用日内分钟级别数据，计算分钟级上行波动率
     """
-    return (
-        df.select(
-            pl.col('code'),
-            pl.col('date'),
-            (pl.col('close') / pl.col('open') - 1)
-            .alias('return')
-        )
-        .with_columns(
-            pl.when(pl.col('return') > 0)
-            .then(pl.col('return'))
-            .otherwise(None)
-            .alias('up_return')
-        ).group_by(['code', 'date']).agg(
-            pl.col('up_return')
-            .std()
-            .fill_null(0)
-            .alias('vol_upVol')
-        )
+    vol_up_vol = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_std('bar_ret_up')
+        .fill_null(0)
+        .alias('vol_upVol')
     )
+    return vol_up_vol
 
 
+@register_factor('vol', intermediates=('bar_ret',), day_local=True)
 def cal_vol_upRatio(df: pl.DataFrame):
     """
     上行波动率占比
     使用日内分钟级别数据，计算分钟级上行波动率占总波动的比例
     """
-    return (
-        df.select(
-            pl.col('code'),
-            pl.col('date'),
-            (pl.col('close') / pl.col('open') - 1)
-            .alias('return')
-        )
-        .with_columns(
-            pl.when(pl.col('return') > 0)
-            .then(pl.col('return'))
-            .otherwise(None)
-            .alias('up_return')
-        ).group_by(['code', 'date']).agg(
-            (
-                pl.col('up_return')
-                .std()
-                .fill_null(0) / pl.col('return').std()
-            )
-            .alias('vol_upRatio')
+    vol_up_ratio = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        (
+            moment_std('bar_ret_up')
+            .fill_null(0) / moment_std('bar_ret')
         )
+        .alias('vol_upRatio')
     )
+    return vol_up_ratio
 
 
+@register_factor('vol', intermediates=('bar_ret',), day_local=True)
 def cal_vol_downVol(df: pl.DataFrame):
     """
     下行波动率
     使用日内分钟级别数据，计算分钟级下行波动率
     """
-    return (
-        df.select(
-            pl.col('code'),
-            pl.col('date'),
-            (pl.col('close') / pl.col('open') - 1)
-            .alias('return')
-        )
-        .with_columns(
-            pl.when(pl.col('return') < 0)
-            .then(pl.col('return'))
-            .otherwise(None)
-            .alias('down_return')
-        ).group_by(['code', 'date']).agg(
-            pl.col('down_return')
-            .std()
-            .fill_null(0)
-            .alias('vol_downVol')
-        )
+    vol_down_vol = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_std('bar_ret_down')
+        .fill_null(0)
+        .alias('vol_downVol')
     )
+    return vol_down_vol
 
 
+@register_factor('vol', intermediates=('bar_ret',), day_local=True)
 def cal_vol_downRatio(df: pl.DataFrame):
     """
     下行波动率占比
     使用日内分钟级别数据，计算分钟级下行波动率占总波动的比例
     """
-    return (
-        df.select(
-            pl.col('code'),
-            pl.col('date'),
-            (pl.col('close') / pl.col('open') - 1)
-            .alias('return')
-        )
-        .with_columns(
-            pl.when(pl.col('return') < 0)
-            .then(pl.col('return'))
-            .otherwise(None)
-            .alias('down_return')
-        ).group_by(['code', 'date']).agg(
-            (
-                pl.col('down_return')
-                .std()
-                .fill_null(0) / pl.col('return').std()
-            )
-            .alias('vol_downRatio')
+    vol_down_ratio = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        (
+            moment_std('bar_ret_down')
+            .fill_null(0) / moment_std('bar_ret')
         )
+        .alias('vol_downRatio')
     )
+    return vol_down_ratio
 
 
 # 高阶特征
 
+@register_factor('shape', intermediates=('bar_ret',), day_local=True)
 def cal_shape_skew(df: pl.DataFrame):
     """
     分钟收益率偏度
     分钟k线收益率的偏度
     """
-    shape_skew = df.group_by(['code', 'date']).agg(
-        (pl.col('close') / pl.col('open') - 1)
-        .skew()
+    shape_skew = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_skew('bar_ret')
         .alias('shape_skew')
     )
     return shape_skew
 
 
+@register_factor('shape', intermediates=('bar_ret',), day_local=True)
 def cal_shape_kurt(df: pl.DataFrame):
     """
     分钟收益率峰度
     分钟k线收益率的峰度
     """
-    shape_kurt = df.group_by(['code', 'date']).agg(
-        (pl.col('close') / pl.col('open') - 1)
-        .kurtosis()
+    shape_kurt = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_kurt('bar_ret')
         .alias('shape_kurt')
     )
     return shape_kurt
 
 
+@register_factor('shape', intermediates=('bar_ret',), day_local=True)
 def cal_shape_skratio(df: pl.DataFrame):
     """
     分钟收益率峰度偏度比
     分钟k线收益率的峰度与偏度的比值
     """
-    df = df.select(
-        'code',
-        'date',
-        (pl.col('close') / pl.col('open') - 1).alias('return')
-    )
-    shape_skratio = df.group_by(['date', 'code']).agg(
-        (pl.col('return').skew() / pl.col('return').kurtosis())
+    shape_skratio = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        (moment_skew('bar_ret') / moment_kurt('bar_ret'))
         .alias('shape_skratio')
     )
     return shape_skratio
 
 
+@register_factor('shape', intermediates=('volume_share',), day_local=True)
 def cal_shape_skewVol(df: pl.DataFrame):
     """
     分钟成交量占比的偏度
     分钟k线成交量占比的偏度
     """
-    shape_skew_vol = df.group_by(['code', 'date']).agg(
-        (pl.col('volume') / pl.col('volume').sum())
-        .skew()
+    shape_skew_vol = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_skew('volume_share')
         .alias('shape_skewVol')
     )
     return shape_skew_vol
 
 
+@register_factor('shape', intermediates=('volume_share',), day_local=True)
 def cal_shape_kurtVol(df: pl.DataFrame):
     """
     分钟成交量占比的峰度
     分钟k线成交量占比的峰度
     """
-    shape_kurt_vol = df.group_by(['code', 'date']).agg(
-        (pl.col('volume') / pl.col('volume').sum())
-        .kurtosis()
+    shape_kurt_vol = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        moment_kurt('volume_share')
         .alias('shape_kurtVol')
     )
     return shape_kurt_vol
 
 
+@register_factor('shape', intermediates=('volume_share',), day_local=True)
 def cal_shape_skratioVol(df: pl.DataFrame):
     """
     分钟成交量占比峰度偏度比
     分钟k线成交量占比的峰度与偏度的比值
     """
-    shape_skratio_vol = df.with_columns(
-        (pl.col('volume') / pl.col('volume').sum())
-        .over(['code', 'date'])
-        .alias('volume_d')
-    ).group_by(['code', 'date']).agg(
-        (pl.col('volume_d').skew() / pl.col('volume_d').kurtosis())
+    shape_skratio_vol = power_sums(df).select(
+        pl.col('code'),
+        pl.col('date'),
+        (moment_skew('volume_share') / moment_kurt('volume_share'))
         .alias('shape_skratioVol')
     )
     return shape_skratio_vol
@@ -731,6 +788,7 @@ def cal_shape_skratioVol(df: pl.DataFrame):
 
 # 流动性
 
+@register_factor('liq', columns=('close', 'volume'))
 def cal_liq_amihud_1min(df: pl.DataFrame):
     """
     Amihud非流动性因子
@@ -761,58 +819,63 @@ def cal_liq_amihud_1min(df: pl.DataFrame):
     return liq_amihud_1min
 
 
+@register_factor('liq', columns=('time', 'volume'), intermediates=('session',), day_local=True)
 def cal_liq_closeprevol(df: pl.DataFrame):
     """
     集合竞价前成交量
     计算集合竞价前的成交量
     """
-    liq_closeprevol = (
-        df.filter(pl.col('time') < 145700000)
-        .group_by(['code', 'date']).agg(
-            pl.col('volume').sum().alias('liq_closeprevol')
-        )
+    liq_closeprevol = segment_agg(
+        df.filter(pl.col('session') < SESSION_CLOSE_AUCTION),
+        pl.col('volume').sum().alias('liq_closeprevol')
     )
     return liq_closeprevol
 
 
+@register_factor(
+    'liq', columns=('time', 'volume'),
+    time_window=(145700000, None), intermediates=('session',), day_local=True
+)
 def cal_liq_closevol(df: pl.DataFrame):
     """
     收盘前3分钟成交量
     计算收盘前3分钟成交量
     """
-    liq_closevol = (
-        df.filter(pl.col('time') >= 145700000)
-        .group_by(['code', 'date']).agg(
-            pl.col('volume').sum().alias('liq_closevol')
-        )
+    liq_closevol = segment_agg(
+        df.filter(pl.col('session') == SESSION_CLOSE_AUCTION),
+        pl.col('volume').sum().alias('liq_closevol')
     )
     return liq_closevol
 
 
+@register_factor('liq', columns=('volume',), day_local=True)
 def cal_liq_firstCallR(df: pl.DataFrame):
     """
     开盘集合竞价成交量占比
     使用日内tick数据计算上午开盘9：25之前的集合竞价总交易量占全天交易量的比例
     改为使用分钟频数据计算
     """
-    liq_first_call_r = df.group_by(['code', 'date']).agg(
+    liq_first_call_r = segment_agg(
+        df,
         (pl.col('volume').first() / pl.col('volume').sum())
         .alias('liq_firstCallR')
     )
     return liq_first_call_r
 
 
+@register_factor('liq', columns=('time', 'volume'), intermediates=('session',), day_local=True)
 def cal_liq_lastCallR(df: pl.DataFrame):
     """
     收盘集合竞价成交量占比
     使用日内tick数据计算下午收盘前14：57-15：00的集合竞价的总交易量占全天交易量的比例
     改为使用分钟频数据计算
     """
-    liq_last_call_r = df.group_by(['code', 'date']).agg(
+    liq_last_call_r = segment_agg(
+        df,
         (
             (
                 pl.col("volume")
-                .filter(pl.col("time") >= 145700000)
+                .filter(pl.col('session') == SESSION_CLOSE_AUCTION)
                 .sum()
             ) / pl.col('volume').sum()
         ).alias('liq_lastCallR')
@@ -820,12 +883,14 @@ def cal_liq_lastCallR(df: pl.DataFrame):
     return liq_last_call_r
 
 
+@register_factor('liq', columns=('volume',), time_window=(None, 93000000), day_local=True)
 def cal_liq_openvol(df: pl.DataFrame):
     """
     开盘集合竞价成交量
     计算开盘集合竞价成交量
     """
-    liq_openvol = df.group_by(['code', 'date']).agg(
+    liq_openvol = segment_agg(
+        df,
         pl.col('volume').first().alias('liq_openvol')
     )
     return liq_openvol
@@ -833,12 +898,14 @@ def cal_liq_openvol(df: pl.DataFrame):
 
 # 量价相关性
 
+@register_factor('corr', columns=('close', 'volume'), day_local=True)
 def cal_corr_prv(df: pl.DataFrame):
     """
     计算分钟收益率与成交量相关系数
     计算分钟收益率与成交量相关系数
     """
-    corr_prv = df.group_by(['code', 'date']).agg(
+    corr_prv = segment_agg(
+        df,
         pl.corr(
             pl.col('close').pct_change(),
             pl.col('volume')
@@ -847,6 +914,7 @@ def cal_corr_prv(df: pl.DataFrame):
     return corr_prv
 
 
+@register_factor('corr', columns=('close', 'volume'))
 def cal_corr_prvr(df: pl.DataFrame):
     """
     分钟收益率与成交量变化率相关系数
@@ -874,12 +942,14 @@ def cal_corr_prvr(df: pl.DataFrame):
     return corr_prvr
 
 
+@register_factor('corr', columns=('close', 'volume'), day_local=True)
 def cal_corr_pv(df: pl.DataFrame):
     """
     分钟收盘价与成交量相关系数
     计算分钟收盘价与成交量相关系数
     """
-    corr_pv = df.group_by(['code', 'date']).agg(
+    corr_pv = segment_agg(
+        df,
         pl.corr(
             pl.col('close'),
             pl.col('volume')
@@ -888,12 +958,14 @@ def cal_corr_pv(df: pl.DataFrame):
     return corr_pv
 
 
+@register_factor('corr', columns=('close', 'volume'), day_local=True)
 def cal_corr_pvd(df: pl.DataFrame):
     """
     分钟收盘价与滞后成交量相关系数
     计算分钟收盘价与滞后成交量相关系数
     """
-    corr_pvd = df.group_by(['code', 'date']).agg(
+    corr_pvd = segment_agg(
+        df,
         pl.corr(
             pl.col('close'),
             pl.col('volume').shift(1)
@@ -902,12 +974,14 @@ def cal_corr_pvd(df: pl.DataFrame):
     return corr_pvd
 
 
+@register_factor('corr', columns=('close', 'volume'), day_local=True)
 def cal_corr_pvl(df: pl.DataFrame):
     """
     分钟收盘价与领先成交量相关系数
     计算分钟收盘价与领先成交量相关系数
     """
-    corr_pvl = df.group_by(['code', 'date']).agg(
+    corr_pvl = segment_agg(
+        df,
         pl.corr(
             pl.col('close'),
             pl.col('volume').shift(-1)
@@ -916,14 +990,14 @@ def cal_corr_pvl(df: pl.DataFrame):
     return corr_pvl
 
 
+@register_factor('corr', columns=('close', 'volume'), day_local=True)
 def cal_corr_pvr(df: pl.DataFrame):
     """
     分钟收盘价与成交量变化率相关系数
     计算分钟收盘价与成交量变化率相关系数
     """
-    corr_pvr = df.filter(
-        pl.col('volume') != 0
-    ).group_by(['code', 'date']).agg(
+    corr_pvr = segment_agg(
+        df.filter(pl.col('volume') != 0),
         pl.corr(
             pl.col('close'),
             pl.col('volume').pct_change()
@@ -934,284 +1008,281 @@ def cal_corr_pvr(df: pl.DataFrame):
 
 # 筹码分布
 
-def cal_doc_kurt(df: pl.DataFrame):
+# 由筹码分布计算的doc_*因子的bin_width为分箱宽度，None表示每个不同的close_last_ratio为一组（见chip_distribution），
+# 需要分箱时以factor_with_params绑定，如factor_with_params('doc_std', bin_width=0.001)
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_kurt(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码峰度
     计算分钟级k线数据按照收益率分布成交量分布的峰度
     """
-    doc_kurt = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .alias("return")
-        ).group_by(["code", "date", "return"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col("volume_d")
-            .kurtosis()
-            .alias("doc_kurt")
-        )
+    doc_kurt = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        moments={'doc_kurt': 'kurt'}
     )
     return doc_kurt
 
 
-def cal_doc_skew(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_skew(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码偏度
     计算分钟级k线数据按照收益率分布成交量分布的偏度
     """
-    doc_skew = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .alias("return")
-        ).group_by(["code", "date", "return"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col("volume_d")
-            .skew()
-            .alias("doc_skew")
-        )
+    doc_skew = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        moments={'doc_skew': 'skew'}
     )
     return doc_skew
 
 
-def cal_doc_std(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_std(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码标准差
     计算分钟级k线数据按照收益率分布成交量分布的标准差
     """
-    doc_std = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .alias("return")
-        ).group_by(["code", "date", "return"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col("volume_d")
-            .skew()
-            .alias("doc_std")
-        )
+    doc_std = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        moments={'doc_std': 'std'}
     )
     return doc_std
 
 
-def cal_doc_pdf60(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',))
+def cal_doc_pdf60(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码60%占比收益率分位
-    计算分钟收益率分组筹码60%占比收益率分位
-    """
-    doc_pdf60 = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .rank()
-            .alias("return_rank")
-        ).group_by(["code", "date", "return_rank"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col('return_rank').filter(
-                pl.col("volume_d")
-                .cum_sum() > 0.6
-            ).sort()
-            .first()
-            .alias('doc_pdf60')
-        )
+    按收益率在当日全部k线中的排名从小到大累计筹码，首次超过60%时的排名
+    """
+    doc_pdf60 = chip_distribution_stats(
+        chip_distribution(df, bin_width, rank=True),
+        quantiles={'doc_pdf60': 0.6}
     )
     return doc_pdf60
 
 
-def cal_doc_pdf70(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',))
+def cal_doc_pdf70(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码70%占比收益率分位
-    计算分钟收益率分组筹码70%占比收益率分位
-    """
-    doc_pdf70 = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .rank()
-            .alias("return_rank")
-        ).group_by(["code", "date", "return_rank"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col('return_rank').filter(
-                pl.col("volume_d")
-                .cum_sum() > 0.7
-            ).sort()
-            .first()
-            .alias('doc_pdf70')
-        )
+    按收益率在当日全部k线中的排名从小到大累计筹码，首次超过70%时的排名
+    """
+    doc_pdf70 = chip_distribution_stats(
+        chip_distribution(df, bin_width, rank=True),
+        quantiles={'doc_pdf70': 0.7}
     )
     return doc_pdf70
 
 
-def cal_doc_pdf80(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',))
+def cal_doc_pdf80(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码80%占比收益率分位
-    计算分钟收益率分组筹码80%占比收益率分位
-    """
-    doc_pdf80 = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .rank()
-            .alias("return_rank")
-        ).group_by(["code", "date", "return_rank"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col('return_rank').filter(
-                pl.col("volume_d")
-                .cum_sum() > 0.8
-            ).sort()
-            .first()
-            .alias('doc_pdf80')
-        )
+    按收益率在当日全部k线中的排名从小到大累计筹码，首次超过80%时的排名
+    """
+    doc_pdf80 = chip_distribution_stats(
+        chip_distribution(df, bin_width, rank=True),
+        quantiles={'doc_pdf80': 0.8}
     )
     return doc_pdf80
 
 
-def cal_doc_pdf90(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',))
+def cal_doc_pdf90(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码90%占比收益率分位
-    计算分钟收益率分组筹码90%占比收益率分位
-    """
-    doc_pdf90 = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .rank()
-            .alias("return_rank")
-        ).group_by(["code", "date", "return_rank"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col('return_rank').filter(
-                pl.col("volume_d")
-                .cum_sum() > 0.9
-            ).sort()
-            .first()
-            .alias('doc_pdf90')
-        )
+    按收益率在当日全部k线中的排名从小到大累计筹码，首次超过90%时的排名
+    """
+    doc_pdf90 = chip_distribution_stats(
+        chip_distribution(df, bin_width, rank=True),
+        quantiles={'doc_pdf90': 0.9}
     )
     return doc_pdf90
 
 
-def cal_doc_pdf95(df: pl.DataFrame):
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',))
+def cal_doc_pdf95(df: pl.DataFrame, bin_width: float = None):
     """
     分钟收益率分组筹码95%占比收益率分位
-    计算分钟收益率分组筹码95%占比收益率分位
-    """
-    doc_pdf95 = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .rank()
-            .alias("return_rank")
-        ).group_by(["code", "date", "return_rank"]).agg(
-            pl.col("volume_d")
-            .sum()
-        ).group_by(["code", "date"]).agg(
-            pl.col('return_rank').filter(
-                pl.col("volume_d")
-                .cum_sum() > 0.95
-            ).sort()
-            .first()
-            .alias('doc_pdf95')
-        )
+    按收益率在当日全部k线中的排名从小到大累计筹码，首次超过95%时的排名
+    """
+    doc_pdf95 = chip_distribution_stats(
+        chip_distribution(df, bin_width, rank=True),
+        quantiles={'doc_pdf95': 0.95}
     )
     return doc_pdf95
 
 
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_pdf60_level(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码60%占比收益率水平
+    按收益率从小到大累计筹码，首次超过60%时的收益率（close_last_ratio），与doc_pdf60的截面排序一致且只依赖当日本股数据
+    """
+    doc_pdf60_level = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        quantiles={'doc_pdf60_level': 0.6}
+    )
+    return doc_pdf60_level
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_pdf70_level(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码70%占比收益率水平
+    按收益率从小到大累计筹码，首次超过70%时的收益率（close_last_ratio），与doc_pdf70的截面排序一致且只依赖当日本股数据
+    """
+    doc_pdf70_level = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        quantiles={'doc_pdf70_level': 0.7}
+    )
+    return doc_pdf70_level
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_pdf80_level(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码80%占比收益率水平
+    按收益率从小到大累计筹码，首次超过80%时的收益率（close_last_ratio），与doc_pdf80的截面排序一致且只依赖当日本股数据
+    """
+    doc_pdf80_level = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        quantiles={'doc_pdf80_level': 0.8}
+    )
+    return doc_pdf80_level
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_pdf90_level(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码90%占比收益率水平
+    按收益率从小到大累计筹码，首次超过90%时的收益率（close_last_ratio），与doc_pdf90的截面排序一致且只依赖当日本股数据
+    """
+    doc_pdf90_level = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        quantiles={'doc_pdf90_level': 0.9}
+    )
+    return doc_pdf90_level
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_pdf95_level(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码95%占比收益率水平
+    按收益率从小到大累计筹码，首次超过95%时的收益率（close_last_ratio），与doc_pdf95的截面排序一致且只依赖当日本股数据
+    """
+    doc_pdf95_level = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        quantiles={'doc_pdf95_level': 0.95}
+    )
+    return doc_pdf95_level
+
+
+@register_factor('doc', intermediates=('volume_share',), day_local=True)
 def cal_doc_vol10_ratio(df: pl.DataFrame):
     """
     分钟收益率分组筹码前10大占比
-    计算分钟收益率分组筹码前10大占比
-    """
-    doc_vol10_ratio = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .alias("return")
-        ).group_by(['code', 'date']).agg(
-            pl.col('volume_d')
-            .top_k(10)
-            .sum()
-            .alias('doc_vol10_ratio')
-        )
+    成交量占比最大的10根k线的占比之和
+    """
+    doc_vol10_ratio = segment_agg(
+        df,
+        pl.col('volume_share')
+        .top_k(10)
+        .sum()
+        .alias('doc_vol10_ratio')
     )
     return doc_vol10_ratio
 
 
+@register_factor('doc', intermediates=('volume_share',), day_local=True)
 def cal_doc_vol5_ratio(df: pl.DataFrame):
     """
     分钟收益率分组筹码前5大占比
-    计算分钟收益率分组筹码前5大占比
-    """
-    doc_vol5_ratio = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .alias("return")
-        ).group_by(['code', 'date']).agg(
-            pl.col('volume_d')
-            .top_k(5)
-            .sum()
-            .alias('doc_vol5_ratio')
-        )
+    成交量占比最大的5根k线的占比之和
+    """
+    doc_vol5_ratio = segment_agg(
+        df,
+        pl.col('volume_share')
+        .top_k(5)
+        .sum()
+        .alias('doc_vol5_ratio')
     )
     return doc_vol5_ratio
 
 
+@register_factor('doc', intermediates=('volume_share',), day_local=True)
 def cal_doc_vol50_ratio(df: pl.DataFrame):
     """
     分钟收益率分组筹码前50大占比
-    计算分钟收益率分组筹码前50大占比
-    """
-    doc_vol50_ratio = (
-        df.with_columns(
-            (pl.col("volume") / pl.col("volume").sum().over(["code", "date"]))
-            .alias("volume_d"),
-            (pl.col("close").last().over(["code", "date"]) / pl.col("close"))
-            .alias("return")
-        ).group_by(['code', 'date']).agg(
-            pl.col('volume_d')
-            .top_k(5)
-            .sum()
-            .alias('doc_vol50_ratio')
-        )
+    成交量占比最大的50根k线的占比之和
+    """
+    doc_vol50_ratio = segment_agg(
+        df,
+        pl.col('volume_share')
+        .top_k(50)
+        .sum()
+        .alias('doc_vol50_ratio')
     )
     return doc_vol50_ratio
 
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_vol10_bin_ratio(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码前10大组占比
+    收盘价相对收益相同（或同一分箱）的k线合为一组，筹码最多的10组的占比之和
+    """
+    doc_vol10_bin_ratio = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        top_n={'doc_vol10_bin_ratio': 10}
+    )
+    return doc_vol10_bin_ratio
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_vol5_bin_ratio(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码前5大组占比
+    收盘价相对收益相同（或同一分箱）的k线合为一组，筹码最多的5组的占比之和
+    """
+    doc_vol5_bin_ratio = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        top_n={'doc_vol5_bin_ratio': 5}
+    )
+    return doc_vol5_bin_ratio
+
+
+@register_factor('doc', columns=('volume',), intermediates=('close_last_ratio',), day_local=True)
+def cal_doc_vol50_bin_ratio(df: pl.DataFrame, bin_width: float = None):
+    """
+    分钟收益率分组筹码前50大组占比
+    收盘价相对收益相同（或同一分箱）的k线合为一组，筹码最多的50组的占比之和
+    """
+    doc_vol50_bin_ratio = chip_distribution_stats(
+        chip_distribution(df, bin_width),
+        top_n={'doc_vol50_bin_ratio': 50}
+    )
+    return doc_vol50_bin_ratio
+
 # 资金成交
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    time_window=(144000000, None), intermediates=('bar_ret', 'minute_in_trade')
+)
 def cal_trade_bottom20retRatio(df: pl.DataFrame):
     """
     后20k线收益率成交占比
     后20根k线每根的收益率乘以其成交量所占比例，得到的加权收益率之和
     """
     trade_bottom20retRatio = (
-        df.lazy().filter(pl.col('time') >= 144000000)
+        df.lazy().filter(pl.col('minute_in_trade') >= trade_minute(144000000))
         .with_columns(
-            (pl.col('close') / pl.col('open') - 1)
+            pl.col('bar_ret')
             .alias('ret'),
             (pl.col('volume') / (pl.col('volume').sum().over('code') + 1))
             .alias('volume_d')
@@ -1224,15 +1295,19 @@ def cal_trade_bottom20retRatio(df: pl.DataFrame):
     return trade_bottom20retRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    time_window=(141000000, None), intermediates=('bar_ret', 'minute_in_trade')
+)
 def cal_trade_bottom50retRatio(df: pl.DataFrame):
     """
     后50k线收益率成交占比
     后50根k线每根的收益率乘以其成交量所占比例，得到的加权收益率之和
     """
     trade_bottom50retRatio = (
-        df.lazy().filter(pl.col('time') >= 141000000)
+        df.lazy().filter(pl.col('minute_in_trade') >= trade_minute(141000000))
         .with_columns(
-            (pl.col('close') / pl.col('open') - 1)
+            pl.col('bar_ret')
             .alias('ret'),
             (pl.col('volume') / (
                 pl.when(pl.col('volume').sum().over('code') == 0)
@@ -1248,6 +1323,10 @@ def cal_trade_bottom50retRatio(df: pl.DataFrame):
     return trade_bottom50retRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    intermediates=('minute_in_trade',), day_local=True
+)
 def cal_trade_headRatio(df: pl.DataFrame):
     """
     开盘成交占比
@@ -1255,12 +1334,13 @@ def cal_trade_headRatio(df: pl.DataFrame):
     """
     trade_headRatio = (
         df.lazy().with_columns(
-            pl.when(pl.col('time') <= 100000000)
+            pl.when(pl.col('minute_in_trade') <= trade_minute(100000000))
             .then(pl.col('volume'))
             .otherwise(0)
             .alias('headVolume')
         )
-        .group_by(['code', 'date']).agg(
+        .pipe(
+            segment_agg,
             pl.col('headVolume')
             .sum(),
             pl.col('volume')
@@ -1272,11 +1352,15 @@ def cal_trade_headRatio(df: pl.DataFrame):
             .then(pl.col('headVolume') / pl.col('volume'))
             .otherwise(0.125)
             .alias('trade_headRatio')
-        ).collect()
+        )
     )
     return trade_headRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    intermediates=('minute_in_trade',), day_local=True
+)
 def cal_trade_tailRatio(df: pl.DataFrame):
     """
     尾盘成交占比
@@ -1284,12 +1368,13 @@ def cal_trade_tailRatio(df: pl.DataFrame):
     """
     trade_tailRatio = (
         df.lazy().with_columns(
-            pl.when(pl.col('time') >= 143000000)
+            pl.when(pl.col('minute_in_trade') >= trade_minute(143000000))
             .then(pl.col('volume'))
             .otherwise(0)
             .alias('tailVolume')
         )
-        .group_by(['code', 'date']).agg(
+        .pipe(
+            segment_agg,
             pl.col('tailVolume')
             .sum(),
             pl.col('volume')
@@ -1301,25 +1386,30 @@ def cal_trade_tailRatio(df: pl.DataFrame):
             .then(pl.col('tailVolume') / pl.col('volume'))
             .otherwise(0.125)
             .alias('trade_tailRatio')
-        ).collect()
+        )
     )
     return trade_tailRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    time_window=(None, 95000000), intermediates=('bar_ret', 'minute_in_trade'), day_local=True
+)
 def cal_trade_top20retRatio(df: pl.DataFrame):
     """
     前20K线收益率成交占比
     前20根K线中，收益率与成交量比例的均值
     """
     trade_top20retRatio = (
-        df.filter(pl.col('time') <= 95000000)
+        df.filter(pl.col('minute_in_trade') <= trade_minute(95000000))
         .with_columns(
-            (pl.col('volume') / pl.col('volume').sum().over(['code', 'date']))
+            (pl.col('volume') / pl.col('volume').sum().over(segment_keys(df)))
             .alias('volume_d'),
-            (pl.col('close') / pl.col('open') - 1)
+            pl.col('bar_ret')
             .alias('pct_change')
         )
-        .group_by(['code', 'date']).agg(
+        .pipe(
+            segment_agg,
             (pl.col('pct_change') / pl.col('volume_d'))
             .mean()
             .alias('trade_top20retRatio')
@@ -1328,20 +1418,25 @@ def cal_trade_top20retRatio(df: pl.DataFrame):
     return trade_top20retRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    time_window=(None, 102000000), intermediates=('bar_ret', 'minute_in_trade'), day_local=True
+)
 def cal_trade_top50retRatio(df: pl.DataFrame):
     """
     前50K线收益率成交占比
     前50根K线中，收益率与成交量比例的均值
     """
     trade_top50retRatio = (
-        df.filter(pl.col('time') <= 102000000)
+        df.filter(pl.col('minute_in_trade') <= trade_minute(102000000))
         .with_columns(
-            (pl.col('volume') / pl.col('volume').sum().over(['code', 'date']))
+            (pl.col('volume') / pl.col('volume').sum().over(segment_keys(df)))
             .alias('volume_d'),
-            (pl.col('close') / pl.col('open') - 1)
+            pl.col('bar_ret')
             .alias('pct_change')
         )
-        .group_by(['code', 'date']).agg(
+        .pipe(
+            segment_agg,
             (pl.col('pct_change') / pl.col('volume_d'))
             .mean()
             .alias('trade_top50retRatio')
@@ -1350,20 +1445,25 @@ def cal_trade_top50retRatio(df: pl.DataFrame):
     return trade_top50retRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    time_window=(None, 95000000), intermediates=('bar_ret', 'minute_in_trade'), day_local=True
+)
 def cal_trade_topNeg20retRatio(df: pl.DataFrame):
     """
     前20K线下跌收益率成交占比
     前20根K线中，收益率为负的绝对平均收益率与成交量比例的均值
     """
     trade_topNeg20retRatio = (
-        df.filter(pl.col('time') <= 95000000)
+        df.filter(pl.col('minute_in_trade') <= trade_minute(95000000))
         .with_columns(
-            (pl.col('volume') / pl.col('volume').sum().over(['code', 'date']))
+            (pl.col('volume') / pl.col('volume').sum().over(segment_keys(df)))
             .alias('volume_d'),
-            (pl.col('close') / pl.col('open') - 1)
+            pl.col('bar_ret')
             .alias('pct_change')
         )
-        .group_by(['code', 'date']).agg(
+        .pipe(
+            segment_agg,
             (
                 (
                     pl.when(pl.col('pct_change') < 0)
@@ -1378,20 +1478,25 @@ def cal_trade_topNeg20retRatio(df: pl.DataFrame):
     return trade_topNeg20retRatio
 
 
+@register_factor(
+    'trade', columns=('time', 'volume'),
+    time_window=(None, 95000000), intermediates=('bar_ret', 'minute_in_trade'), day_local=True
+)
 def cal_trade_topPos20retRatio(df: pl.DataFrame):
     """
     前20K线上涨收益率成交占比
     前20根K线中，收益率为正的平均收益率与成交量比例的均值
     """
     trade_topPos20retRatio = (
-        df.filter(pl.col('time') <= 95000000)
+        df.filter(pl.col('minute_in_trade') <= trade_minute(95000000))
         .with_columns(
-            (pl.col('volume') / pl.col('volume').sum().over(['code', 'date']))
+            (pl.col('volume') / pl.col('volume').sum().over(segment_keys(df)))
             .alias('volume_d'),
-            (pl.col('close') / pl.col('open') - 1)
+            pl.col('bar_ret')
             .alias('pct_change')
         )
-        .group_by(['code', 'date']).agg(
+        .pipe(
+            segment_agg,
             (
                 (
                     pl.when(pl.col('pct_change') > 0)
@@ -0,0 +1,176 @@
+from MinuteFrequentFactorCache import ExposureCache
+from FactorCodes import decode_exposure
+import os
+import json
+import shutil
+import datetime
+import tempfile
+import polars as pl
+from typing import Callable, Optional
+
+"""
+    ========================
+        分钟频因子计算检查点
+    ========================
+"""
+
+
+class Checkpoint:
+    def __init__(self, checkpoint_dir: str = None):
+        r"""
+        因子计算的检查点：每个交易日的结果在完成时立即写入磁盘，运行中断后重新运行只计算未完成的日期；
+        计算失败的日期记录在重试清单中，下次运行时自动重试，成功后移出清单。
+        目录结构为checkpoint_dir/因子名/YYYYMMDD.parquet，_manifest.json记录各因子计算方法的指纹与重试清单，
+        因子计算方法变化时该因子的检查点失效。
+        检查点只在父进程中读写；结果写入ExposureStore后自动清空，保存为parquet后需调用clear清空
+        :param checkpoint_dir: 检查点文件夹，默认为'D:\QuantData\MinuteFreqFactor\checkpoint'
+        """
+        if checkpoint_dir is None:
+            checkpoint_dir = r'D:\QuantData\MinuteFreqFactor\checkpoint'
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint_dir = checkpoint_dir
+        self._manifest = None
+
+    @property
+    def manifest(self) -> dict:
+        """
+        {'methods': {因子名: 计算方法指纹}, 'failures': {文件名: {'factors', 'attempts', 'last_attempt'}}}
+        """
+        if self._manifest is None:
+            path = os.path.join(self.checkpoint_dir, '_manifest.json')
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {'methods': {}, 'failures': {}}
+        return self._manifest
+
+    def _write_manifest(self):
+        with tempfile.NamedTemporaryFile(
+                mode='w', dir=self.checkpoint_dir, delete=False, suffix='.tmp', encoding='utf-8'
+        ) as tmp:
+            json.dump(self.manifest, tmp, indent=2, ensure_ascii=False)
+            temp_path = tmp.name
+        os.replace(temp_path, os.path.join(self.checkpoint_dir, '_manifest.json'))
+
+    def bind(self, factor_name: str, calculate_method: Callable):
+        """
+        登记因子的计算方法，指纹与已登记的不同时清空该因子的检查点
+        :param factor_name: 因子名
+        :param calculate_method: 因子计算方法
+        """
+        fingerprint = ExposureCache.method_fingerprint(calculate_method)
+        registered = self.manifest['methods'].get(factor_name)
+        if registered == fingerprint:
+            return
+        if registered is not None:
+            print(f"因子 {factor_name} 的计算方法已变化，清空检查点")
+            self.clear(factor_name)
+        self.manifest['methods'][factor_name] = fingerprint
+        self._write_manifest()
+
+    def completed(self, factor_name: str) -> set[str]:
+        """
+        已完成的文件
+        :param factor_name: 因子名
+        :return: 文件名（YYYYMMDD.parquet）的集合
+        """
+        factor_dir = os.path.join(self.checkpoint_dir, factor_name)
+        if not os.path.isdir(factor_dir):
+            return set()
+        return {f for f in os.listdir(factor_dir) if f.endswith('.parquet')}
+
+    def load(self, factor_name: str, file_name: str) -> Optional[pl.DataFrame | None]:
+        """
+        读取已完成的当日因子暴露，损坏的检查点视为未完成
+        :param factor_name: 因子名
+        :param file_name: 分钟频文件名
+        :return:
+        """
+        try:
+            return pl.read_parquet(os.path.join(self.checkpoint_dir, factor_name, f'{file_name[:8]}.parquet'))
+        except Exception:
+            return None
+
+    def save(self, factor_name: str, file_name: str, exposure: pl.DataFrame):
+        """
+        保存当日因子暴露，先写入临时文件再原子替换，并将该日期移出重试清单
+        :param factor_name: 因子名
+        :param file_name: 分钟频文件名
+        :param exposure: 当日因子暴露
+        """
+        factor_dir = os.path.join(self.checkpoint_dir, factor_name)
+        os.makedirs(factor_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=factor_dir, delete=False, suffix='.tmp') as tmp:
+            temp_path = tmp.name
+        try:
+            decode_exposure(exposure).write_parquet(temp_path)
+            os.replace(temp_path, os.path.join(factor_dir, f'{file_name[:8]}.parquet'))
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise e
+        failure = self.manifest['failures'].get(file_name)
+        if failure is not None and factor_name in failure['factors']:
+            failure['factors'].remove(factor_name)
+            if len(failure['factors']) == 0:
+                del self.manifest['failures'][file_name]
+            self._write_manifest()
+
+    def record_failure(self, file_name: str, factor_names: list[str]):
+        """
+        将计算失败的日期加入重试清单，错误信息见运行时输出
+        :param file_name: 分钟频文件名
+        :param factor_names: 失败的因子
+        """
+        failure = self.manifest['failures'].setdefault(
+            file_name, {'factors': [], 'attempts': 0, 'last_attempt': None}
+        )
+        failure['factors'] = sorted(set(failure['factors']) | set(factor_names))
+        failure['attempts'] += 1
+        failure['last_attempt'] = datetime.datetime.now().isoformat(timespec='seconds')
+        self._write_manifest()
+
+    def failures(self) -> pl.DataFrame:
+        """
+        重试清单
+        :return: 包含file_name/factor/attempts/last_attempt的DataFrame
+        """
+        return pl.DataFrame(
+            [
+                {
+                    'file_name': file_name,
+                    'factor': factor_name,
+                    'attempts': failure['attempts'],
+                    'last_attempt': failure['last_attempt'],
+                }
+                for file_name, failure in sorted(self.manifest['failures'].items())
+                for factor_name in failure['factors']
+            ],
+            schema={
+                'file_name': pl.String,
+                'factor': pl.String,
+                'attempts': pl.Int64,
+                'last_attempt': pl.String,
+            }
+        )
+
+    def clear(self, factor_name: str = None, failures: bool = True):
+        """
+        清空检查点与重试清单
+        :param factor_name: 只清空该因子，默认清空全部
+        :param failures: 是否同时清空重试清单，结果已写入存储时保留清单以便查看失败的日期
+        """
+        factor_names = [factor_name] if factor_name is not None else list(self.manifest['methods'])
+        for name in factor_names:
+            shutil.rmtree(os.path.join(self.checkpoint_dir, name), ignore_errors=True)
+            self.manifest['methods'].pop(name, None)
+            if not failures:
+                continue
+            for file_name in list(self.manifest['failures']):
+                failure = self.manifest['failures'][file_name]
+                if name in failure['factors']:
+                    failure['factors'].remove(name)
+                if len(failure['factors']) == 0:
+                    del self.manifest['failures'][file_name]
+        self._write_manifest()
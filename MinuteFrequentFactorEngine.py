@@ -0,0 +1,596 @@
+from MinuteFrequentFactorCICC import MinFreqFactor
+from MinuteFrequentFactorCache import ExposureCache
+from FactorExposureStore import ExposureStore
+from MinuteFrequentFactorProfile import ProfileReport, profile_stage
+from MinuteFrequentFactorScheduler import FileScheduler, MemoryBudget
+from MinuteFrequentFactorCheckpoint import Checkpoint
+from FactorCodes import decode_exposure
+import MinuteFrequentFactorCalculateMethodsCICC as cicc_methods
+import os
+import shutil
+import tempfile
+import polars as pl
+from typing import Callable, Optional
+
+
+class MinFreqFactorEngine:
+    def __init__(self, calculate_methods: list[Callable | str]):
+        """
+        分钟频多因子计算引擎：每个分钟频文件只读取一次，在同一份数据上计算全部因子
+        :param calculate_methods: 因子计算方法列表，元素可以为计算函数或因子注册表中的因子名（'mmt_pm'或'cal_mmt_pm'）
+        """
+        self.calculate_methods = {}
+        for method in calculate_methods:
+            method = self._resolve_method(method)
+            self.calculate_methods[self._factor_name(method)] = method
+        self.factors = {
+            factor_name: MinFreqFactor(factor_name)
+            for factor_name in self.calculate_methods
+        }
+        # 全部因子依赖的中间列（每日数据只计算一次）与需要读取的列、time范围
+        self.intermediates, self.read_plan = self._plan(self.calculate_methods)
+
+    @classmethod
+    def from_categories(
+            cls, categories: str | list[str] = None, day_local_only: bool = False
+    ) -> 'MinFreqFactorEngine':
+        """
+        由因子注册表中一个或多个类别的全部因子构建引擎，
+        如MinFreqFactorEngine.from_categories('liq').cal_exposure_by_min_data()计算全部流动性因子
+        :param categories: 类别或类别列表（见FACTOR_CATEGORIES），默认为全部因子
+        :param day_local_only: 是否只包含day_local的因子
+        :return:
+        """
+        return cls(cicc_methods.list_factors(categories, day_local_only))
+
+    @staticmethod
+    def _resolve_method(method: Callable | str) -> Callable:
+        """
+        将因子名解析为注册表中的计算函数
+        :param method: 计算函数或因子名
+        :return:
+        """
+        if callable(method):
+            return method
+        return cicc_methods.get_factor(method).calculate_method
+
+    @staticmethod
+    def _factor_name(method: Callable) -> str:
+        """
+        因子名为计算函数名去掉'cal_'前缀
+        :param method: 计算函数，支持functools.partial
+        :return:
+        """
+        method = getattr(method, 'func', method)
+        return method.__name__.removeprefix('cal_')
+
+    @staticmethod
+    def _plan(calculate_methods: dict[str, Callable]) -> tuple[tuple[str, ...], tuple]:
+        """
+        一组因子共同依赖的中间列与读取需求
+        :param calculate_methods: 因子名到计算函数的映射
+        :return: (中间列, (需要读取的列, time范围))
+        """
+        intermediates = tuple(dict.fromkeys(
+            name
+            for method in calculate_methods.values()
+            for name in getattr(method, 'intermediates', ())
+        ))
+        return intermediates, cicc_methods.get_read_plan(calculate_methods.values())
+
+    @staticmethod
+    def _process_single_file(
+            file_name: str,
+            folder_path: str,
+            calculate_methods: dict[str, Callable],
+            intermediates: tuple[str, ...] = (),
+            read_plan: tuple = (None, None),
+            profile: bool = False,
+            capture_plans: bool = False,
+            result_dir: str = None,
+            code_dtype: pl.Enum = None
+    ) -> Optional[dict[str, pl.DataFrame] | tuple[str, dict] | None]:
+        """
+        处理单个文件：读取一次，所有因子的计算合并为一个惰性查询，公共子计划只执行一次
+        :param file_name: 文件名
+        :param folder_path: 文件所在的文件夹
+        :param calculate_methods: 因子名到计算函数的映射
+        :param intermediates: 需要预先计算的中间列
+        :param read_plan: 需要读取的列与time范围
+        :param profile: 是否剖析各阶段，剖析时返回(结果, 本文件的剖析报告)；
+            为了把耗时归属到各因子，剖析时各因子的查询分别执行，不合并公共子计划
+        :param capture_plans: 剖析时是否记录各因子的查询计划
+        :param result_dir: 传入时全部因子的当日暴露写为该文件夹下的一个Arrow IPC文件，返回(文件路径, 布局)
+        :param code_dtype: 共享代码字典的Enum类型，传入时读取后将code编码为Enum
+        :return: 因子名到当日因子暴露的映射
+        """
+        if profile:
+            return MinFreqFactorEngine._profile_single_file(
+                file_name, folder_path, calculate_methods, intermediates, read_plan,
+                ProfileReport(capture_plans), result_dir, code_dtype
+            )
+        try:
+            file_path = os.path.join(folder_path, file_name)
+            min_data = cicc_methods.add_intermediate_columns(
+                MinFreqFactor._read_min_data(file_path, *read_plan, code_dtype), intermediates
+            ).lazy()
+        except Exception as e:
+            print(f"处理文件 {file_name} 时出错: {str(e)}")
+            return None
+
+        results = {}
+        for factor_name, calculate_method in calculate_methods.items():
+            try:
+                results[factor_name] = calculate_method(min_data)
+            except Exception as e:
+                print(f"处理文件 {file_name} 的因子 {factor_name} 时出错: {str(e)}")
+
+        lazy_names = [
+            factor_name for factor_name, result in results.items()
+            if isinstance(result, pl.LazyFrame)
+        ]
+        try:
+            collected = pl.collect_all([results[factor_name] for factor_name in lazy_names])
+            results.update(zip(lazy_names, collected))
+        except Exception:  # 合并查询失败时逐个计算，定位出错的因子
+            for factor_name in lazy_names:
+                try:
+                    results[factor_name] = results[factor_name].collect()
+                except Exception as e:
+                    print(f"处理文件 {file_name} 的因子 {factor_name} 时出错: {str(e)}")
+                    del results[factor_name]
+        if result_dir is not None:
+            return MinFreqFactorEngine._write_results(result_dir, file_name, results)
+        return results
+
+    @staticmethod
+    def _profile_single_file(
+            file_name: str,
+            folder_path: str,
+            calculate_methods: dict[str, Callable],
+            intermediates: tuple[str, ...],
+            read_plan: tuple,
+            report: ProfileReport,
+            result_dir: str = None,
+            code_dtype: pl.Enum = None
+    ) -> tuple[Optional[dict[str, pl.DataFrame] | tuple[str, dict] | None], ProfileReport]:
+        """
+        剖析单个文件：分别记录读取、中间列、每个因子的计算与结果序列化
+        :return: (因子名到当日因子暴露的映射, 剖析报告)
+        """
+        try:
+            file_path = os.path.join(folder_path, file_name)
+            with profile_stage(report, 'read', file_name) as record:
+                min_data = MinFreqFactor._read_min_data(file_path, *read_plan, code_dtype)
+                record['rows'] = min_data.height
+                record['bytes'] = os.path.getsize(file_path)
+            with profile_stage(report, 'intermediates', file_name) as record:
+                min_data = cicc_methods.add_intermediate_columns(min_data, intermediates)
+                record['rows'] = min_data.height
+                record['bytes'] = min_data.estimated_size()
+            min_data = min_data.lazy()
+        except Exception as e:
+            print(f"处理文件 {file_name} 时出错: {str(e)}")
+            return None, report
+
+        results = {}
+        for factor_name, calculate_method in calculate_methods.items():
+            try:
+                with profile_stage(report, 'factor', file_name, factor_name) as record:
+                    result = calculate_method(min_data)
+                    report.capture_plan(factor_name, result)
+                    if isinstance(result, pl.LazyFrame):
+                        result = result.collect()
+                    record['rows'] = result.height
+                    record['bytes'] = result.estimated_size()
+                results[factor_name] = result
+            except Exception as e:
+                print(f"处理文件 {file_name} 的因子 {factor_name} 时出错: {str(e)}")
+        if result_dir is None:
+            report.measure_transfer(file_name, results)
+            return results, report
+        with profile_stage(report, 'transfer', file_name) as record:
+            record['rows'] = sum(result.height for result in results.values())
+            results = MinFreqFactorEngine._write_results(result_dir, file_name, results)
+            record['bytes'] = os.path.getsize(results[0])
+        return results, report
+
+    @staticmethod
+    def _write_results(
+            result_dir: str, file_name: str, results: dict[str, pl.DataFrame]
+    ) -> tuple[str, dict]:
+        """
+        工作进程将全部因子的当日暴露按因子依次拼接为code/date/value长表，写为一个未压缩的Arrow IPC文件，
+        每个文件只需打开一次；父进程按布局切片读取，不复制、不反序列化
+        :param result_dir: 保存的文件夹
+        :param file_name: 分钟频文件名
+        :param results: 因子名到当日因子暴露的映射
+        :return: (文件路径, 因子名到(起始行, 行数, 因子列类型)的布局)
+        """
+        layout = {}
+        frames = []
+        offset = 0
+        for factor_name, result in results.items():
+            dtype = result.schema[factor_name]
+            layout[factor_name] = (offset, result.height, dtype)
+            frames.append(result.select(
+                pl.col('code'),
+                pl.col('date'),
+                pl.col(factor_name).cast(pl.Float64).alias('value')
+            ))
+            offset += result.height
+        path = os.path.join(result_dir, f'{file_name[:8]}.arrow')
+        if len(frames) > 0:
+            pl.concat(frames, how='vertical').write_ipc(
+                path, compression='uncompressed', compat_level=pl.CompatLevel.newest()
+            )
+        return path, layout
+
+    @staticmethod
+    def _read_results(
+            result: Optional[dict[str, pl.DataFrame] | tuple[str, dict] | None]
+    ) -> Optional[dict[str, pl.DataFrame] | None]:
+        """
+        父进程读取工作进程的结果：IPC文件以内存映射方式读取后按布局零拷贝切片
+        :param result: 因子名到当日因子暴露的映射，或_write_results返回的(文件路径, 布局)
+        :return: 因子名到当日因子暴露的映射
+        """
+        if not isinstance(result, tuple):
+            return result
+        path, layout = result
+        if len(layout) == 0:
+            return {}
+        frame = pl.read_ipc(path)  # polars默认内存映射本地IPC文件
+        return {
+            factor_name: frame.slice(offset, length).select(
+                pl.col('code'),
+                pl.col('date'),
+                pl.col('value').cast(dtype).alias(factor_name)
+            )
+            for factor_name, (offset, length, dtype) in layout.items()
+        }
+
+    def _run_tasks(
+            self,
+            tasks: list[tuple[str, dict[str, Callable]]],
+            folder_path: str,
+            n_jobs: int,
+            scheduler: FileScheduler,
+            profile: ProfileReport = None,
+            transfer: str = 'ipc',
+            cache: ExposureCache = None,
+            cache_keys: dict[tuple[str, str], str] = None,
+            desc: str = 'Processing',
+            checkpoint: Checkpoint = None
+    ) -> tuple[dict[str, dict[str, pl.DataFrame]], Optional[str | None]]:
+        """
+        并行计算一组任务，写入缓存；传入检查点时每个文件完成后立即保存，失败的因子加入重试清单
+        :param tasks: [(文件名, 需要计算的因子)]
+        :return: (文件名到各因子当日暴露的映射, 临时IPC文件夹)，结果可能内存映射自临时文件夹中的文件，
+            使用完毕后才能删除该文件夹
+        """
+        result_dir = None
+        if transfer == 'ipc' and n_jobs != 1 and scheduler.backend == 'loky':
+            result_dir = tempfile.mkdtemp(prefix='min_freq_factor_')
+        sizes = [os.path.getsize(os.path.join(folder_path, file_name)) for file_name, _ in tasks]
+        code_dictionary = MinFreqFactor.code_dictionary
+        code_dtype = None if code_dictionary is None else code_dictionary.dtype
+
+        def save_checkpoint(index, result):
+            if profile is not None:
+                result = result[0]
+            result = self._read_results(result) or {}
+            file_name, calculate_methods = tasks[index]
+            for factor_name, exposure in result.items():
+                checkpoint.save(factor_name, file_name, exposure)
+            failed = [factor_name for factor_name in calculate_methods if factor_name not in result]
+            if len(failed) > 0:
+                checkpoint.record_failure(file_name, failed)
+
+        with profile_stage(profile, 'parallel') as record:
+            results = scheduler.run(
+                self._process_single_file,
+                [
+                    (
+                        (
+                            file_name,
+                            folder_path,
+                            calculate_methods,
+                            *self._plan(calculate_methods),
+                            profile is not None,
+                            profile is not None and profile.capture_plans,
+                            result_dir,
+                            code_dtype
+                        ),
+                        size
+                    )
+                    for (file_name, calculate_methods), size in zip(tasks, sizes)
+                ],
+                n_jobs=n_jobs,
+                weights=[
+                    size * len(calculate_methods)
+                    for (_, calculate_methods), size in zip(tasks, sizes)
+                ],
+                desc=desc,
+                on_result=save_checkpoint if checkpoint is not None else None
+            )
+            record['rows'] = len(results)
+        if profile is not None:
+            for _, report in results:
+                profile.merge(report)
+            results = [result for result, _ in results]
+        results = [self._read_results(result) for result in results]
+        if cache is not None:
+            for (file_name, _), result in zip(tasks, results):
+                if result is None:
+                    continue
+                for factor_name, exposure in result.items():
+                    cache.put(
+                        factor_name, file_name[:8],
+                        cache_keys[(file_name, factor_name)], exposure
+                    )
+        return {
+            file_name: result
+            for (file_name, _), result in zip(tasks, results) if result is not None
+        }, result_dir
+
+    @staticmethod
+    def _new_exposure(
+            factor_name: str, frames: list[pl.DataFrame], end_date
+    ) -> list[pl.DataFrame]:
+        """
+        因子在已保存最新日期之后的当日暴露
+        :param factor_name: 因子名
+        :param frames: 当日因子暴露
+        :param end_date: 已保存的最新日期，None表示全部保留
+        :return:
+        """
+        if end_date is not None:
+            frames = [r.filter(pl.col('date') > end_date) for r in frames]
+        return [r.select('code', 'date', factor_name) for r in frames]
+
+    def cal_exposure_by_min_data(
+            self,
+            path: str = None,
+            folder_path: str = None,
+            n_jobs: int = None,
+            cache: ExposureCache = None,
+            store: ExposureStore = None,
+            profile: ProfileReport = None,
+            transfer: str = 'ipc',
+            scheduler: FileScheduler = None,
+            memory_budget: MemoryBudget = None,
+            checkpoint: Checkpoint = None
+    ) -> dict[str, MinFreqFactor]:
+        r"""
+        使用分钟频数据同时计算全部因子的暴露。各因子已有已计算的部分则分别更新至最新数据。
+        :param path: 因子暴露的保存路径，默认为'D:\QuantData\MinuteFreqFactor\CICC Factor'
+        :param folder_path: 分钟频价量数据所在的文件夹，默认为'D:\QuantData\KLine_cleaned'
+        :param n_jobs: 并行进程数，默认使用全部核心
+        :param cache: 按日缓存，传入时检查全部日期，每个文件只重新计算缓存失效的因子
+        :param store: 按年月分区的存储，传入时从manifest读取各因子的最新日期，新日期的结果追加至存储
+        :param profile: 剖析报告，传入时记录每个文件、每个因子各阶段的耗时、行数、字节数与内存
+        :param transfer: 工作进程返回结果的方式：'ipc'写入临时Arrow IPC文件由父进程内存映射读取，
+            'pickle'由joblib序列化返回；n_jobs为1或使用多线程后端时不经过进程间传输
+        :param scheduler: 文件调度器，决定分批方式与joblib后端，默认为FileScheduler()，保存检查点时每批一个文件；
+            任务的工作量为文件大小乘以需要计算的因子数
+        :param memory_budget: 内存预算，传入时按预算限制并行数，并按月（或年）分块计算，
+            每块结果写入store或临时parquet文件后释放，最后合并为各因子暴露，用于全历史回补
+        :param checkpoint: 检查点，传入时每个交易日完成后立即保存，中断后重新运行只计算未完成的文件与因子，
+            失败的因子加入重试清单并在下次运行时重试；结果写入store后清空各因子的检查点
+        设置了MinFreqFactor.code_dictionary时分钟频数据的code在读取时编码为Enum，
+        因子的float32_exposure为True时因子暴露以float32保存在内存中
+        :return: 因子名到因子的映射
+        """
+        if transfer not in ('ipc', 'pickle'):
+            raise ValueError(f'Unknown transfer: {transfer}')
+        end_dates = {}
+        for factor_name, factor in self.factors.items():
+            factor.factor_exposure = None
+            if store is not None:
+                end_dates[factor_name] = store.latest_date(factor_name)
+                continue
+            if cache is None:
+                factor.factor_exposure = MinFreqFactor._read_exposure(
+                    factor_name=factor_name,
+                    default_path=r'D:\QuantData\MinuteFreqFactor\CICC Factor',
+                    path=path
+                )
+            if factor.factor_exposure is not None:
+                end_dates[factor_name] = factor.factor_exposure['date'].max()
+            else:
+                end_dates[factor_name] = None
+
+        if folder_path is None:
+            folder_path = r'D:\QuantData\KLine_cleaned'  # 分钟频价量数据
+        pv_data_index = MinFreqFactor._list_min_files(folder_path)
+
+        # 每个任务为(文件名, 需要计算的因子)
+        tasks = []
+        cached_results = {factor_name: {} for factor_name in self.factors}
+        if cache is not None:  # 全部日期由缓存与重新计算的结果组成
+            method_fingerprints = {
+                factor_name: cache.method_fingerprint(method)
+                for factor_name, method in self.calculate_methods.items()
+            }
+            cache_keys = {}
+            for file_name in pv_data_index['file_name']:
+                file_fingerprint = cache.file_fingerprint(os.path.join(folder_path, file_name))
+                missing = {}
+                for factor_name, method in self.calculate_methods.items():
+                    key = cache.make_key(file_fingerprint, method_fingerprints[factor_name])
+                    cached = cache.get(factor_name, file_name[:8], key)
+                    if cached is None:
+                        missing[factor_name] = method
+                        cache_keys[(file_name, factor_name)] = key
+                    else:
+                        cached_results[factor_name][file_name] = cached
+                if len(missing) > 0:
+                    tasks.append((file_name, missing))
+        else:
+            if None not in end_dates.values():  # 只读取至少一个因子需要更新的日期
+                pv_data_index = pv_data_index.filter(
+                    pl.col('date') > min(end_dates.values())
+                )
+            tasks = [
+                (file_name, self.calculate_methods)
+                for file_name in pv_data_index['file_name']
+            ]
+
+        if checkpoint is not None:  # 已完成的文件与因子从检查点读取
+            completed = {}
+            for factor_name, method in self.calculate_methods.items():
+                checkpoint.bind(factor_name, method)
+                completed[factor_name] = checkpoint.completed(factor_name)
+            remaining = []
+            for file_name, calculate_methods in tasks:
+                missing = {}
+                for factor_name, method in calculate_methods.items():
+                    exposure = None
+                    if f'{file_name[:8]}.parquet' in completed[factor_name]:
+                        exposure = checkpoint.load(factor_name, file_name)
+                    if exposure is None:
+                        missing[factor_name] = method
+                    else:
+                        cached_results[factor_name][file_name] = exposure
+                if len(missing) > 0:
+                    remaining.append((file_name, missing))
+            tasks = remaining
+
+        if n_jobs is None:
+            n_jobs = -1
+        if scheduler is None:  # 保存检查点时每个文件完成后即返回父进程
+            scheduler = FileScheduler(max_batch_size=1 if checkpoint is not None else None)
+        tasks = dict(tasks)
+        file_names = set(tasks).union(*(cached.keys() for cached in cached_results.values()))
+        spill_dir = None
+        if memory_budget is None:  # 全部日期为一块，结果保留在内存中
+            chunks = {None: sorted(file_names)}
+        else:
+            chunks = memory_budget.split(list(file_names))
+            if len(tasks) > 0:
+                n_jobs = memory_budget.n_workers(
+                    n_jobs, [os.path.join(folder_path, file_name) for file_name in tasks]
+                )
+            if store is None:
+                spill_dir = tempfile.mkdtemp(prefix='min_freq_spill_')
+
+        valid_results = {factor_name: [] for factor_name in self.factors}
+        result_dirs = []
+        for chunk_key, chunk_files in chunks.items():
+            chunk_tasks = [(f, tasks[f]) for f in chunk_files if f in tasks]
+            results = {}
+            if len(chunk_tasks) > 0:
+                results, result_dir = self._run_tasks(
+                    chunk_tasks, folder_path, n_jobs, scheduler, profile, transfer, cache,
+                    cache_keys if cache is not None else None,
+                    desc='Processing' if chunk_key is None else f'Processing {chunk_key}',
+                    checkpoint=checkpoint
+                )
+                if result_dir is not None:
+                    result_dirs.append(result_dir)
+            for factor_name in self.factors:
+                chunk_results = self._new_exposure(
+                    factor_name,
+                    [
+                        cached_results[factor_name].pop(f) if f in cached_results[factor_name]
+                        else results[f][factor_name]
+                        for f in chunk_files
+                        if f in cached_results[factor_name]
+                        or (f in results and factor_name in results[f])
+                    ],
+                    end_dates[factor_name]
+                )
+                if memory_budget is None:
+                    valid_results[factor_name] += chunk_results
+                    continue
+                if len(chunk_results) == 0:
+                    continue
+                with profile_stage(profile, 'concat', factor_name=factor_name) as record:
+                    chunk_exposure = pl.concat(
+                        self.factors[factor_name]._encode_codes(chunk_results), how='vertical'
+                    ).sort(['date', 'code'])
+                    if store is not None:
+                        store.append(factor_name, chunk_exposure)
+                    else:
+                        os.makedirs(os.path.join(spill_dir, factor_name), exist_ok=True)
+                        decode_exposure(chunk_exposure).write_parquet(
+                            os.path.join(spill_dir, factor_name, f'{chunk_key}.parquet')
+                        )
+                    record['rows'] = chunk_exposure.height
+                    record['bytes'] = chunk_exposure.estimated_size()
+                del chunk_results, chunk_exposure
+            del results
+            if memory_budget is not None:  # 本块结果已写出，释放临时文件
+                while len(result_dirs) > 0:
+                    shutil.rmtree(result_dirs.pop(), ignore_errors=True)
+
+        for factor_name, factor in self.factors.items():
+            with profile_stage(profile, 'concat', factor_name=factor_name) as record:
+                if store is not None:
+                    if len(valid_results[factor_name]) > 0:
+                        store.append(
+                            factor_name,
+                            pl.concat(factor._encode_codes(valid_results[factor_name]), how='vertical')
+                        )
+                    factor.factor_exposure = store.read(factor_name)
+                elif spill_dir is not None:  # 临时文件与已有因子暴露均为解码后的类型
+                    factor_dir = os.path.join(spill_dir, factor_name)
+                    parts = [] if factor.factor_exposure is None else [factor.factor_exposure.lazy()]
+                    if os.path.isdir(factor_dir):
+                        parts += [
+                            pl.scan_parquet(os.path.join(factor_dir, part))
+                            for part in sorted(os.listdir(factor_dir))
+                        ]
+                    if len(parts) > 0:
+                        factor.factor_exposure = (
+                            pl.concat(parts, how='vertical')
+                            .sort(['date', 'code'])
+                            .collect(engine='streaming')
+                        )
+                elif factor.factor_exposure is None:
+                    factor.factor_exposure = (
+                        pl.concat(factor._encode_codes(valid_results[factor_name]), how='vertical')
+                        .sort(['date', 'code'])
+                    )
+                elif len(valid_results[factor_name]) > 0:
+                    factor.factor_exposure = (
+                        pl.concat(
+                            items=factor._encode_codes(
+                                [factor.factor_exposure] + valid_results[factor_name]
+                            ),
+                            how='vertical'
+                        )
+                        .sort(['date', 'code'])
+                    )
+                factor.factor_exposure = factor._compact_exposure(factor.factor_exposure)
+                if factor.factor_exposure is not None:
+                    record['rows'] = factor.factor_exposure.height
+                    record['bytes'] = factor.factor_exposure.estimated_size()
+            valid_results[factor_name] = None
+            if checkpoint is not None and store is not None:  # 结果已持久化
+                checkpoint.clear(factor_name, failures=False)
+        del valid_results  # 排序后的因子暴露已复制，释放内存映射后删除临时文件
+        for result_dir in result_dirs:
+            shutil.rmtree(result_dir, ignore_errors=True)
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        return self.factors
+
+    def to_parquet(self, path: str = None):
+        r"""
+        将全部因子暴露分别保存为parquet。
+        :param path: 保存的文件夹, 默认路径为'D:\QuantData\MinuteFreqFactor', 文件名为因子名。
+        """
+        for factor in self.factors.values():
+            if factor.factor_exposure is not None:
+                factor.to_parquet(path)
+
+    def to_store(self, store: ExposureStore = None):
+        r"""
+        将全部因子暴露追加至按年月分区的存储，只写入新日期。
+        :param store: 分区存储，默认根目录为'D:\QuantData\MinuteFreqFactor\store'
+        """
+        for factor in self.factors.values():
+            if factor.factor_exposure is not None:
+                factor.to_store(store)
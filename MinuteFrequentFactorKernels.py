@@ -0,0 +1,464 @@
+import polars as pl
+
+"""
+    ========================
+        分钟频因子公共计算核
+    ========================
+"""
+
+
+# 有序分段
+
+# 读取时校验顺序后添加的段号列：同一code、date的k线连续排列且按time排序，段号随code、date递增
+SEGMENT_COLUMN = 'segment'
+
+
+def attach_segments(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    校验分钟频数据是否按code、date、time排序（不含time列时只校验code、date），
+    未排序时排序一次，然后添加段号列并标记为已排序。
+    分钟频文件本身按code、time排序，通常只需校验；
+    带段号列的数据按段号分组时每组为连续的行，不需要哈希，依赖顺序的聚合也无需再排序
+    :param df: 分钟频数据
+    :return: 添加了SEGMENT_COLUMN的数据
+    """
+    segment = pl.struct('code', 'date').rle_id().alias(SEGMENT_COLUMN)
+    df = df.with_columns(segment)
+    if not _segments_sorted(df):
+        sort_by = ['code', 'date', 'time'] if 'time' in df.columns else ['code', 'date']
+        df = df.drop(SEGMENT_COLUMN).sort(sort_by, maintain_order=True).with_columns(segment)
+    return df.with_columns(pl.col(SEGMENT_COLUMN).set_sorted())
+
+
+def _segments_sorted(df: pl.DataFrame) -> bool:
+    """
+    各段的首行（约5000行）按code、date严格递增，且段内time严格递增
+    """
+    heads = df.filter(pl.col(SEGMENT_COLUMN).is_first_distinct()).select('code', 'date')
+    previous_code = pl.col('code').shift(1)
+    previous_date = pl.col('date').shift(1)
+    heads_sorted = heads.select(
+        (
+            (pl.col('code') > previous_code)
+            | ((pl.col('code') == previous_code) & (pl.col('date') > previous_date))
+        ).fill_null(True).all()
+    ).item()
+    if not heads_sorted or 'time' not in df.columns:
+        return heads_sorted
+    return df.select(
+        (
+            (pl.col(SEGMENT_COLUMN) != pl.col(SEGMENT_COLUMN).shift(1))
+            | (pl.col('time') > pl.col('time').shift(1))
+        ).fill_null(True).all()
+    ).item()
+
+
+def segment_keys(df: pl.DataFrame | pl.LazyFrame) -> str | list[str]:
+    """
+    窗口函数的分组键：有段号列时为段号，否则为['code', 'date']
+    :param df: 分钟频数据
+    :return:
+    """
+    if SEGMENT_COLUMN in df.collect_schema().names():
+        return SEGMENT_COLUMN
+    return ['code', 'date']
+
+
+def segment_agg(
+        df: pl.DataFrame | pl.LazyFrame,
+        *aggs: pl.Expr,
+        ordered: bool = False
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    按code、date分组聚合。有段号列时按已排序的段号分组，每组为连续的行；
+    否则按['code', 'date']哈希分组，ordered为True时先按code、date、time排序
+    :param df: 分钟频数据
+    :param aggs: 聚合表达式
+    :param ordered: 聚合是否依赖k线的时间顺序（如first/last/shift）
+    :return: 包含code/date与聚合列的结果
+    """
+    if SEGMENT_COLUMN in df.collect_schema().names():
+        return df.group_by(SEGMENT_COLUMN).agg(
+            pl.col('code').first(),
+            pl.col('date').first(),
+            *aggs
+        ).drop(SEGMENT_COLUMN)
+    if ordered:
+        df = df.sort(by=['code', 'date', 'time'])
+    return df.group_by(['code', 'date']).agg(*aggs)
+
+
+def rolling_ols(
+        df: pl.DataFrame | pl.LazyFrame,
+        x: str = 'low',
+        y: str = 'high',
+        window: int = 50,
+        index_column: str = 'minute_in_trade',
+        group_by: list[str] = None
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    滚动一元回归 y = alpha + beta * x，基于前缀和计算，复杂度与窗口长度无关。
+    窗口为index_column在(t-window, t]内的全部k线，index相同的k线共用一个窗口（如11:30，见_minute_in_trade_expr），
+    包含至少window根k线的窗口有效，与rolling(period=f'{window}i')后筛选n >= window的结果一致。
+    数据需按group_by与index_column排序。
+    添加列：ols_beta_{window}/ols_corr_{window}/ols_corr_square_{window}，无效窗口为空值
+    :param df: 分钟频数据
+    :param x: 自变量列
+    :param y: 因变量列
+    :param window: 窗口长度
+    :param index_column: 窗口索引列
+    :param group_by: 分组列，默认有段号列时为段号，否则为['code', 'date']
+    :return:
+    """
+    beta_name = f'ols_beta_{window}'
+    if beta_name in df.collect_schema().names():  # 已经计算过
+        return df
+    if group_by is None:
+        group_by = segment_keys(df)
+
+    def at_row(column: str, row: pl.Expr) -> pl.Expr:
+        return pl.col(column).gather(row.clip(lower_bound=0))
+
+    def window_sum(column: str) -> pl.Expr:
+        before = pl.when(pl.col('_start') > pl.col('_first')).then(at_row(column, pl.col('_start') - 1))
+        return at_row(column, pl.col('_end') - 1) - before.otherwise(0)
+
+    def window_change(column: str) -> pl.Expr:  # 不计窗口内第一根k线相对窗口外的变化
+        return at_row(column, pl.col('_end') - 1) - at_row(column, pl.col('_start'))
+
+    # 去中心化后计算前缀和，减小大数相减的误差
+    prefix = (
+        df.with_columns(
+            (pl.col(x) - pl.col(x).first().over(group_by)).alias('_dx'),
+            (pl.col(y) - pl.col(y).first().over(group_by)).alias('_dy'),
+            (pl.col(x) != pl.col(x).shift(1)).over(group_by)
+            .fill_null(False).cast(pl.Int64)
+            .alias('_chg_x'),
+            (pl.col(y) != pl.col(y).shift(1)).over(group_by)
+            .fill_null(False).cast(pl.Int64)
+            .alias('_chg_y'),
+        ).with_columns(
+            pl.col('_dx').cum_sum().over(group_by).alias('_cx'),
+            pl.col('_dy').cum_sum().over(group_by).alias('_cy'),
+            (pl.col('_dx') * pl.col('_dx')).cum_sum().over(group_by).alias('_cxx'),
+            (pl.col('_dy') * pl.col('_dy')).cum_sum().over(group_by).alias('_cyy'),
+            (pl.col('_dx') * pl.col('_dy')).cum_sum().over(group_by).alias('_cxy'),
+            pl.col('_chg_x').cum_sum().over(group_by).alias('_ncx'),
+            pl.col('_chg_y').cum_sum().over(group_by).alias('_ncy'),
+        )
+    )
+    # 窗口的起止行号（整表行号，左闭右开）与k线数量
+    index = pl.col(index_column)
+    bounds = prefix.with_columns(
+        pl.int_range(pl.len(), dtype=pl.Int64).alias('_row'),
+    ).with_columns(
+        pl.col('_row').first().over(group_by).alias('_first'),
+    ).with_columns(
+        (pl.col('_first') + index.search_sorted(index - window, side='right').over(group_by))
+        .alias('_start'),
+        (pl.col('_first') + index.search_sorted(index, side='right').over(group_by))
+        .alias('_end'),
+    )
+    # 窗口内的均值，以及窗口是否包含足够的k线
+    n = pl.col('_end') - pl.col('_start')
+    sums = bounds.with_columns(
+        (window_sum('_cx') / n).alias('_mx'),
+        (window_sum('_cy') / n).alias('_my'),
+        (window_sum('_cxx') / n).alias('_mxx'),
+        (window_sum('_cyy') / n).alias('_myy'),
+        (window_sum('_cxy') / n).alias('_mxy'),
+        (window_change('_ncx') == 0).alias('_const_x'),
+        (window_change('_ncy') == 0).alias('_const_y'),
+        (n >= window).alias('_valid'),
+    )
+    # 窗口内价格不变时方差严格为0
+    moments = sums.with_columns(
+        (pl.col('_mx') + pl.col(x).first().over(group_by)).alias('_mean_x'),
+        (pl.col('_my') + pl.col(y).first().over(group_by)).alias('_mean_y'),
+        pl.when(pl.col('_const_x'))
+        .then(0.0)
+        .otherwise((pl.col('_mxx') - pl.col('_mx').pow(2)).clip(lower_bound=0))
+        .alias('_var_x'),
+        pl.when(pl.col('_const_y'))
+        .then(0.0)
+        .otherwise((pl.col('_myy') - pl.col('_my').pow(2)).clip(lower_bound=0))
+        .alias('_var_y'),
+        pl.when(pl.col('_const_x') | pl.col('_const_y'))
+        .then(0.0)
+        .otherwise(pl.col('_mxy') - pl.col('_mx') * pl.col('_my'))
+        .alias('_cov'),
+    )
+    corr_expr = (
+        pl.when(pl.col('_var_x') * pl.col('_var_y') != 0)
+        .then(pl.col('_cov') / (pl.col('_var_x') * pl.col('_var_y')).sqrt())
+        .otherwise(None)
+    )
+    return moments.with_columns(
+        pl.when(pl.col('_valid'))
+        .then(
+            pl.when(pl.col('_var_x') != 0)
+            .then(pl.col('_cov') / pl.col('_var_x'))
+            .otherwise(pl.col('_mean_y') / pl.col('_mean_x'))
+        )
+        .otherwise(None)
+        .alias(beta_name),
+        pl.when(pl.col('_valid'))
+        .then(corr_expr)
+        .otherwise(None)
+        .alias(f'ols_corr_{window}'),
+        pl.when(pl.col('_valid'))
+        .then(corr_expr.pow(2))
+        .otherwise(None)
+        .alias(f'ols_corr_square_{window}'),
+    ).drop(
+        '_dx', '_dy', '_chg_x', '_chg_y', '_cx', '_cy', '_cxx', '_cyy', '_cxy',
+        '_ncx', '_ncy', '_row', '_first', '_start', '_end',
+        '_mx', '_my', '_mxx', '_myy', '_mxy', '_const_x', '_const_y',
+        '_valid', '_mean_x', '_mean_y', '_var_x', '_var_y', '_cov'
+    )
+
+
+def rolling_ols_summary(
+        df: pl.DataFrame | pl.LazyFrame,
+        x: str = 'low',
+        y: str = 'high',
+        window: int = 50,
+        index_column: str = 'minute_in_trade',
+) -> pl.LazyFrame:
+    """
+    滚动回归的日内汇总，只使用有效窗口
+    输出列：code/date/beta_mean/beta_std/beta_last/corr_mean/corr_square_mean
+    :param df: 分钟频数据，已含rolling_ols的结果时直接使用
+    :param x: 自变量列
+    :param y: 因变量列
+    :param window: 窗口长度
+    :param index_column: 窗口索引列
+    :return:
+    """
+    beta = pl.col(f'ols_beta_{window}')
+    return segment_agg(
+        rolling_ols(df.lazy(), x=x, y=y, window=window, index_column=index_column)
+        .filter(beta.is_not_null()),
+        beta.mean().alias('beta_mean'),
+        beta.std().alias('beta_std'),
+        beta.last().alias('beta_last'),
+        pl.col(f'ols_corr_{window}').mean().alias('corr_mean'),
+        pl.col(f'ols_corr_square_{window}').mean().alias('corr_square_mean'),
+    )
+
+
+# 成交量排名
+
+def volume_rank(
+        df: pl.DataFrame | pl.LazyFrame,
+        group_by: str | list[str] = None
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    每根k线的成交量在当日的排名，每日只计算一次，供任意K的顶量/底量因子共用。
+    并列时取最小排名，成交量为空时排名为空：volume_rank_top为从大到小的排名，volume_rank_bottom为从小到大的排名。
+    volume_rank_top <= K即成交量不低于第K大的成交量，与第K大并列的k线全部入选，
+    与volume >= volume.top_k(K).min()一致，底量同理
+    :param df: 分钟频数据
+    :param group_by: 分组列，默认有段号列时为段号，否则为['code', 'date']
+    :return:
+    """
+    if 'volume_rank_top' in df.collect_schema().names():  # 已经计算过
+        return df
+    if group_by is None:
+        group_by = segment_keys(df)
+    return df.with_columns(
+        pl.col('volume').rank('min', descending=True).over(group_by).alias('volume_rank_top'),
+        pl.col('volume').rank('min').over(group_by).alias('volume_rank_bottom'),
+    )
+
+
+def volume_rank_return(k: int, side: str = 'top', column: str = 'bar_ret') -> pl.Expr:
+    """
+    成交量最高（top）或最低（bottom）k根k线的累计收益率，用于按code、date的聚合，依赖volume_rank。
+    多个k与两侧的表达式可以放在同一次聚合中计算
+    :param k: k线数量，并列的k线全部计入
+    :param side: 'top'或'bottom'
+    :param column: 分钟收益率所在的列
+    :return:
+    """
+    if side not in ('top', 'bottom'):
+        raise ValueError(f'Unknown side: {side}')
+    return (pl.col(column) + 1).filter(pl.col(f'volume_rank_{side}') <= k).product() - 1
+
+
+# 筹码分布
+
+CHIP_MOMENTS = {
+    'std': lambda share: share.std(),
+    'skew': lambda share: share.skew(),
+    'kurt': lambda share: share.kurtosis(),
+}
+
+
+def chip_distribution(
+        df: pl.DataFrame | pl.LazyFrame,
+        bin_width: float = None,
+        rank: bool = False
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    每个code、date的筹码分布：按收盘价相对各分钟收盘价的收益（close_last_ratio，中间列）分组，
+    各组的成交量之和为chip_volume，占当日成交量的比例为chip_share。
+    结果按code、date、chip_level排序，有段号列时保留段号列。
+    引擎以LazyFrame同时计算多个doc_*因子时，相同的构建子图由collect_all合并，每日只执行一次
+    :param df: 分钟频数据
+    :param bin_width: 分箱宽度，None表示每个不同的close_last_ratio为一组；
+        设置后按等宽分箱，取值为箱的左端点，每日的组数不超过价格区间除以箱宽
+    :param rank: chip_level是否取收益在当日全部k线（所有code）中的平均排名，分组不变；
+        排名依赖当日的全部股票，结果不再只取决于单个code、date的k线
+    :return: 包含code/date/chip_level/chip_volume/chip_share的筹码分布
+    """
+    if bin_width is not None and bin_width <= 0:
+        raise ValueError(f'bin_width must be positive: {bin_width}')
+    level = pl.col('close_last_ratio')
+    if bin_width is not None:
+        level = (level / bin_width).floor() * bin_width
+    if rank:
+        df = df.with_columns(level.rank().over('date').alias('chip_level'))
+        level = pl.col('chip_level')
+    volume = pl.col('volume').sum().alias('chip_volume')
+    keys = segment_keys(df)
+    if keys == SEGMENT_COLUMN:
+        distribution = (
+            df.group_by(SEGMENT_COLUMN, level.alias('chip_level'))
+            .agg(pl.col('code').first(), pl.col('date').first(), volume)
+            .sort(SEGMENT_COLUMN, 'chip_level')
+            .with_columns(pl.col(SEGMENT_COLUMN).set_sorted())
+        )
+    else:
+        distribution = (
+            df.group_by('code', 'date', level.alias('chip_level'))
+            .agg(volume)
+            .sort('code', 'date', 'chip_level')
+        )
+    distribution = distribution.with_columns(
+        (pl.col('chip_volume') / pl.col('chip_volume').sum().over(keys))
+        .alias('chip_share')
+    )
+    return distribution
+
+
+def chip_distribution_stats(
+        distribution: pl.DataFrame | pl.LazyFrame,
+        moments: dict[str, str] = None,
+        quantiles: dict[str, float] = None,
+        top_n: dict[str, int] = None
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    由筹码分布在一次聚合中计算各项统计量
+    :param distribution: chip_distribution的结果
+    :param moments: 输出列名 -> 'std'/'skew'/'kurt'，各组筹码的标准差、偏度、峰度
+    :param quantiles: 输出列名 -> 占比q，按chip_level从小到大累计筹码首次超过q的chip_level；
+        按成交量累计，结果与求和顺序无关
+    :param top_n: 输出列名 -> n，筹码最多的n组的筹码之和
+    :return: 包含code/date与各输出列的结果
+    """
+    share = pl.col('chip_share')
+    aggs = []
+    for name, moment in (moments or {}).items():
+        if moment not in CHIP_MOMENTS:
+            raise ValueError(f'Unknown moment: {moment}')
+        aggs.append(CHIP_MOMENTS[moment](share).alias(name))
+    volume = pl.col('chip_volume')
+    for name, q in (quantiles or {}).items():
+        aggs.append(pl.col('chip_level').filter(volume.cum_sum() > q * volume.sum()).first().alias(name))
+    for name, n in (top_n or {}).items():
+        aggs.append(share.top_k(n).sum().alias(name))
+    if len(aggs) == 0:
+        raise ValueError('No statistics requested')
+    return segment_agg(distribution, *aggs)
+
+
+# 矩
+
+# 计算幂和的列，存在于数据中时一并计算；带符号的列另外计算正、负部分的一、二阶幂和
+MOMENT_COLUMNS = ('bar_ret', 'volume_share')
+SIGNED_MOMENT_COLUMNS = ('bar_ret',)
+
+
+def power_sums(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    """
+    每个code、date在一次聚合中计算MOMENT_COLUMNS中存在的列的幂和：
+    {列}_n为非空值个数，{列}_s1至{列}_s4为一至四次幂之和；
+    SIGNED_MOMENT_COLUMNS中的列另有{列}_up_*与{列}_down_*，为正值、负值部分的个数与一、二次幂之和。
+    标准差、偏度、峰度由moment_std、moment_skew、moment_kurt从幂和导出。
+    引擎以LazyFrame同时计算多个矩类因子时，相同的聚合子图由collect_all合并，每日只执行一次
+    :param df: 分钟频数据
+    :return: 包含code/date与幂和列的结果
+    """
+    names = df.collect_schema().names()
+    columns = tuple(column for column in MOMENT_COLUMNS if column in names)
+    if len(columns) == 0:
+        raise ValueError(f'None of {MOMENT_COLUMNS} found in data')
+    aggs = []
+    for column in columns:
+        x = pl.col(column)
+        aggs.append(x.count().alias(f'{column}_n'))
+        aggs.extend(x.pow(power).sum().alias(f'{column}_s{power}') for power in range(1, 5))
+        if column in SIGNED_MOMENT_COLUMNS:
+            for side, condition in (('up', x > 0), ('down', x < 0)):
+                part = x.filter(condition)
+                aggs.append(part.count().alias(f'{column}_{side}_n'))
+                aggs.append(part.sum().alias(f'{column}_{side}_s1'))
+                aggs.append(part.pow(2).sum().alias(f'{column}_{side}_s2'))
+    return segment_agg(df, *aggs)
+
+
+def _central_moment_2(prefix: str) -> pl.Expr:
+    """
+    二阶中心矩（有偏）；相对二阶原点矩小于1e-12时视为0，避免常数序列上幂和相减的舍入误差
+    """
+    n = pl.col(f'{prefix}_n')
+    mean = pl.col(f'{prefix}_s1') / n
+    raw_2 = pl.col(f'{prefix}_s2') / n
+    m2 = raw_2 - mean.pow(2)
+    return pl.when(m2 > raw_2 * 1e-12).then(m2).otherwise(0.0)
+
+
+def moment_std(prefix: str) -> pl.Expr:
+    """
+    由幂和导出的样本标准差（ddof=1），个数不足2时为空，与Expr.std()一致
+    :param prefix: 幂和列的前缀，如'bar_ret'、'bar_ret_up'
+    :return:
+    """
+    n = pl.col(f'{prefix}_n')
+    return pl.when(n > 1).then((_central_moment_2(prefix) * n / (n - 1)).sqrt())
+
+
+def moment_skew(prefix: str) -> pl.Expr:
+    """
+    由幂和导出的偏度（有偏），与Expr.skew()一致，方差为0时为NaN
+    :param prefix: 幂和列的前缀
+    :return:
+    """
+    n = pl.col(f'{prefix}_n')
+    mean = pl.col(f'{prefix}_s1') / n
+    m2 = _central_moment_2(prefix)
+    m3 = (
+        pl.col(f'{prefix}_s3') / n
+        - 3 * mean * pl.col(f'{prefix}_s2') / n
+        + 2 * mean.pow(3)
+    )
+    return pl.when(m2 > 0).then(m3 / m2.pow(1.5)).otherwise(float('nan'))
+
+
+def moment_kurt(prefix: str) -> pl.Expr:
+    """
+    由幂和导出的超额峰度（Fisher定义，有偏），与Expr.kurtosis()一致，方差为0时为NaN
+    :param prefix: 幂和列的前缀
+    :return:
+    """
+    n = pl.col(f'{prefix}_n')
+    mean = pl.col(f'{prefix}_s1') / n
+    m2 = _central_moment_2(prefix)
+    m4 = (
+        pl.col(f'{prefix}_s4') / n
+        - 4 * mean * pl.col(f'{prefix}_s3') / n
+        + 6 * mean.pow(2) * pl.col(f'{prefix}_s2') / n
+        - 3 * mean.pow(4)
+    )
+    return pl.when(m2 > 0).then(m4 / m2.pow(2) - 3).otherwise(float('nan'))
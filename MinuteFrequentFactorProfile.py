@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import pickle
+import datetime
+import polars as pl
+from contextlib import contextmanager, nullcontext
+
+try:
+    import psutil
+except ImportError:  # 未安装psutil时不记录内存
+    psutil = None
+
+"""
+    ========================
+        分钟频因子性能剖析
+    ========================
+"""
+
+# 计算流程的各阶段
+STAGES = ('read', 'intermediates', 'factor', 'transfer', 'parallel', 'concat')
+
+
+def profile_stage(report: 'ProfileReport', stage: str, file_name: str = None, factor_name: str = None):
+    """
+    report为None时不记录，代码块内写入的rows/bytes被丢弃
+    :param report: 剖析报告
+    :param stage: 阶段名
+    :param file_name: 文件名
+    :param factor_name: 因子名
+    """
+    if report is None:
+        return nullcontext({})
+    return report.stage(stage, file_name, factor_name)
+
+
+def _rss() -> int | None:
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class ProfileReport:
+    def __init__(self, capture_plans: bool = False):
+        """
+        因子计算的分阶段剖析报告，每条记录为一个文件、一个因子的一个阶段：
+        read：读取与解码parquet，bytes为文件大小；
+        intermediates：计算公共中间列，bytes为加入中间列后的数据大小；
+        factor：因子表达式的计算，bytes为结果大小；
+        transfer：结果在工作进程中的序列化（父进程反序列化耗时与之相近），bytes为序列化后的大小；
+        parallel：父进程等待全部任务的总耗时，包含进程启动与调度；
+        concat：父进程合并与排序各日结果，bytes为合并后的大小。
+        rss为阶段结束时所在进程的常驻内存，未安装psutil时为空
+        :param capture_plans: 是否记录每个因子的Polars查询计划（每个因子只记录第一个文件的）
+        """
+        self.capture_plans = capture_plans
+        self.records = []
+        self.plans = {}
+
+    @contextmanager
+    def stage(self, stage: str, file_name: str = None, factor_name: str = None):
+        """
+        记录一个阶段的耗时，代码块内可以向返回的记录写入rows/bytes
+        :param stage: 阶段名，为STAGES之一
+        :param file_name: 文件名
+        :param factor_name: 因子名，与因子无关的阶段为None
+        """
+        if stage not in STAGES:
+            raise ValueError(f'Unknown stage: {stage}')
+        record = {
+            'file_name': file_name,
+            'factor': factor_name,
+            'stage': stage,
+            'seconds': None,
+            'rows': None,
+            'bytes': None,
+            'rss': None,
+        }
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['rss'] = _rss()
+            self.records.append(record)
+
+    def capture_plan(self, factor_name: str, result):
+        """
+        记录因子的查询计划，只对LazyFrame有效
+        :param factor_name: 因子名
+        :param result: 因子计算方法的返回值
+        """
+        if self.capture_plans and factor_name not in self.plans and isinstance(result, pl.LazyFrame):
+            self.plans[factor_name] = result.explain()
+
+    def measure_transfer(self, file_name: str, results) -> None:
+        """
+        记录工作进程返回结果的序列化耗时与大小
+        :param file_name: 文件名
+        :param results: 返回给父进程的结果
+        """
+        with self.stage('transfer', file_name) as record:
+            record['bytes'] = len(pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL))
+            frames = results.values() if isinstance(results, dict) else [results]
+            record['rows'] = sum(frame.height for frame in frames if frame is not None)
+
+    def merge(self, other: 'ProfileReport'):
+        """
+        合并工作进程返回的报告
+        :param other: 工作进程的报告
+        """
+        self.records.extend(other.records)
+        for factor_name, plan in other.plans.items():
+            self.plans.setdefault(factor_name, plan)
+
+    def to_frame(self) -> pl.DataFrame:
+        """
+        全部记录
+        :return: 包含file_name/factor/stage/seconds/rows/bytes/rss的DataFrame
+        """
+        return pl.DataFrame(self.records, schema={
+            'file_name': pl.String,
+            'factor': pl.String,
+            'stage': pl.String,
+            'seconds': pl.Float64,
+            'rows': pl.Int64,
+            'bytes': pl.Int64,
+            'rss': pl.Int64,
+        })
+
+    def summary(self, by: list[str] = None) -> pl.DataFrame:
+        """
+        按阶段（及因子或文件）汇总
+        :param by: 汇总的分组列，默认为['stage', 'factor']
+        :return: 分组列与count/seconds/rows/bytes/peak_rss，按总耗时降序
+        """
+        if by is None:
+            by = ['stage', 'factor']
+        return (
+            self.to_frame()
+            .group_by(by)
+            .agg(
+                pl.len().alias('count'),
+                pl.col('seconds').sum(),
+                pl.col('rows').sum(),
+                pl.col('bytes').sum(),
+                pl.col('rss').max().alias('peak_rss'),
+            )
+            .sort('seconds', descending=True)
+        )
+
+    def dump(self, path: str):
+        """
+        保存报告：.parquet只保存记录，其他后缀保存为包含记录与查询计划的JSON
+        :param path: 保存路径
+        """
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith('.parquet'):
+            self.to_frame().write_parquet(path)
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'records': self.records,
+                'plans': self.plans,
+            }, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,211 @@
+import os
+import time
+import heapq
+import polars as pl
+from typing import Callable, Literal
+from joblib import Parallel, delayed, effective_n_jobs
+from tqdm import tqdm
+
+"""
+    ========================
+        分钟频文件任务调度
+    ========================
+"""
+
+
+def _run_batch(function: Callable, batch: list[tuple[int, tuple]]) -> list[tuple[int, object]]:
+    """
+    在同一个工作进程中依次处理一批任务
+    :param function: 任务函数
+    :param batch: [(任务序号, 参数)]
+    :return: [(任务序号, 结果)]
+    """
+    return [(index, function(*args)) for index, args in batch]
+
+
+class FileScheduler:
+    def __init__(
+            self,
+            backend: Literal['loky', 'threading'] = 'loky',
+            batches_per_worker: int = 4,
+            show_progress: bool = True,
+            max_batch_size: int = None
+    ):
+        """
+        分钟频文件的批量调度：按文件大小将任务分为工作量均衡的批次，大批次先执行，
+        每个批次只派发一次，减少调度开销；进度条按任务完成（而非派发）更新，并显示吞吐量。
+        polars在进程内已多线程计算，文件多、每个文件计算量小时'threading'后端可以省去进程启动与结果传输，
+        文件计算量大时'loky'多进程后端更能利用全部核心
+        :param backend: joblib后端：'loky'多进程或'threading'多线程
+        :param batches_per_worker: 每个工作进程平均分得的批次数，越大负载越均衡、调度开销越大
+        :param show_progress: 是否显示进度条
+        :param max_batch_size: 每个批次的最大任务数；批次完成后结果才返回父进程，
+            保存检查点时较小的批次使中断时丢失的已完成任务更少
+        """
+        if backend not in ('loky', 'threading'):
+            raise ValueError(f'Unknown backend: {backend}')
+        if batches_per_worker < 1:
+            raise ValueError('batches_per_worker must be positive')
+        if max_batch_size is not None and max_batch_size < 1:
+            raise ValueError('max_batch_size must be positive')
+        self.backend = backend
+        self.batches_per_worker = batches_per_worker
+        self.show_progress = show_progress
+        self.max_batch_size = max_batch_size
+        self.last_run = None  # 最近一次执行的统计
+
+    def plan(self, weights: list[float], n_workers: int) -> list[list[int]]:
+        """
+        最长处理时间优先（LPT）分批：任务按工作量降序依次放入当前总量最小的批次，批次按总量降序排列
+        :param weights: 每个任务的工作量，如文件字节数
+        :param n_workers: 工作进程数
+        :return: 每个批次的任务序号
+        """
+        n_batches = min(len(weights), max(n_workers, 1) * self.batches_per_worker)
+        if self.max_batch_size is not None:
+            n_batches = max(n_batches, -(-len(weights) // self.max_batch_size))
+        if n_batches == 0:
+            return []
+        heap = [(0, b) for b in range(n_batches)]
+        batches = [[] for _ in range(n_batches)]
+        totals = [0] * n_batches
+        for index in sorted(range(len(weights)), key=lambda i: weights[i], reverse=True):
+            total, b = heapq.heappop(heap)
+            batches[b].append(index)
+            totals[b] = total + weights[index]
+            heapq.heappush(heap, (totals[b], b))
+        order = sorted(range(n_batches), key=lambda b: totals[b], reverse=True)
+        return [batches[b] for b in order if len(batches[b]) > 0]
+
+    def run(
+            self,
+            function: Callable,
+            tasks: list[tuple[tuple, int]],
+            n_jobs: int = -1,
+            desc: str = 'Processing',
+            weights: list[float] = None,
+            on_result: Callable[[int, object], None] = None
+    ) -> list:
+        """
+        执行全部任务，结果按任务顺序返回
+        :param function: 任务函数，需要可以被序列化到工作进程
+        :param tasks: [(参数元组, 文件字节数)]，字节数用于统计吞吐量
+        :param n_jobs: 并行数，-1为全部核心
+        :param desc: 进度条描述
+        :param weights: 分批使用的工作量，默认为文件字节数
+        :param on_result: 每个任务完成时在父进程中调用on_result(任务序号, 结果)，如保存检查点
+        :return: 每个任务的结果
+        """
+        sizes = [size for _, size in tasks]
+        if weights is None:
+            weights = sizes
+        batches = self.plan(weights, effective_n_jobs(n_jobs))
+        results = [None] * len(tasks)
+        done_bytes = 0
+        start = time.perf_counter()
+        with tqdm(
+                total=len(tasks), desc=desc, unit='file', disable=not self.show_progress
+        ) as progress:
+            for batch_results in Parallel(
+                    n_jobs=n_jobs, backend=self.backend, return_as='generator_unordered'
+            )(
+                delayed(_run_batch)(function, [(index, tasks[index][0]) for index in batch])
+                for batch in batches
+            ):
+                for index, result in batch_results:
+                    results[index] = result
+                    done_bytes += sizes[index]
+                    if on_result is not None:
+                        on_result(index, result)
+                progress.update(len(batch_results))
+                elapsed = time.perf_counter() - start
+                if elapsed > 0:
+                    progress.set_postfix(MB_s=f'{done_bytes / 1024 ** 2 / elapsed:.1f}')
+        seconds = time.perf_counter() - start
+        self.last_run = {
+            'tasks': len(tasks),
+            'batches': len(batches),
+            'bytes': sum(sizes),
+            'seconds': seconds,
+            'tasks_per_sec': len(tasks) / seconds if seconds > 0 else None,
+            'mb_per_sec': sum(sizes) / 1024 ** 2 / seconds if seconds > 0 else None,
+        }
+        return results
+
+
+class MemoryBudget:
+    def __init__(
+            self,
+            limit_gb: float = 32,
+            chunk: Literal['month', 'year'] = 'month',
+            reserve_gb: float = 8,
+            working_set_ratio: float = 6
+    ):
+        """
+        全历史回补的内存预算：按单日数据的内存估计限制同时运行的工作进程数，
+        并按月（或年）分块计算，每块结果写入存储或磁盘后释放，父进程不再同时持有全部日期的结果
+        :param limit_gb: 内存上限（GB）
+        :param chunk: 分块方式：'month'按月，'year'按年
+        :param reserve_gb: 为父进程（已有因子暴露、分块结果与最终合并）预留的内存（GB）
+        :param working_set_ratio: 工作进程峰值内存与单日数据解码后大小之比，
+            包括中间列、分组聚合的临时数据与Polars线程池，5000只股票、全部因子约为6
+        """
+        if chunk not in ('month', 'year'):
+            raise ValueError(f'Unknown chunk: {chunk}')
+        if limit_gb <= reserve_gb:
+            raise ValueError('limit_gb must be larger than reserve_gb')
+        self.limit_gb = limit_gb
+        self.chunk = chunk
+        self.reserve_gb = reserve_gb
+        self.working_set_ratio = working_set_ratio
+
+    def estimate_worker_bytes(self, file_paths: list[str], sample: int = 3) -> int:
+        """
+        估计单个工作进程的峰值内存：取最大的几个文件，以行数×列数×8字节估计解码后的大小
+        :param file_paths: 分钟频文件路径
+        :param sample: 读取元数据的文件数
+        :return: 字节数
+        """
+        largest = sorted(file_paths, key=os.path.getsize, reverse=True)[:sample]
+        decoded = max(
+            (
+                pl.scan_parquet(path).select(pl.len()).collect().item()
+                * len(pl.read_parquet_schema(path)) * 8
+                for path in largest
+            ),
+            default=0
+        )
+        return int(decoded * self.working_set_ratio)
+
+    def n_workers(self, n_jobs: int, file_paths: list[str]) -> int:
+        """
+        内存预算允许的并行数，不超过n_jobs对应的核心数
+        :param n_jobs: 并行数，-1为全部核心
+        :param file_paths: 需要计算的分钟频文件路径
+        :return:
+        """
+        worker_bytes = self.estimate_worker_bytes(file_paths)
+        n_jobs = effective_n_jobs(n_jobs)
+        if worker_bytes == 0:
+            return n_jobs
+        available = (self.limit_gb - self.reserve_gb) * 1024 ** 3
+        return max(1, min(n_jobs, int(available // worker_bytes)))
+
+    def chunk_key(self, file_name: str) -> str:
+        """
+        文件所属的分块，文件名前8位为日期
+        :param file_name: 分钟频文件名
+        :return: 'YYYYMM'或'YYYY'
+        """
+        return file_name[:6] if self.chunk == 'month' else file_name[:4]
+
+    def split(self, file_names: list[str]) -> dict[str, list[str]]:
+        """
+        按日期分块，分块按时间顺序排列
+        :param file_names: 分钟频文件名
+        :return: 分块到文件名的映射
+        """
+        chunks = {}
+        for file_name in sorted(file_names):
+            chunks.setdefault(self.chunk_key(file_name), []).append(file_name)
+        return chunks
@@ -0,0 +1,488 @@
+import datetime
+import numpy as np
+import polars as pl
+
+"""
+    ========================
+        分钟频因子流式计算
+    ========================
+"""
+
+
+def _minute_in_trade(time: np.ndarray) -> np.ndarray:
+    """
+    交易分钟序号，与中间列minute_in_trade一致，11:30的处理见_minute_in_trade_expr
+    :param time: HHMMSSmmm格式的时间
+    :return:
+    """
+    minutes = time // 10000000 * 60 + time % 10000000 // 100000
+    return np.where(minutes < 720, minutes - 570, minutes - 660)
+
+
+class _PowerSums:
+    def __init__(self, n_codes: int):
+        """
+        按股票保存的一至四阶幂和，以每只股票第一个观测值为参照平移，减小大数相减的误差
+        :param n_codes: 股票数量
+        """
+        self.n = np.zeros(n_codes, dtype=np.int64)
+        self.ref = np.zeros(n_codes)
+        self.s = np.zeros((4, n_codes))
+
+    def add(self, idx: np.ndarray, x: np.ndarray):
+        first = self.n[idx] == 0
+        self.ref[idx[first]] = x[first]
+        d = x - self.ref[idx]
+        d2 = d * d
+        self.s[0, idx] += d
+        self.s[1, idx] += d2
+        self.s[2, idx] += d2 * d
+        self.s[3, idx] += d2 * d2
+        self.n[idx] += 1
+
+    def moments(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        与polars一致：标准差ddof=1，偏度与峰度为有偏估计，峰度为超额峰度
+        :return: (标准差, 偏度, 峰度)，无法计算时为NaN
+        """
+        n = self.n.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.s[0] / n
+            e2, e3, e4 = self.s[1] / n, self.s[2] / n, self.s[3] / n
+            m2 = np.clip(e2 - mean ** 2, 0, None)
+            m3 = e3 - 3 * mean * e2 + 2 * mean ** 3
+            m4 = e4 - 4 * mean * e3 + 6 * mean ** 2 * e2 - 3 * mean ** 4
+            std = np.where(n >= 2, np.sqrt(m2 * n / (n - 1)), np.nan)
+            skew = m3 / m2 ** 1.5
+            kurt = m4 / m2 ** 2 - 3
+        return std, skew, kurt
+
+
+class StreamingAccumulator:
+    """
+    流式累加器基类：状态为按股票序号排列的numpy数组，每根k线的更新为O(1)，
+    同一分钟全部股票的k线向量化更新，任意时刻可以输出当前的因子值
+    """
+    factor_names: tuple[str, ...] = ()
+    required_columns: tuple[str, ...] = ()
+
+    def __init__(self, n_codes: int):
+        self.n_codes = n_codes
+
+    def update(self, idx: np.ndarray, bars: dict[str, np.ndarray]):
+        """
+        更新一分钟的k线
+        :param idx: 股票序号，同一次更新中不重复
+        :param bars: 列名到数组的映射，与idx一一对应
+        """
+        raise NotImplementedError
+
+    def values(self) -> dict[str, np.ndarray]:
+        """
+        当前的因子值
+        :return: 因子名到按股票序号排列的数组的映射
+        """
+        raise NotImplementedError
+
+
+class ReturnMomentAccumulator(StreamingAccumulator):
+    """分钟收益率的标准差、上下行波动率与偏度峰度"""
+    factor_names = (
+        'vol_return1min', 'vol_upVol', 'vol_upRatio', 'vol_downVol', 'vol_downRatio',
+        'shape_skew', 'shape_kurt', 'shape_skratio'
+    )
+    required_columns = ('open', 'close')
+
+    def __init__(self, n_codes: int):
+        super().__init__(n_codes)
+        self.all = _PowerSums(n_codes)
+        self.up = _PowerSums(n_codes)
+        self.down = _PowerSums(n_codes)
+
+    def update(self, idx, bars):
+        ret = bars['close'] / bars['open'] - 1
+        self.all.add(idx, ret)
+        up = ret > 0
+        self.up.add(idx[up], ret[up])
+        down = ret < 0
+        self.down.add(idx[down], ret[down])
+
+    def values(self):
+        std, skew, kurt = self.all.moments()
+        up_vol = np.nan_to_num(self.up.moments()[0], nan=0.0)  # 不足两个观测值时为0
+        down_vol = np.nan_to_num(self.down.moments()[0], nan=0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'vol_return1min': std,
+                'vol_upVol': up_vol,
+                'vol_upRatio': up_vol / std,
+                'vol_downVol': down_vol,
+                'vol_downRatio': down_vol / std,
+                'shape_skew': skew,
+                'shape_kurt': kurt,
+                'shape_skratio': skew / kurt,
+            }
+
+
+class VolumeMomentAccumulator(StreamingAccumulator):
+    """
+    分钟成交量的标准差与成交量占比的偏度峰度。
+    偏度峰度与尺度无关，成交量占比的偏度峰度等于成交量本身的偏度峰度，无需等到收盘得到全天成交量
+    """
+    factor_names = ('vol_volume1min', 'shape_skewVol', 'shape_kurtVol', 'shape_skratioVol')
+    required_columns = ('volume',)
+
+    def __init__(self, n_codes: int):
+        super().__init__(n_codes)
+        self.volume = _PowerSums(n_codes)
+
+    def update(self, idx, bars):
+        self.volume.add(idx, bars['volume'])
+
+    def values(self):
+        std, skew, kurt = self.volume.moments()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'vol_volume1min': std,
+                'shape_skewVol': skew,
+                'shape_kurtVol': kurt,
+                'shape_skratioVol': skew / kurt,
+            }
+
+
+class SessionVolumeAccumulator(StreamingAccumulator):
+    """开盘、尾盘与集合竞价的成交量及其占比"""
+    factor_names = (
+        'trade_headRatio', 'trade_tailRatio', 'liq_openvol', 'liq_firstCallR',
+        'liq_closevol', 'liq_closeprevol', 'liq_lastCallR'
+    )
+    required_columns = ('time', 'volume')
+
+    def __init__(self, n_codes: int):
+        super().__init__(n_codes)
+        self.n = np.zeros(n_codes, dtype=np.int64)
+        self.first_volume = np.full(n_codes, np.nan)
+        self.first_time = np.zeros(n_codes, dtype=np.int64)
+        self.total = np.zeros(n_codes)
+        self.head = np.zeros(n_codes)
+        self.tail = np.zeros(n_codes)
+        self.close = np.zeros(n_codes)
+        self.n_close = np.zeros(n_codes, dtype=np.int64)
+        self.pre_close = np.zeros(n_codes)
+        self.n_pre_close = np.zeros(n_codes, dtype=np.int64)
+
+    def update(self, idx, bars):
+        time, volume = bars['time'], bars['volume']
+        first = self.n[idx] == 0
+        self.first_volume[idx[first]] = volume[first]
+        self.first_time[idx[first]] = time[first]
+        self.n[idx] += 1
+        self.total[idx] += volume
+        self.head[idx] += np.where(time <= 100000000, volume, 0)
+        self.tail[idx] += np.where(time >= 143000000, volume, 0)
+        close = time >= 145700000
+        self.close[idx] += np.where(close, volume, 0)
+        self.n_close[idx] += close
+        self.pre_close[idx] += np.where(close, 0, volume)
+        self.n_pre_close[idx] += ~close
+
+    def values(self):
+        positive = self.total > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'trade_headRatio': np.where(positive, self.head / self.total, 0.125),
+                'trade_tailRatio': np.where(positive, self.tail / self.total, 0.125),
+                'liq_openvol': np.where(self.first_time <= 93000000, self.first_volume, np.nan),
+                'liq_firstCallR': self.first_volume / self.total,
+                'liq_closevol': np.where(self.n_close > 0, self.close, np.nan),
+                'liq_closeprevol': np.where(self.n_pre_close > 0, self.pre_close, np.nan),
+                'liq_lastCallR': self.close / self.total,
+            }
+
+
+class RollingOLSAccumulator(StreamingAccumulator):
+    """
+    分钟qrs及其衍生因子：最低价对最高价的滚动回归。
+    窗口为交易分钟序号在(t-window, t]内的全部k线，包含至少window根k线时有效，与rolling_ols一致；
+    环形缓冲区保存窗口内的k线，窗口和随新k线加入、旧k线移出增量更新。
+    序号相同的k线共用一个窗口，后一根到达时撤回前一根已计入的窗口，再按k线数计入新窗口。
+    各窗口的beta与相关系数再在线汇总为日内均值、标准差与最新值
+    """
+    factor_names = (
+        'mmt_ols_qrs', 'mmt_ols_beta_mean', 'mmt_ols_corr_mean',
+        'mmt_ols_corr_square_mean', 'mmt_ols_beta_zscore_last'
+    )
+    required_columns = ('time', 'high', 'low')
+
+    def __init__(self, n_codes: int, window: int = 50):
+        super().__init__(n_codes)
+        self.window = window
+        self.capacity = 2 * window  # 窗口内的k线数不超过window加上重复序号的个数
+        self.n_seen = np.zeros(n_codes, dtype=np.int64)
+        self.last_minute = np.zeros(n_codes, dtype=np.int64)
+        self.ref_x = np.zeros(n_codes)
+        self.ref_y = np.zeros(n_codes)
+        self.last_x = np.zeros(n_codes)
+        self.last_y = np.zeros(n_codes)
+        # 窗口状态：已加入与已移出的k线数
+        self.count = np.zeros(n_codes, dtype=np.int64)
+        self.start = np.zeros(n_codes, dtype=np.int64)
+        self.buffer = np.zeros((5, n_codes, self.capacity))  # dx/dy/x是否变化/y是否变化/分钟序号
+        self.sums = np.zeros((5, n_codes))  # dx/dy/dx²/dy²/dxdy
+        self.changes = np.zeros((2, n_codes))
+        # 最新分钟序号上已计入的窗口：k线数与窗口的beta、相关系数
+        self.n_pending = np.zeros(n_codes, dtype=np.int64)
+        self.pending_beta = np.full(n_codes, np.nan)
+        self.pending_corr = np.full(n_codes, np.nan)
+        # 有效窗口的日内汇总
+        self.n_beta = np.zeros(n_codes, dtype=np.int64)
+        self.beta_mean = np.zeros(n_codes)
+        self.beta_m2 = np.zeros(n_codes)
+        self.beta_last = np.full(n_codes, np.nan)
+        self.n_corr = np.zeros(n_codes, dtype=np.int64)
+        self.corr_sum = np.zeros(n_codes)
+        self.corr_square_sum = np.zeros(n_codes)
+
+    def _push(self, idx, values):
+        slot = self.count[idx] % self.capacity
+        self.buffer[:, idx, slot] = values
+        dx, dy = values[0], values[1]
+        self.sums[:, idx] += np.stack([dx, dy, dx ** 2, dy ** 2, dx * dy])
+        self.changes[:, idx] += values[2:4]
+        self.count[idx] += 1
+
+    def _pop(self, idx):
+        old = self.buffer[:, idx, self.start[idx] % self.capacity]
+        dx, dy = old[0], old[1]
+        self.sums[:, idx] -= np.stack([dx, dy, dx ** 2, dy ** 2, dx * dy])
+        self.changes[:, idx] -= old[2:4]
+        self.start[idx] += 1
+
+    def _record(self, idx, beta, corr, sign):
+        """计入（sign=1）或撤回（sign=-1）一个窗口，Welford算法更新beta的均值与离差平方和"""
+        n_beta = self.n_beta[idx] + sign
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if sign > 0:
+                delta = beta - self.beta_mean[idx]
+                mean = self.beta_mean[idx] + delta / n_beta
+                m2 = self.beta_m2[idx] + delta * (beta - mean)
+            else:
+                mean = np.where(n_beta > 0, (self.beta_mean[idx] * (n_beta + 1) - beta) / n_beta, 0.0)
+                m2 = np.where(n_beta > 0, self.beta_m2[idx] - (beta - mean) * (beta - self.beta_mean[idx]), 0.0)
+        self.beta_mean[idx] = mean
+        self.beta_m2[idx] = m2
+        self.n_beta[idx] = n_beta
+        has_corr = ~np.isnan(corr)
+        self.n_corr[idx] += sign * has_corr
+        self.corr_sum[idx] += sign * np.where(has_corr, corr, 0)
+        self.corr_square_sum[idx] += sign * np.where(has_corr, corr ** 2, 0)
+
+    def update(self, idx, bars):
+        w = self.window
+        x, y = bars['low'], bars['high']
+        minute = _minute_in_trade(bars['time'])
+
+        first = self.n_seen[idx] == 0
+        self.ref_x[idx[first]] = x[first]
+        self.ref_y[idx[first]] = y[first]
+        repeated = ~first & (minute == self.last_minute[idx])
+        full = self.count[idx] - self.start[idx] >= self.capacity
+        if full.any():  # 重复序号过多时丢弃最早的k线
+            self._pop(idx[full])
+        self._push(idx, np.stack([
+            x - self.ref_x[idx],
+            y - self.ref_y[idx],
+            np.where(first, 0.0, x != self.last_x[idx]),
+            np.where(first, 0.0, y != self.last_y[idx]),
+            minute,
+        ]))
+        # 移出序号不在(t-window, t]内的k线
+        while True:
+            start = self.start[idx]
+            expired = (start < self.count[idx]) & (
+                self.buffer[4, idx, start % self.capacity] <= minute - w
+            )
+            if not expired.any():
+                break
+            self._pop(idx[expired])
+        self.n_seen[idx] += 1
+        self.last_minute[idx] = minute
+        self.last_x[idx] = x
+        self.last_y[idx] = y
+
+        # 撤回同一序号上已计入的窗口，新窗口按该序号上的k线数计入
+        n_pending = self.n_pending[idx]
+        retract = repeated & ~np.isnan(self.pending_beta[idx])
+        for copy in range(int(n_pending[retract].max(initial=0))):
+            rows = idx[retract & (n_pending > copy)]
+            self._record(rows, self.pending_beta[rows], self.pending_corr[rows], -1)
+        n_pending = np.where(repeated, n_pending + 1, 1)
+        self.n_pending[idx] = n_pending
+
+        n = self.count[idx] - self.start[idx]
+        valid = n >= w
+        self.pending_beta[idx[~valid]] = np.nan
+        if not valid.any():
+            return
+        idx, n, n_pending = idx[valid], n[valid], n_pending[valid]
+        # 窗口内的价格变化次数不计最早一根k线相对窗口外的变化
+        oldest = self.start[idx] % self.capacity
+        const_x = self.changes[0, idx] - self.buffer[2, idx, oldest] == 0
+        const_y = self.changes[1, idx] - self.buffer[3, idx, oldest] == 0
+        mx, my, mxx, myy, mxy = self.sums[:, idx] / n
+        var_x = np.where(const_x, 0.0, np.clip(mxx - mx ** 2, 0, None))
+        var_y = np.where(const_y, 0.0, np.clip(myy - my ** 2, 0, None))
+        cov = np.where(const_x | const_y, 0.0, mxy - mx * my)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            beta = np.where(
+                var_x != 0,
+                cov / var_x,
+                (my + self.ref_y[idx]) / (mx + self.ref_x[idx])
+            )
+            corr = np.where(var_x * var_y != 0, cov / np.sqrt(var_x * var_y), np.nan)
+        self.pending_beta[idx] = beta
+        self.pending_corr[idx] = corr
+        self.beta_last[idx] = beta
+        for copy in range(int(n_pending.max(initial=0))):
+            rows = n_pending > copy
+            self._record(idx[rows], beta[rows], corr[rows], 1)
+
+    def values(self):
+        has_beta = self.n_beta > 0
+        has_corr = self.n_corr > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            beta_mean = np.where(has_beta, self.beta_mean, np.nan)
+            beta_std = np.where(self.n_beta >= 2, np.sqrt(self.beta_m2 / (self.n_beta - 1)), np.nan)
+            zscore = (self.beta_last - beta_mean) / beta_std
+            corr_mean = np.where(has_corr, self.corr_sum / self.n_corr, 0.0)
+            corr_square_mean = np.where(has_corr, self.corr_square_sum / self.n_corr, 0.0)
+            qrs = np.where(has_corr & (beta_std != 0), corr_square_mean * zscore, 0.0)
+            # 没有有效窗口的股票无因子值
+            return {
+                'mmt_ols_qrs': np.where(has_beta, np.nan_to_num(qrs, nan=0.0), np.nan),
+                'mmt_ols_beta_mean': beta_mean,
+                'mmt_ols_corr_mean': np.where(has_beta, corr_mean, np.nan),
+                'mmt_ols_corr_square_mean': np.where(has_beta, corr_square_mean, np.nan),
+                'mmt_ols_beta_zscore_last': np.where(beta_std > 0, zscore, beta_mean),
+            }
+
+
+STREAMING_ACCUMULATORS = (
+    ReturnMomentAccumulator,
+    VolumeMomentAccumulator,
+    SessionVolumeAccumulator,
+    RollingOLSAccumulator,
+)
+
+
+class StreamingFactorEngine:
+    def __init__(
+            self,
+            codes: list[str] | pl.Series,
+            accumulators: list[type[StreamingAccumulator]] = None,
+            date: datetime.date = None
+    ):
+        """
+        分钟频因子流式计算引擎：盘中每收到一分钟k线即更新各股票的在线状态，
+        任意时刻输出截至当前的因子值，收盘时的结果与按整日文件批量计算的结果一致
+        :param codes: 股票代码，不在其中的股票的k线被忽略
+        :param accumulators: 累加器类型，默认为STREAMING_ACCUMULATORS中的全部累加器
+        :param date: 交易日，默认取第一次更新的k线中的date列
+        """
+        self.codes = pl.Series('code', codes, dtype=pl.String)
+        self._code_ordinal = dict(zip(self.codes.to_list(), range(len(self.codes))))
+        if accumulators is None:
+            accumulators = STREAMING_ACCUMULATORS
+        self._accumulator_types = list(accumulators)
+        self.required_columns = list(dict.fromkeys(
+            column for accumulator in self._accumulator_types
+            for column in accumulator.required_columns
+        ))
+        self.reset(date)
+
+    def reset(self, date: datetime.date = None):
+        """
+        清空全部状态，开始新的交易日
+        :param date: 交易日
+        """
+        self.date = date
+        self.accumulators = [
+            accumulator(len(self.codes)) for accumulator in self._accumulator_types
+        ]
+        self.n_bars = np.zeros(len(self.codes), dtype=np.int64)
+
+    @property
+    def factor_names(self) -> list[str]:
+        return [
+            name for accumulator in self.accumulators
+            for name in accumulator.factor_names
+        ]
+
+    def update(self, bars: pl.DataFrame):
+        """
+        输入新的分钟k线，可以包含多只股票、多个分钟，按time顺序更新
+        :param bars: 包含code/time与累加器所需列的DataFrame，同一股票同一分钟只能有一根k线
+        """
+        if self.date is None and 'date' in bars.columns and bars.height > 0:
+            self.date = bars['date'][0]
+        bars = (
+            bars.select(
+                pl.col('code')
+                .cast(pl.String)  # 输入的code可以为共享代码字典的Enum
+                .replace_strict(self._code_ordinal, default=None, return_dtype=pl.Int64)
+                .alias('code_ordinal'),
+                *self.required_columns
+            )
+            .drop_nulls('code_ordinal')
+            .sort('time', maintain_order=True)
+        )
+        time = bars['time'].to_numpy()
+        # 每个分钟的起始位置
+        bounds = np.flatnonzero(np.diff(time)) + 1
+        bounds = np.concatenate([[0], bounds, [len(time)]])
+        columns = {
+            column: bars[column].to_numpy().astype(
+                np.int64 if column == 'time' else np.float64
+            )
+            for column in self.required_columns
+        }
+        code_ordinal = bars['code_ordinal'].to_numpy()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            idx = code_ordinal[start:end]
+            minute_bars = {column: values[start:end] for column, values in columns.items()}
+            for accumulator in self.accumulators:
+                accumulator.update(idx, minute_bars)
+            self.n_bars[idx] += 1
+
+    def snapshot(self) -> pl.DataFrame:
+        """
+        截至当前的因子值，只包含已收到k线的股票；无法计算的因子值为NaN
+        :return: 包含code/date/各因子列的DataFrame
+        """
+        values = {}
+        for accumulator in self.accumulators:
+            values.update(accumulator.values())
+        seen = self.n_bars > 0
+        return pl.DataFrame({
+            'code': self.codes.filter(pl.Series(seen)),
+            'date': pl.Series([self.date] * int(seen.sum()), dtype=pl.Date),
+            **{name: values[name][seen] for name in self.factor_names},
+        })
+
+    @classmethod
+    def replay(
+            cls,
+            min_data: pl.DataFrame,
+            accumulators: list[type[StreamingAccumulator]] = None
+    ) -> pl.DataFrame:
+        """
+        将一个交易日的分钟频数据逐分钟输入引擎，返回收盘时的因子值，用于与批量计算结果核对
+        :param min_data: 单日分钟频数据
+        :param accumulators: 累加器类型
+        :return:
+        """
+        engine = cls(min_data['code'].unique().sort(), accumulators)
+        engine.update(min_data)
+        return engine.snapshot()